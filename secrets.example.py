@@ -5,10 +5,24 @@ PREFECTS = ["your_slack_id_here", "someone_elses_here"]
 # A channel id to post to
 CHANNEL = u'some_slack_channel_id'
 ADMIN_CHANNEL = u'some_slack_channel_id'
-# A channel for getting prefects ID (only works in non-locked channels)
+# No longer used: prefect ids are looked up with users.list
 PUBLIC_CHANNEL = 'some_public_slack_channel_id'
+# Signing secret of the Slack app, to check Events API callbacks with
+# (see USE_EVENTS_API in consts.py)
+SLACK_SIGNING_SECRET = 'your_signing_secret_here'
 # Bot's user id
 BOT_ID = 'Bot_user_id'
 # Bucket name
 BUCKET_NAME = "xxx"
 POINTS_FILE = 'xxx'
+
+# Optional: run several tournaments at once. Each one takes the arguments
+# of tournaments.Tournament; anything left out comes from the settings above.
+# TOURNAMENTS = [
+#     {"name": "hackathon", "channel": "C1", "admin_channel": "C2",
+#      "points_file": "hogwarts_bot/Hackathon.json"},
+#     {"name": "book-club", "channel": "C3", "admin_channel": "C4",
+#      "points_file": "hogwarts_bot/BookClub.json",
+#      "houses": ["Gryffindor", "Slytherin"], "max_points": 300,
+#      "prefects": ["someone"]},
+# ]
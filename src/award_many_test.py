@@ -0,0 +1,124 @@
+"""
+Test that awarding a batch of messages matches awarding them one at a time
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from consts import ADMIN_CHANNEL, CHANNEL, HOUSES, MAX_POINTS
+from ledger import PointsLedger
+from main import PointCounter
+import metrics
+
+TEST_PREFECTS = ["prefect"]
+SUBJECTS = ["Dumbledore", "Filch"]
+
+
+def random_message(rnd, n):
+    """An award, deduction or "says" message, big enough to be clamped"""
+    houses = rnd.sample(HOUSES, rnd.choice([1, 1, 1, 2]))
+    amount = rnd.choice([1, 5, 50, MAX_POINTS // 2, MAX_POINTS])
+    if rnd.random() < 0.4:
+        text = "%d points from %s" % (amount, " and ".join(houses))
+    else:
+        text = "%d points to %s" % (amount, " and ".join(houses))
+    if rnd.random() < 0.2:
+        text = "%s says %s" % (rnd.choice(SUBJECTS), text)
+    if rnd.random() < 0.2:
+        text += " for being kind"
+    return {"type": "message", "text": text,
+            "user": rnd.choice(TEST_PREFECTS + ["U1", "U2"]),
+            "channel": rnd.choice([CHANNEL, CHANNEL, ADMIN_CHANNEL]),
+            "ts": "%d.000000" % (1583107200 + n)}
+
+
+def clamps():
+    return metrics.CLAMPS.value(limit="max") + \
+        metrics.CLAMPS.value(limit="zero")
+
+
+class TestAwardMany(unittest.TestCase):
+
+    def setUp(self):
+        self.directories = [tempfile.mkdtemp(), tempfile.mkdtemp()]
+
+    def tearDown(self):
+        for directory in self.directories:
+            shutil.rmtree(directory)
+
+    def counter(self, directory):
+        p = PointCounter(TEST_PREFECTS, reset=True,
+                         ledger=PointsLedger(directory))
+        p.store = None
+        return p
+
+    def ledger_events(self, directory):
+        with open(os.path.join(directory, "ledger.jsonl")) as f:
+            return [{k: v for k, v in json.loads(line).items()
+                     if k != "time"} for line in f]
+
+    def test_matches_award_points(self):
+        rnd = random.Random(0)
+        one, many = [self.counter(d) for d in self.directories]
+        n = 0
+        for _ in range(200):
+            batch = []
+            for _ in range(rnd.randint(0, 40)):
+                n += 1
+                batch.append(random_message(rnd, n))
+
+            before = clamps()
+            expected = [one.award_points(m["text"], m["user"],
+                                         channel=m["channel"], ts=m["ts"])
+                        for m in batch]
+            between = clamps()
+            summary, attributions = many.award_many(batch)
+            self.assertEqual(attributions, expected)
+            self.assertEqual(clamps() - between, between - before)
+
+            self.assertEqual(many.points, one.points)
+            self.assertEqual(many.deltas, one.deltas)
+            self.assertEqual(many.dirty_awards, one.dirty_awards)
+            # The awards queued for the store, apart from when they were made
+            self.assertEqual([a[1:] for a in many.awards],
+                             [a[1:] for a in one.awards])
+            self.assertEqual(many.index.standings(), one.index.standings())
+            self.assertEqual(many.index.awarders, one.index.awarders)
+            for house, house_summary in summary.items():
+                self.assertEqual(house_summary["points"], one.points[house])
+
+        one.ledger.sync()
+        many.ledger.sync()
+        self.assertEqual(self.ledger_events(self.directories[1]),
+                         self.ledger_events(self.directories[0]))
+        self.assertEqual(PointsLedger(self.directories[1]).load(),
+                         one.points)
+        now = 1583107200 + n
+        for period in ("day", "week"):
+            for house in HOUSES:
+                self.assertEqual(many.index.history(house, period, now),
+                                 one.index.history(house, period, now))
+
+    def test_summary(self):
+        p = self.counter(self.directories[0])
+        p.points["Gryffindor"] = MAX_POINTS - 5
+        summary, attributions = p.award_many([
+            {"text": "10 points to Gryffindor", "user": "prefect"},
+            {"text": "10 points from Gryffindor", "user": "prefect"},
+            {"text": "hello", "user": "prefect"},
+            {"text": "3 points to Slytherin", "user": "prefect"},
+        ])
+        self.assertEqual(summary["Gryffindor"], {
+            "points": MAX_POINTS - 10, "delta": -5, "awards": 2,
+            "clamped": -5})
+        self.assertEqual(summary["Slytherin"]["points"], 3)
+        self.assertEqual(len(attributions[0]), 2)
+        self.assertEqual(attributions[2], [])
+        self.assertEqual(p.dirty_awards, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
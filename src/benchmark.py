@@ -0,0 +1,750 @@
+"""
+Performance benchmarks for the bot's hot paths
+
+Run from the `src` directory:
+
+    python benchmark.py
+    python benchmark.py --json results.json --compare previous.json
+"""
+import argparse
+import asyncio
+import contextlib
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import mock
+
+from consts import (
+    ADMIN_CHANNEL, CHANNEL, EVENTS_PATH, FLUSH_AWARDS, HOUSES,
+    LOG_EVENT_SAMPLE
+)
+from cup_image import (
+    ENCODINGS, CupRenderer, calculate_scales, image_for_scores
+)
+from events_api import EventsServer, signature
+from fakes import FakeBucket, FakeSlackClient
+from image_test import CASES, scores_for
+import logs
+import metrics
+import points_util
+from main import (
+    BotRuntime, PointCounter, announcement_for, is_hogwarts_related,
+    start_tournaments, upload_scores_image
+)
+from outbox import Outbox
+from persistence import PointsWriter
+from prefects import PrefectResolver
+from replay import ReplayRenderer
+from replay_test import season
+import standings
+from standings import StandingsIndex
+from storage import BucketStore, SqliteStore
+from tournaments import DEFAULT_NAME, Tournament, TournamentRegistry
+from traffic import TrafficGenerator
+
+
+def timed(fn, repeat):
+    """Average seconds per call of `fn` over `repeat` calls"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_render(repeat=5):
+    """Per-render latency for each image_test.py case
+
+    cold:   a fresh renderer per call, which is what every render cost before
+            assets were preloaded
+    warm:   a shared renderer with the PNG cache disabled
+    cached: a shared renderer answering a standing it has already seen
+    """
+    warm = CupRenderer(cache_size=0)
+    cached = CupRenderer()
+    results = {}
+    for case in CASES:
+        scores = scores_for(case)
+        cached.png_for_scores(scores)
+        results[case] = {
+            "cold": timed(lambda: CupRenderer().png_for_scores(scores), repeat),
+            "warm": timed(lambda: warm.png_for_scores(scores), repeat),
+            "cached": timed(lambda: cached.png_for_scores(scores), repeat),
+        }
+    return results
+
+
+def print_render(results):
+    print("%-15s %10s %10s %10s" % ("render (ms)", "cold", "warm", "cached"))
+    for case, r in results.items():
+        print("%-15s %10.2f %10.2f %10.4f" % (
+            case, r["cold"] * 1e3, r["warm"] * 1e3, r["cached"] * 1e3))
+
+
+def bench_encoding(repeat=3):
+    """Encoded size and encode time of each image_test.py case in each of
+    cup_image.ENCODINGS"""
+    renderer = CupRenderer(cache_size=0)
+    results = {}
+    for case in CASES:
+        image = renderer.render(scores_for(case))
+        results[case] = {
+            mode: (len(encoding.encode(image)),
+                   timed(lambda: encoding.encode(image), repeat))
+            for mode, encoding in ENCODINGS.items()
+        }
+    return results
+
+
+def print_encoding(results):
+    print("%-15s" % "encode (KB/ms)" + "".join(
+        "%16s" % mode for mode in ENCODINGS))
+    for case, modes in results.items():
+        print("%-15s" % case + "".join(
+            "%8.1f/%7.1f" % (size / 1024, seconds * 1e3)
+            for size, seconds in modes.values()))
+
+
+def bench_replay(frames=200):
+    """Frames/sec of a replay GIF, against rendering and encoding each
+    frame with CupRenderer"""
+    standings = season(frames)
+    renderer = CupRenderer(cache_size=0, mode="palette")
+    replay = ReplayRenderer(renderer)
+
+    out = io.BytesIO()
+    start = time.perf_counter()
+    replay.write_gif(standings, out)
+    gif_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for scores in standings:
+        renderer.png_for_scores(scores)
+    png_seconds = time.perf_counter() - start
+    return {
+        "frames": frames,
+        "replay": (frames / gif_seconds, len(out.getvalue())),
+        "per frame": (frames / png_seconds, None),
+    }
+
+
+def print_replay(results):
+    print("replay (%d frames)" % results["frames"])
+    for name in ("replay", "per frame"):
+        rate, size = results[name]
+        print("  %-10s %8.1f frames/s%s" % (
+            name, rate, "" if size is None else "  %8.1f KB" % (size / 1024)))
+
+
+PARSER_MESSAGES = [
+    "1 point to gryffindor for <@U15BW22P9> ... 5 years ago",
+    "....1 point to gryffindor",
+    "Dumbledore awards 1 point to ravenclaw <@U0NJ1PH1R> for making reason "
+    "works",
+    "Dumbledore says ho ho ho :party-khan:",
+    "oNe point from Gryffindor",
+    "10 points to everybody",
+    "lunch is at noon, anyone want pizza?",
+    "did you see the slytherin PR? it's 2 files",
+]
+
+
+def bench_parser(count=20000):
+    """Messages/sec on one core for parse() and for filter + award"""
+    events = [{"type": "message", "channel": CHANNEL, "user": "prefect",
+               "text": text} for text in PARSER_MESSAGES]
+    p = PointCounter(["prefect"], reset=True)
+    p.store = None
+
+    start = time.perf_counter()
+    for i in range(count):
+        points_util.parse(PARSER_MESSAGES[i % len(PARSER_MESSAGES)])
+    parse = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(count):
+        event = events[i % len(events)]
+        parsed = is_hogwarts_related(event)
+        if parsed:
+            p.award_points(event['text'], event['user'],
+                           channel=event['channel'], parsed=parsed)
+    award = count / (time.perf_counter() - start)
+    return {"parse": parse, "filter+award": award}
+
+
+def print_parser(results):
+    print("%-15s %10s" % ("parser", "msgs/sec"))
+    for name, rate in results.items():
+        print("%-15s %10d" % (name, rate))
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def poll_loop(sc, p, stop):
+    """The main loop before the asyncio runtime, kept for comparison"""
+    while not stop.is_set():
+        seen_point_messages = False
+        for message in sc.rtm_read():
+            parsed = is_hogwarts_related(message)
+            if parsed:
+                for m in p.award_points(message['text'], message['user'],
+                                        channel=message['channel'],
+                                        parsed=parsed):
+                    kwargs = announcement_for(m)
+                    sc.api_call("chat.postMessage", **kwargs)
+                    if 'point' in kwargs['text']:
+                        seen_point_messages = True
+        if seen_point_messages:
+            upload_scores_image(sc, p.points)
+        time.sleep(1)
+        p.post_update()
+
+
+def feed_awards(sc, count, interval):
+    """Push `count` awards from distinct users, return their receipt times"""
+    received = {}
+    for i in range(count):
+        user = "U%d" % i
+        received[user] = time.perf_counter()
+        sc.push({"type": "message", "channel": CHANNEL, "user": user,
+                 "text": "1 point to Gryffindor"})
+        sc.push({"type": "user_typing", "channel": CHANNEL, "user": user})
+        time.sleep(interval)
+    return received
+
+
+def announcement_latencies(sc, received):
+    """Latency of each award announced; merged posts announce several"""
+    latencies = []
+    for _, kwargs, sent in sc.calls_to("chat.postMessage"):
+        for line in kwargs["text"].split("\n"):
+            user = line.split(">")[0][len("<@"):]
+            latencies.append(sent - received[user])
+    return latencies
+
+
+def bench_loop_latency(count=30, interval=0.1, api_latency=0.05):
+    """Receipt to announcement latency of the poll loop and asyncio runtime
+
+    Awards are pushed through a FakeSlackClient whose Web API calls take
+    `api_latency` seconds.
+    """
+    results = {}
+
+    sc = FakeSlackClient(api_latency)
+    p = PointCounter(reset=True)
+    p.store = None
+    stop = threading.Event()
+    worker = threading.Thread(target=poll_loop, args=(sc, p, stop))
+    worker.start()
+    received = feed_awards(sc, count, interval)
+    time.sleep(2 + count * api_latency)
+    stop.set()
+    worker.join()
+    results["poll"] = announcement_latencies(sc, received)
+
+    sc = FakeSlackClient(api_latency)
+    p = PointCounter(reset=True)
+    p.store = None
+    runtime = BotRuntime(sc, p)
+    # Without the channel rate limit and merge window, which would set the
+    # latency instead of the runtime; the poll loop has neither
+    runtime.outbox = Outbox(sc, runtime.in_executor, merge_window=0,
+                            rate=1e6, burst=1e6)
+
+    async def run():
+        task = asyncio.get_running_loop().create_task(runtime.run())
+        feeder = asyncio.get_running_loop().run_in_executor(
+            None, feed_awards, sc, count, interval)
+        received = await feeder
+        await asyncio.sleep(1)
+        runtime.stop()
+        await task
+        return received
+
+    received = asyncio.run(run())
+    results["asyncio"] = announcement_latencies(sc, received)
+    return results
+
+
+def print_loop_latency(results):
+    print("%-15s %10s %10s %10s %6s" % (
+        "latency (ms)", "p50", "p95", "max", "awards"))
+    for loop, latencies in results.items():
+        print("%-15s %10.1f %10.1f %10.1f %6d" % (
+            loop, percentile(latencies, 50) * 1e3,
+            percentile(latencies, 95) * 1e3, max(latencies) * 1e3,
+            len(latencies)))
+
+
+def post_callbacks(port, secret, events):
+    """Post each of `events` as a signed callback on one connection, and
+    return the seconds each took to be acknowledged"""
+    conn = http.client.HTTPConnection("localhost", port)
+    latencies = []
+    for event in events:
+        body = json.dumps({"type": "event_callback",
+                           "event": event}).encode("utf-8")
+        timestamp = int(time.time())
+        headers = {"Content-Type": "application/json",
+                   "X-Slack-Request-Timestamp": str(timestamp),
+                   "X-Slack-Signature": signature(secret, timestamp, body)}
+        start = time.perf_counter()
+        conn.request("POST", EVENTS_PATH, body, headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            raise RuntimeError("Callback got a %d" % response.status)
+    conn.close()
+    return latencies
+
+
+def bench_events(count=5000, clients=8, seed=0):
+    """Acks/sec and ack latency of Events API callbacks posted by `clients`
+    connections as fast as they are acknowledged, with the bot awarding
+    points from them behind"""
+    events = TrafficGenerator(seed).events(count)
+    secret = "benchmark"
+    sc = FakeSlackClient()
+    p = PointCounter(["prefect"], reset=True)
+    p.store = None
+    server = EventsServer(0, secret, host="localhost")
+    runtime = BotRuntime(sc, p, tick=0.01, events_server=server)
+    # Slack's rate limits aren't what's being measured
+    runtime.outbox = Outbox(sc, runtime.in_executor, rate=1e6, burst=1e6)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        task = loop.create_task(runtime.run())
+        await asyncio.sleep(0.1)
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*[
+            loop.run_in_executor(None, post_callbacks, server.port, secret,
+                                 events[i::clients])
+            for i in range(clients)])
+        seconds = time.perf_counter() - start
+        runtime.stop()
+        await task
+        return seconds, [l for client in latencies for l in client]
+
+    seconds, latencies = asyncio.run(run())
+    return {
+        "acks/s": count / seconds,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies),
+        "handled": metrics.MESSAGES.value(result="handled"),
+    }
+
+
+def print_events(results):
+    print("events api: %.0f acks/s, ack p50 %.2fms, p99 %.2fms, "
+          "max %.2fms" % (results["acks/s"], results["p50"] * 1e3,
+                          results["p99"] * 1e3, results["max"] * 1e3))
+
+
+def convert_name_to_id(sc, channel, prefect_names):
+    """Prefect lookup before PrefectResolver, kept for comparison: one
+    users.info call per channel member"""
+    prefect_name_set = set(prefect_names)
+    members = sc.api_call("channels.info", channel=channel)['channel'][
+        'members']
+    return [user_id for user_id in members
+            if sc.api_call("users.info", user=user_id).get(
+                'user', {}).get('name') in prefect_name_set]
+
+
+def time_to_first_message(sc, start_counter):
+    """Seconds from startup until the first award has been announced"""
+    start = time.perf_counter()
+    p = start_counter()
+    p.store = None
+    runtime = BotRuntime(sc, p)
+    sc.push({"type": "message", "channel": CHANNEL, "user": "U0000",
+             "text": "10 points to Gryffindor"})
+
+    async def run():
+        task = asyncio.get_running_loop().create_task(runtime.run())
+        while not sc.calls_to("chat.postMessage"):
+            await asyncio.sleep(0.001)
+        runtime.stop()
+        await task
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        asyncio.run(run())
+    return sc.calls_to("chat.postMessage")[0][2] - start
+
+
+def bench_startup(members=300, api_latency=0.005, bucket_latency=0.2):
+    """Startup to first handled message against a fake Slack API
+
+    `members` users are in the workspace and prefect channel, every Slack
+    call takes `api_latency` seconds and reading the points file takes
+    `bucket_latency` seconds per request.
+    """
+    users = {"U%04d" % i: "user%d" % i for i in range(members)}
+    prefects = ["user0"]
+    bucket = FakeBucket(latency=bucket_latency)
+    bucket.objects[""] = json.dumps([{"Gryffindor": 10}])
+    directory = tempfile.mkdtemp()
+    cache_path = os.path.join(directory, "prefects.json")
+
+    def resolved(sc):
+        return PrefectResolver(sc, prefects, cache_path=cache_path)
+
+    results = {}
+    with mock.patch("main.get_client"), \
+            mock.patch("main.get_bucket", return_value=bucket):
+        sc = FakeSlackClient(api_latency, users)
+        results["users.info per member"] = time_to_first_message(
+            sc, lambda: PointCounter(
+                prefects=convert_name_to_id(sc, "public", prefects)))
+        for run, background in (("users.list, no cache", True),
+                                ("users.list, cached", True),
+                                ("cached, bucket read first", False)):
+            sc = FakeSlackClient(api_latency, users)
+            results[run] = time_to_first_message(
+                sc, lambda: start_tournaments(
+                    sc, TournamentRegistry([Tournament(DEFAULT_NAME)]),
+                    resolver=resolved(sc), background_load=background
+                ).tournaments[0].counter)
+    shutil.rmtree(directory)
+    return results
+
+
+# Run in a fresh interpreter, so nothing is imported already
+IMPORT_MAIN = """
+import json, sys, time
+start = time.perf_counter()
+import main
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [m for m in %r if m in sys.modules]]))
+"""
+
+
+def bench_import(modules=("PIL.Image", "google.cloud.storage",
+                          "slackclient")):
+    """Seconds to import main, and which of the slow `modules` it loaded"""
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_MAIN % (list(modules),)],
+        check=True, stdout=subprocess.PIPE,
+        cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    seconds, loaded = json.loads(output.decode("utf-8").splitlines()[-1])
+    return seconds, loaded
+
+
+def print_startup(results, imported=None):
+    print("%-25s %10s" % ("startup", "seconds"))
+    for run, seconds in results.items():
+        print("%-25s %10.3f" % (run, seconds))
+    if imported:
+        seconds, loaded = imported
+        print("%-25s %10.3f  (loaded: %s)" % ("import main", seconds,
+                                             ", ".join(loaded) or "none"))
+
+
+def bench_prefilter(count=20000, seed=0):
+    """Events/sec through is_hogwarts_related on a mixed corpus, parsing
+    every message as before and prefiltering them"""
+    events = list(TrafficGenerator(seed).events(count))
+
+    def relevant(event):
+        # is_hogwarts_related before the prefilter
+        if not (event.get("type") == "message" and "text" in event and
+                event.get("channel") in (CHANNEL, ADMIN_CHANNEL)):
+            return None
+        parsed = points_util.parse(event["text"])
+        if (("point" in parsed.text and parsed.houses) or
+                ("say" in parsed.text and parsed.subject)):
+            return parsed
+        return None
+
+    results = {}
+    for name, fn in (("parse all", lambda: list(map(relevant, events))),
+                     ("prefilter", lambda: list(map(is_hogwarts_related,
+                                                    events)))):
+        start = time.perf_counter()
+        handled = sum(1 for parsed in fn() if parsed)
+        results[name] = (count / (time.perf_counter() - start), handled)
+    return results
+
+
+def print_prefilter(results):
+    print("%-15s %12s %8s" % ("filter", "events/sec", "handled"))
+    for name, (rate, handled) in results.items():
+        print("%-15s %12.0f %8d" % (name, rate, handled))
+
+
+def bench_standings(sizes=(1000, 100000), queries=200, seed=0):
+    """Microseconds per standings query after `sizes` awards"""
+    rnd = random.Random(seed)
+    results = {}
+    for size in sizes:
+        index = StandingsIndex(houses=HOUSES)
+        now = time.time()
+        for i in range(size):
+            index.record("U%d" % rnd.randrange(50), rnd.choice(HOUSES),
+                         rnd.randint(-5, 20), now - (size - i) * 60)
+        results[size] = {
+            text: timed(lambda: standings.answer(index, text), queries) * 1e6
+            for text in ("standings", "standings awarders week",
+                         "standings gryffindor day")
+        }
+    return results
+
+
+def print_standings(results):
+    print("standings queries (us)")
+    for size, times in results.items():
+        print("  %7d awards " % size + "".join(
+            "  %s %.1f" % (text, us) for text, us in times.items()))
+
+
+def bench_storage(awards=2000, bucket_latency=0.02, seed=0):
+    """Awards/sec and flush latency with each points store
+
+    The points are flushed every FLUSH_AWARDS awards, like the PointsWriter
+    does under load, or after every award. Each request to the bucket takes
+    `bucket_latency` seconds.
+    """
+    rnd = random.Random(seed)
+    messages = ["%d points to %s" % (rnd.randint(1, 10), rnd.choice(HOUSES))
+                for _ in range(awards)]
+    directory = tempfile.mkdtemp()
+    runs = [
+        ("bucket", lambda: BucketStore(FakeBucket(latency=bucket_latency),
+                                       "points.json"), FLUSH_AWARDS),
+        ("sqlite", lambda: SqliteStore(
+            os.path.join(directory, "normal.db"), "points.json"),
+         FLUSH_AWARDS),
+        ("sqlite", lambda: SqliteStore(
+            os.path.join(directory, "each.db"), "points.json"), 1),
+        ("sqlite FULL", lambda: SqliteStore(
+            os.path.join(directory, "full.db"), "points.json",
+            synchronous="FULL"), 1),
+    ]
+    results = {}
+    for name, store, every in runs:
+        p = PointCounter(["prefect"], reset=True)
+        p.store = store()
+        writer = PointsWriter(p)
+        flushes = []
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for i, message in enumerate(messages, 1):
+                p.award_points(message, "prefect", ts="%d.0" % i)
+                if i % every == 0:
+                    flush_start = time.perf_counter()
+                    writer.flush()
+                    flushes.append(time.perf_counter() - flush_start)
+            seconds = time.perf_counter() - start
+        results["%s, flush every %d" % (name, every)] = {
+            "awards/s": awards / seconds,
+            "flush p50": percentile(flushes, 50),
+            "flush p99": percentile(flushes, 99),
+        }
+    shutil.rmtree(directory)
+    return results
+
+
+def print_storage(results):
+    print("%-26s %10s %12s %12s" % ("store", "awards/s", "flush p50 ms",
+                                    "flush p99 ms"))
+    for name, r in results.items():
+        print("%-26s %10.0f %12.3f %12.3f" % (
+            name, r["awards/s"], r["flush p50"] * 1e3,
+            r["flush p99"] * 1e3))
+
+
+def bench_tracing(count=20000, seed=0):
+    """Dispatch throughput with the old per-event print, and with event
+    tracing off, sampled and on for every event
+
+    Returns mode -> (events/sec, seconds to drain the log queue after).
+    """
+    events = list(TrafficGenerator(seed).events(count))
+    modes = {
+        "print": ("INFO", 0),
+        "trace off": ("INFO", 0),
+        "trace sampled": ("DEBUG", LOG_EVENT_SAMPLE),
+        "trace all": ("DEBUG", 1),
+    }
+    results = {}
+    with open(os.devnull, "w") as devnull:
+        for mode, (level, sample) in modes.items():
+            p = PointCounter(reset=True)
+            p.store = None
+            runtime = BotRuntime(sc=FakeSlackClient(), counter=p)
+            # Only the dispatch is measured, not sending the posts
+            runtime.outbox.post = lambda kwargs, priority: None
+            logs.setup(level, stream=devnull, event_sample=sample)
+            with contextlib.redirect_stdout(devnull):
+                start = time.perf_counter()
+                for event in events:
+                    if mode == "print":
+                        print("Message: %s" % event)
+                    runtime.dispatch(event)
+                seconds = time.perf_counter() - start
+            drain_start = time.perf_counter()
+            logs.shutdown()
+            results[mode] = (count / seconds,
+                             time.perf_counter() - drain_start)
+    return results
+
+
+def print_tracing(results):
+    print("%-15s %12s %10s" % ("dispatch", "events/sec", "drain s"))
+    for mode, (rate, drain) in results.items():
+        print("%-15s %12.0f %10.3f" % (mode, rate, drain))
+
+
+def stage_result(calls, seconds):
+    return {
+        "calls": calls,
+        "total_s": seconds,
+        "mean_us": seconds / calls * 1e6 if calls else 0,
+        "ops_per_sec": calls / seconds if seconds else 0,
+    }
+
+
+def bench_stages(count=20000, seed=0, renders=10):
+    """Time each stage of handling a seeded synthetic traffic corpus
+
+    Every relevant message in the corpus is awarded, each resulting
+    standing is scaled, and `renders` of them are rendered.
+    """
+    corpus = TrafficGenerator(seed).events(count)
+    p = PointCounter(["prefect"], reset=True)
+    p.store = None
+    results = {}
+
+    start = time.perf_counter()
+    parsed = [is_hogwarts_related(event) for event in corpus]
+    results["is_hogwarts_related"] = stage_result(
+        len(corpus), time.perf_counter() - start)
+
+    related = [(event, pm) for event, pm in zip(corpus, parsed) if pm]
+    standings = []
+    start = time.perf_counter()
+    for event, pm in related:
+        p.award_points(event['text'], event['user'],
+                       channel=event['channel'], parsed=pm)
+    results["award_points"] = stage_result(
+        len(related), time.perf_counter() - start)
+    # The same awards, a 40 message rtm_read() batch at a time
+    p.points.clear()
+    start = time.perf_counter()
+    for i in range(0, len(related), 40):
+        batch = related[i:i + 40]
+        p.award_many([event for event, _ in batch],
+                     parsed=[pm for _, pm in batch])
+    results["award_many"] = stage_result(
+        len(related), time.perf_counter() - start)
+    # Replay to collect the standings without timing the copies
+    p.points.clear()
+    for event, pm in related:
+        p.award_points(event['text'], event['user'],
+                       channel=event['channel'], parsed=pm)
+        standings.append(dict(p.points))
+
+    start = time.perf_counter()
+    for scores in standings:
+        calculate_scales(scores)
+    results["calculate_scales"] = stage_result(
+        len(standings), time.perf_counter() - start)
+
+    step = max(1, len(standings) // renders)
+    sample = [s for s in standings[::step] if len(s) == 4][:renders]
+    start = time.perf_counter()
+    for scores in sample:
+        image_for_scores(scores, imgname="benchmark")
+    results["image_for_scores"] = stage_result(
+        len(sample), time.perf_counter() - start)
+    return results
+
+
+def print_stages(results):
+    print("%-20s %8s %12s %12s" % ("stage", "calls", "mean (us)", "ops/sec"))
+    for stage, r in results.items():
+        print("%-20s %8d %12.2f %12d" % (
+            stage, r["calls"], r["mean_us"], r["ops_per_sec"]))
+
+
+def print_comparison(results, previous):
+    """Ratio of the new mean time per call to a previous run's, per stage"""
+    print("%-20s %12s %12s %8s" % ("stage", "before (us)", "after (us)",
+                                   "ratio"))
+    for stage, r in results["stages"].items():
+        before = previous.get("stages", {}).get(stage)
+        if before and before["mean_us"]:
+            print("%-20s %12.2f %12.2f %8.2f" % (
+                stage, before["mean_us"], r["mean_us"],
+                r["mean_us"] / before["mean_us"]))
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--count", type=int, default=20000,
+                        help="number of synthetic events")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the stage results to this file")
+    parser.add_argument("--compare", help="results file of a previous run")
+    parser.add_argument("--stages-only", action="store_true",
+                        help="skip the render, parser and loop benchmarks")
+    args = parser.parse_args()
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "seed": args.seed,
+            "count": args.count,
+        },
+        "stages": bench_stages(args.count, args.seed),
+    }
+    print_stages(results["stages"])
+    if not args.stages_only:
+        print_render(bench_render())
+        print_encoding(bench_encoding())
+        print_replay(bench_replay())
+        print_parser(bench_parser())
+        print_prefilter(bench_prefilter(args.count, args.seed))
+        print_standings(bench_standings())
+        print_loop_latency(bench_loop_latency())
+        print_events(bench_events())
+        print_startup(bench_startup(), bench_import())
+        print_tracing(bench_tracing(args.count, args.seed))
+        print_storage(bench_storage())
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import os
+
 try:
     from secrets import (
         SLACK_TOKEN, PREFECTS, CHANNEL, POINTS_FILE,
@@ -14,6 +16,18 @@ except ImportError:
     PUBLIC_CHANNEL = 'public'
     ADMIN_CHANNEL = 'admin'
     BOT_ID = ''
+try:
+    # A list of tournaments, as keyword arguments for
+    # tournaments.Tournament. Without it, the settings above are the one
+    # tournament. Each tournament's houses must be among HOUSES.
+    from secrets import TOURNAMENTS
+except ImportError:
+    TOURNAMENTS = []
+try:
+    # Signs Events API callbacks; only needed with USE_EVENTS_API
+    from secrets import SLACK_SIGNING_SECRET
+except ImportError:
+    SLACK_SIGNING_SECRET = ''
 
 HOUSES = ["Ravenclaw", "Hufflepuff", "Gryffindor", "Slytherin"]
 SPECIAL_SUBJECT = {
@@ -33,9 +47,131 @@ SPECIAL_SUBJECT = {
 # Announcers will be able to make the bot print the current standing
 ANNOUNCERS = PREFECTS
 IMAGE_PATH = "house_points.png"
+# How the image is encoded for upload, one of cup_image.ENCODINGS
+IMAGE_MODE = "palette"
+# Season replay GIFs: milliseconds per frame, and frames scaled at a time
+REPLAY_FRAME_MS = 100
+REPLAY_BATCH = 64
 
 # 2018 - 🙈🙈🙈
 # BUCKET_NAME = "ka_users"
 # POINTS_FILE = 'hogwarts_bot/HackathonFeb2018Points.json'
 
 MAX_POINTS = 1200
+
+# Seconds to wait on the house cup image upload before giving up
+UPLOAD_TIMEOUT = 30
+
+# Local award log, see ledger.py. Awards are fsync'ed in batches of
+# LEDGER_FSYNC_BATCH and on every points flush. It's compacted into a
+# snapshot of the stored points by the first flush after
+# LEDGER_COMPACT_INTERVAL seconds or LEDGER_COMPACT_EVENTS awards, and by
+# the final one
+LEDGER_DIR = "ledger"
+LEDGER_FSYNC_BATCH = 20
+LEDGER_COMPACT_INTERVAL = 30
+LEDGER_COMPACT_EVENTS = 1000
+
+# The points are uploaded at most every FLUSH_INTERVAL seconds, or once
+# FLUSH_AWARDS house awards are waiting. Failed uploads are retried after
+# FLUSH_BACKOFF_BASE seconds, doubling up to FLUSH_BACKOFF_MAX. On shutdown
+# the final flush is retried for up to FLUSH_SHUTDOWN_TIMEOUT seconds.
+FLUSH_INTERVAL = 5
+FLUSH_AWARDS = 50
+FLUSH_BACKOFF_BASE = 1
+FLUSH_BACKOFF_MAX = 60
+FLUSH_SHUTDOWN_TIMEOUT = 20
+
+# Every user's id is cached here for PREFECT_CACHE_TTL seconds, see
+# prefects.py. users.list is read USERS_PAGE_SIZE users at a time.
+PREFECT_CACHE_PATH = "ledger/prefects.json"
+PREFECT_CACHE_TTL = 6 * 60 * 60
+USERS_PAGE_SIZE = 200
+
+# Conditional writes of the points file that lose to another instance are
+# retried up to STORE_MAX_ATTEMPTS times, after a random delay that starts
+# at up to STORE_RETRY_DELAY seconds and doubles
+STORE_MAX_ATTEMPTS = 10
+STORE_RETRY_DELAY = 0.05
+# Loading the points at startup is retried after a random delay below a
+# ceiling that doubles from STORE_LOAD_RETRY_BASE up to STORE_LOAD_RETRY_MAX
+STORE_LOAD_RETRY_BASE = 1
+STORE_LOAD_RETRY_MAX = 30
+# Where the points are kept: "bucket", the BUCKET_NAME bucket shared by
+# every instance, or "sqlite", a database at SQLITE_PATH for a single node.
+# SQLITE_SYNCHRONOUS is its synchronous pragma: NORMAL syncs the WAL at
+# checkpoints, FULL on every commit.
+POINTS_STORE = "bucket"
+SQLITE_PATH = "ledger/points.db"
+SQLITE_SYNCHRONOUS = "NORMAL"
+
+# Processes to spread the tournaments over
+TOURNAMENT_WORKERS = 1
+
+# Announcements queued for the same channel and persona within this many
+# seconds of each other are merged into one post
+OUTBOX_MERGE_WINDOW = 2
+# Slack allows about one post a second per channel, with short bursts
+OUTBOX_CHANNEL_RATE = 1
+OUTBOX_CHANNEL_BURST = 3
+OUTBOX_MAX_ATTEMPTS = 5
+# Seconds before retrying a failed post, doubling each attempt
+OUTBOX_RETRY_DELAY = 1
+# Seconds to keep sending queued posts on shutdown
+OUTBOX_DRAIN_TIMEOUT = 10
+
+# Port for the /metrics and /ready endpoints
+METRICS_PORT = 9090
+# Seconds the event loop can fall behind before the bot reports not ready
+MAX_LOOP_LAG = 5
+
+# DEBUG turns on RTM event traces, of which LOG_EVENT_SAMPLE are logged
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+LOG_EVENT_SAMPLE = 0.01
+# Log records waiting to be written; more are dropped
+LOG_QUEUE_SIZE = 10000
+
+# Processes rendering the house cup image
+RENDER_WORKERS = 2
+
+# Award history kept for "standings" queries in the admin channel: hourly
+# totals for STANDINGS_HOURS and daily totals for STANDINGS_DAYS
+STANDINGS_HOURS = 7 * 24
+STANDINGS_DAYS = 90
+# Awarders listed by "standings awarders"
+STANDINGS_TOP_AWARDERS = 5
+
+# Take events from Events API callbacks instead of the RTM websocket. Slack
+# posts them all to one Request URL, so this needs TOURNAMENT_WORKERS = 1
+USE_EVENTS_API = False
+# Port and path of the Request URL
+EVENTS_PORT = 3000
+EVENTS_PATH = "/slack/events"
+# Threads handling events, and events each can have queued before Slack is
+# told to retry
+EVENTS_WORKERS = 4
+EVENTS_QUEUE_SIZE = 1000
+# Seconds a signed callback stays valid, against replays
+EVENTS_MAX_AGE = 5 * 60
+
+# Seconds between attempts to reconnect to RTM: a random delay below a
+# ceiling that doubles from RTM_RECONNECT_BASE up to RTM_RECONNECT_MAX
+RTM_RECONNECT_BASE = 1
+RTM_RECONNECT_MAX = 60
+# Missed messages are read back from conversations.history after a
+# reconnect, CATCHUP_PAGE_SIZE at a time for at most CATCHUP_MAX_PAGES
+CATCHUP_PAGE_SIZE = 200
+CATCHUP_MAX_PAGES = 10
+# Messages remembered as handled, so one delivered twice counts once
+PROCESSED_TS_SIZE = 10000
+
+# Longest wait for RTM events before checking the websocket again
+RTM_POLL_INTERVAL = 0.05
+# Threads for Slack calls, image renders and bucket uploads
+RUNTIME_WORKERS = 8
+
+# A burst of awards is posted as one image once no award has come in for
+# SCOREBOARD_MIN_INTERVAL seconds, and at least every SCOREBOARD_MAX_STALENESS
+# seconds while the burst goes on
+SCOREBOARD_MIN_INTERVAL = 5
+SCOREBOARD_MAX_STALENESS = 30
@@ -1,10 +1,19 @@
+from collections import OrderedDict
+import io
 import os
 import tempfile
-from typing import Dict
+import threading
+from typing import TYPE_CHECKING, Dict, List
 
-from PIL import Image, ImageDraw, ImageFont
+from consts import HOUSES, IMAGE_PATH, IMAGE_MODE, MAX_POINTS
+import metrics
 
-from consts import HOUSES, IMAGE_PATH, MAX_POINTS
+# Pillow is imported where it's used, so it only loads on the first render
+if TYPE_CHECKING:
+    from PIL import Image
+
+FONT_PATH = 'BrandonText-Black.otf'
+FONT_SIZE = 32
 
 # Tuples of (x1, y1, x2, y2)
 BAR_RECTS = {
@@ -26,11 +35,54 @@ BAR_COLORS = {
 }
 
 
-def calculate_scales(house_points, base_ratio=0.6):
+class Encoding(object):
+    """How the image is encoded for upload
+
+    `colors` quantizes it to a palette first and `scale` resizes it; other
+    keyword arguments are Pillow save options for `format`.
+    """
+
+    def __init__(self, format, extension, mime, colors=None, scale=1,
+                 **options):
+        self.format = format
+        self.extension = extension
+        self.mime = mime
+        self.colors = colors
+        self.scale = scale
+        self.options = options
+
+    def encode(self, image: "Image.Image") -> bytes:
+        from PIL import Image
+        if self.scale != 1:
+            image = image.resize((round(image.width * self.scale),
+                                  round(image.height * self.scale)),
+                                 Image.LANCZOS)
+        if self.colors:
+            # Octree is the quantizer that keeps the overlay's alpha
+            image = image.quantize(self.colors,
+                                   method=Image.Quantize.FASTOCTREE)
+        buf = io.BytesIO()
+        image.save(buf, self.format, **self.options)
+        return buf.getvalue()
+
+
+ENCODINGS = {
+    # The full RGBA image, as it always was
+    "png": Encoding("PNG", "png", "image/png"),
+    # Four bar colors over a static overlay fit a 256 color palette
+    "palette": Encoding("PNG", "png", "image/png", colors=256,
+                        optimize=True),
+    "webp": Encoding("WEBP", "webp", "image/webp", lossless=True, method=4),
+    "thumbnail": Encoding("PNG", "png", "image/png", colors=256, scale=0.5,
+                          optimize=True),
+}
+
+
+def calculate_scales(house_points, base_ratio=0.6, max_points=MAX_POINTS):
     """Calcaulate intepolation ratio
 
     This try to maximise the difference visually, but also ensure that
-    we reflect progress towards our max_point
+    we reflect progress towards our max_points, the tournament's cap
 
     Base is shared between all bars.
     Interpolation is based on the difference between the bars
@@ -38,19 +90,19 @@ def calculate_scales(house_points, base_ratio=0.6):
     See image_test.py for test cases
 
     """
-    max_points = 0
+    most_points = 0
     min_points = 0
     all_points = house_points.values()
     if all_points:
-        max_points = max(all_points)
+        most_points = max(all_points)
         min_points = min(all_points) if len(house_points) == len(HOUSES) else 0
-    interpolation_range = max_points - min_points
+    interpolation_range = most_points - min_points
 
     # The base 60% is based on basic score
-    base = max((min_points / MAX_POINTS) * base_ratio, 0.25)
+    base = max((min_points / max_points) * base_ratio, 0.25)
     # The rest of the base is intepolation, but with minimum 40%
     interpolation_ratio = max(
-        (max_points / MAX_POINTS) * (1-base), (1-base_ratio)
+        (most_points / max_points) * (1-base), (1-base_ratio)
     )
     # NOTE: base + interpolation_ratio < base_ratio + interpolation_ratio  <= 1
 
@@ -68,19 +120,142 @@ def calculate_scales(house_points, base_ratio=0.6):
     }
 
 
-def draw_bar_for_house(im, house, scale):
-    draw = ImageDraw.Draw(im)
+def calculate_scales_batch(frames: List[Dict[str, int]], base_ratio=0.6,
+                           max_points=MAX_POINTS) -> Dict[str, List[float]]:
+    """calculate_scales for many standings at once
+
+    Works a column of scores per house rather than a frame at a time, and
+    returns a column of scales per house, equal to calculate_scales' for
+    each frame.
+    """
+    if not frames:
+        return {house: [] for house in HOUSES}
+    columns = [[f.get(house, 0) for f in frames] for house in HOUSES]
+    complete = [len(f) == len(HOUSES) for f in frames]
+    # A frame with no houses at all has max and min 0, as in
+    # calculate_scales
+    present = [[f[house] for house in f] or [0] for f in frames]
+    maxes = list(map(max, present))
+    mins = [min(points) if full else 0
+            for points, full in zip(present, complete)]
+    bases = [max((low / max_points) * base_ratio, 0.25) for low in mins]
+    ratios = [max((high / max_points) * (1 - base), (1 - base_ratio))
+              for high, base in zip(maxes, bases)]
+    ranges = [high - low for high, low in zip(maxes, mins)]
+    return {
+        house: [
+            0 if points == 0 else (
+                base + ratio * (((points - low) / spread) if spread else 1))
+            for points, base, ratio, low, spread in zip(
+                column, bases, ratios, mins, ranges)
+        ]
+        for house, column in zip(HOUSES, columns)
+    }
+
 
-    # Background rectangle
-    draw.rectangle(BAR_RECTS[house], fill=BAR_COLORS[house][0])
+def bar_fill_rect(house, scale):
+    """Rectangle covering the filled part of a house bar at the given scale"""
     bar_y = BAR_RECTS[house][3] * (1-scale) + BAR_RECTS[house][1] * scale
+    return (BAR_RECTS[house][0], bar_y, BAR_RECTS[house][2], BAR_RECTS[house][3])
+
+
+class CupRenderer(object):
+    """Long-lived house cup renderer
+
+    The overlay, font and empty bar backgrounds are loaded once, and the
+    encoded bytes of the last `cache_size` standings are kept around so a
+    repeated score board costs a dictionary lookup. `mode` picks one of
+    ENCODINGS.
+    """
+
+    def __init__(self, cache_size=32, mode=IMAGE_MODE):
+        from PIL import Image, ImageDraw, ImageFont
+        self.encoding = ENCODINGS[mode]
+        self.overlay = Image.open(IMAGE_PATH)
+        self.overlay.load()
+        self.font = ImageFont.truetype(FONT_PATH, FONT_SIZE)
+
+        # Bar backgrounds don't depend on the scores
+        self.background = Image.new(self.overlay.mode, self.overlay.size)
+        draw = ImageDraw.Draw(self.background)
+        for house in HOUSES:
+            draw.rectangle(BAR_RECTS[house], fill=BAR_COLORS[house][0])
+        del draw
+
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        # Pillow images and fonts are shared, so only one render at a time
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def cache_key(scores: Dict[str, int], max_points=MAX_POINTS):
+        # Missing houses and the cap change the scaling, so they have to be
+        # part of the key
+        return tuple(sorted(scores.items())), max_points
+
+    def render(self, scores: Dict[str, int],
+               max_points=MAX_POINTS) -> "Image.Image":
+        """Composite the house cup image for the given scores, scaled
+        towards `max_points`"""
+        from PIL import Image, ImageDraw
+        with metrics.STAGE_SECONDS.time(stage="calculate_scales"):
+            scaled = calculate_scales(scores, max_points=max_points)
+
+        bars = self.background.copy()
+        draw = ImageDraw.Draw(bars)
+        for house in HOUSES:
+            draw.rectangle(bar_fill_rect(house, scaled[house]),
+                           fill=BAR_COLORS[house][1])
+        del draw
+
+        merged = Image.alpha_composite(bars, self.overlay)
+
+        draw = ImageDraw.Draw(merged)
+        for house in HOUSES:
+            text = "%d" % scores.get(house, 0)
+            w, _ = self.font.getsize(text)
+            draw.text(
+                ((BAR_RECTS[house][0] + BAR_RECTS[house][2] - w) * 0.5,
+                 BAR_RECTS[house][3] + BAR_SPACE),
+                text,
+                fill=BAR_COLORS[house][0], font=self.font)
+        del draw
+        return merged
+
+    def png_for_scores(self, scores: Dict[str, int],
+                       max_points=MAX_POINTS) -> bytes:
+        """Encoded bytes of the house cup image, served from cache when
+        possible
+
+        They're PNG bytes unless the mode says otherwise.
+        """
+        key = self.cache_key(scores, max_points)
+        with self._lock:
+            if key in self._cache:
+                metrics.RENDER_CACHE.inc(result="hit")
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+            metrics.RENDER_CACHE.inc(result="miss")
+            with metrics.STAGE_SECONDS.time(stage="render"):
+                png = self.encoding.encode(self.render(scores, max_points))
+
+            if self.cache_size > 0:
+                self._cache[key] = png
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            return png
+
+
+_renderer = None
 
-    # Fill rectangle
-    draw.rectangle((BAR_RECTS[house][0], bar_y,
-                    BAR_RECTS[house][2], BAR_RECTS[house][3]),
-                   fill=BAR_COLORS[house][1])
 
-    del draw
+def get_renderer() -> CupRenderer:
+    """Shared renderer, created on first use"""
+    global _renderer
+    if _renderer is None:
+        _renderer = CupRenderer()
+    return _renderer
 
 
 def image_for_scores(scores: Dict[str, int], imgname=None) -> str:
@@ -89,31 +264,11 @@ def image_for_scores(scores: Dict[str, int], imgname=None) -> str:
    Returns: filename containing a house cup image representing the
    scores
     """
-    scaled = calculate_scales(scores)
-
-    overlay = Image.open(IMAGE_PATH)
-
-    bars = Image.new(overlay.mode, overlay.size)
-    for house in HOUSES:
-        draw_bar_for_house(bars, house, scaled[house])
-
-    merged = Image.alpha_composite(bars, overlay)
-
-    font = ImageFont.truetype('BrandonText-Black.otf', 32)
-    draw = ImageDraw.Draw(merged)
-    for house in HOUSES:
-        text = "%d" % scores[house]
-        w, _ = font.getsize(text)
-        draw.text(
-            ((BAR_RECTS[house][0] + BAR_RECTS[house][2] - w) * 0.5,
-             BAR_RECTS[house][3] + BAR_SPACE),
-            text,
-            fill=BAR_COLORS[house][0], font=font)
+    png = get_renderer().png_for_scores(scores)
     if not imgname:
         imgname = str(abs(hash(str(scores))))
-    outfile = os.path.join(tempfile.gettempdir(), imgname + '.png')
-    merged.save(outfile, "PNG")
-    del overlay
-    del bars
-    del merged
+    outfile = os.path.join(tempfile.gettempdir(), "%s.%s" % (
+        imgname, ENCODINGS[IMAGE_MODE].extension))
+    with open(outfile, 'wb') as f:
+        f.write(png)
     return outfile
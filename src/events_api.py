@@ -0,0 +1,188 @@
+"""
+Slack Events API ingestion, instead of the RTM websocket
+
+Slack posts each event to a Request URL and expects a 200 within 3
+seconds, or it retries. EventsServer checks the request's signature, hands
+the event to a bounded WorkerPool and acknowledges straight away, so
+acknowledging never waits for points to be awarded. Each channel's events
+always go to the same worker, which keeps them in order.
+"""
+import hashlib
+import hmac
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+import time
+import zlib
+
+import logs
+import metrics
+from consts import (
+    EVENTS_MAX_AGE, EVENTS_PATH, EVENTS_QUEUE_SIZE, EVENTS_WORKERS
+)
+
+log = logs.get_logger("events_api")
+
+# Tells a worker to stop, once it has handled what was queued before it
+_STOP = object()
+
+
+def signature(secret, timestamp, body: bytes) -> str:
+    """The X-Slack-Signature for a request"""
+    base = b"v0:" + str(timestamp).encode("utf-8") + b":" + body
+    return "v0=" + hmac.new(secret.encode("utf-8"), base,
+                            hashlib.sha256).hexdigest()
+
+
+def verify(secret, timestamp, body: bytes, sig, now=None,
+           max_age=EVENTS_MAX_AGE) -> bool:
+    """Whether a request was signed with `secret`, recently enough that it
+    isn't a replay"""
+    try:
+        age = abs((time.time() if now is None else now) - int(timestamp))
+    except (TypeError, ValueError):
+        return False
+    if age > max_age or not sig:
+        return False
+    return hmac.compare_digest(signature(secret, timestamp, body), sig)
+
+
+class WorkerPool(object):
+    """Threads calling `handler` with events, each with its own queue of at
+    most `queue_size`
+
+    An event goes to the worker its channel hashes to, so events for a
+    channel are handled one at a time, in the order they were submitted.
+    """
+
+    def __init__(self, handler, workers=EVENTS_WORKERS,
+                 queue_size=EVENTS_QUEUE_SIZE):
+        self.handler = handler
+        self.queues = [queue.Queue(queue_size) for _ in range(workers)]
+        self._threads = []
+
+    def start(self):
+        self._threads = [
+            threading.Thread(target=self._work, args=(q,),
+                             name="events-%d" % i, daemon=True)
+            for i, q in enumerate(self.queues)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, event) -> bool:
+        """Queue `event`, or return False if its worker is full"""
+        channel = str(event.get("channel", "")).encode("utf-8")
+        q = self.queues[zlib.crc32(channel) % len(self.queues)]
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            return False
+        return True
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+    def _work(self, q):
+        while True:
+            event = q.get()
+            if event is _STOP:
+                return
+            try:
+                self.handler(event)
+            except Exception:
+                log.exception("Error handling event")
+
+    def stop(self, timeout=None):
+        """Handle everything queued, then stop the workers"""
+        for q in self.queues:
+            q.put(_STOP)
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+class EventsServer(object):
+    """Receives Events API callbacks on `port` and hands their events to
+    a WorkerPool
+
+    Requests without a valid signature get a 401. When the event's worker
+    is full the request gets a 503, and Slack will retry it later.
+    """
+
+    def __init__(self, port, secret, workers=EVENTS_WORKERS,
+                 queue_size=EVENTS_QUEUE_SIZE, host="", path=EVENTS_PATH):
+        self.secret = secret
+        self.path = path
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pool = None
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open between events, and don't hold back
+            # the response body waiting for the client to ACK the headers
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                start = time.perf_counter()
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length)
+                status, response = server.receive(
+                    self.path, body,
+                    self.headers.get("X-Slack-Request-Timestamp"),
+                    self.headers.get("X-Slack-Signature"))
+                response = response.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - start,
+                                              stage="ack")
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def receive(self, path, body: bytes, timestamp, sig):
+        """Status and JSON body of the response to a callback"""
+        if path != self.path:
+            return 404, '{"error": "not_found"}'
+        if not verify(self.secret, timestamp, body, sig):
+            metrics.MESSAGES.inc(result="bad_signature")
+            return 401, '{"error": "invalid_signature"}'
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            return 400, '{"error": "invalid_json"}'
+        if payload.get("type") == "url_verification":
+            return 200, json.dumps({"challenge": payload.get("challenge")})
+        event = payload.get("event")
+        if payload.get("type") != "event_callback" or not event:
+            return 200, "{}"
+        if not self.pool.submit(event):
+            metrics.MESSAGES.inc(result="rejected")
+            return 503, '{"error": "busy"}'
+        return 200, "{}"
+
+    def start(self, handler):
+        """Start taking events, calling `handler` with each in a worker"""
+        self.pool = WorkerPool(handler, self.workers, self.queue_size)
+        self.pool.start()
+        metrics.QUEUE_DEPTH.set_function(self.pool.depth, queue="events")
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        name="events", daemon=True)
+        self._thread.start()
+        log.info("Taking Events API callbacks on port %d", self.port)
+
+    def stop(self):
+        """Stop taking events, and handle the ones already taken"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.pool:
+            self.pool.stop()
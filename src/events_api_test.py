@@ -0,0 +1,176 @@
+"""
+Test taking events from Events API callbacks
+"""
+import asyncio
+import http.client
+import json
+import threading
+import time
+import unittest
+
+import mock
+
+from consts import CHANNEL, EVENTS_PATH
+from events_api import EventsServer, WorkerPool, signature, verify
+from fakes import FakeSlackClient
+import main
+from main import BotRuntime, PointCounter
+
+SECRET = "8f742231b10e8888abcd99yyyzzz85a5"
+TEST_PREFECTS = ["prefect"]
+
+
+def callback(event):
+    return json.dumps({"type": "event_callback", "event_id": "Ev1",
+                       "event": event}).encode("utf-8")
+
+
+def post(port, body, secret=SECRET, timestamp=None, path=EVENTS_PATH):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    conn = http.client.HTTPConnection("localhost", port)
+    conn.request("POST", path, body, {
+        "Content-Type": "application/json",
+        "X-Slack-Request-Timestamp": str(timestamp),
+        "X-Slack-Signature": signature(secret, timestamp, body)})
+    response = conn.getresponse()
+    result = response.status, response.read()
+    conn.close()
+    return result
+
+
+def message(text, channel=CHANNEL, user="prefect"):
+    return {"type": "message", "channel": channel, "user": user,
+            "text": text}
+
+
+class TestSignatures(unittest.TestCase):
+
+    def test_verify(self):
+        body = b"token=xyzz0WbapA4vBCDEFasx0q6G&team_id=T1DC2JH3J"
+        sig = signature(SECRET, 1531420618, body)
+        self.assertTrue(verify(SECRET, "1531420618", body, sig,
+                               now=1531420618))
+        self.assertFalse(verify(SECRET, "1531420618", body + b"&", sig,
+                                now=1531420618))
+        self.assertFalse(verify("other", "1531420618", body, sig,
+                                now=1531420618))
+        # Replayed later
+        self.assertFalse(verify(SECRET, "1531420618", body, sig,
+                                now=1531420618 + 3600))
+        self.assertFalse(verify(SECRET, None, body, sig))
+        self.assertFalse(verify(SECRET, "1531420618", body, None,
+                                now=1531420618))
+
+
+class TestWorkerPool(unittest.TestCase):
+
+    def test_keeps_channel_order(self):
+        handled = []
+        lock = threading.Lock()
+
+        def handler(event):
+            # Later events are quicker, so they'd overtake without ordering
+            time.sleep(0.001 * (event["n"] % 3))
+            with lock:
+                handled.append((event["channel"], event["n"]))
+
+        pool = WorkerPool(handler, workers=4, queue_size=1000)
+        pool.start()
+        for n in range(300):
+            self.assertTrue(pool.submit({"channel": "C%d" % (n % 10),
+                                         "n": n}))
+        pool.stop()
+        self.assertEqual(len(handled), 300)
+        for channel in {c for c, _ in handled}:
+            ns = [n for c, n in handled if c == channel]
+            self.assertEqual(ns, sorted(ns))
+
+    def test_full(self):
+        blocked = threading.Event()
+        pool = WorkerPool(lambda event: blocked.wait(), workers=1,
+                          queue_size=2)
+        pool.start()
+        results = [pool.submit({"channel": "C"}) for _ in range(4)]
+        blocked.set()
+        pool.stop()
+        # The first is taken by the worker, the next two are queued
+        self.assertTrue(all(results[:2]))
+        self.assertFalse(results[3])
+
+
+class TestEventsServer(unittest.TestCase):
+
+    def setUp(self):
+        self.events = []
+        self.server = EventsServer(0, SECRET, workers=2, host="localhost")
+        self.server.start(self.events.append)
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_url_verification(self):
+        status, body = post(self.server.port, json.dumps(
+            {"type": "url_verification", "challenge": "3eZbrw1aB"}).encode())
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {"challenge": "3eZbrw1aB"})
+
+    def test_event(self):
+        event = message("5 points to Gryffindor")
+        self.assertEqual(post(self.server.port, callback(event))[0], 200)
+        self.server.stop()
+        self.assertEqual(self.events, [event])
+
+    def test_rejects_bad_signatures(self):
+        body = callback(message("5 points to Gryffindor"))
+        self.assertEqual(post(self.server.port, body, secret="x")[0], 401)
+        self.assertEqual(post(self.server.port, body,
+                              timestamp=int(time.time()) - 3600)[0], 401)
+        self.assertEqual(post(self.server.port, body, path="/other")[0], 404)
+        self.server.stop()
+        self.assertEqual(self.events, [])
+
+
+class TestEventsRuntime(unittest.TestCase):
+    """The bot awards points from callbacks"""
+
+    def test_awards(self):
+        sc = FakeSlackClient()
+        p = PointCounter(TEST_PREFECTS, reset=True)
+        p.store = None
+        server = EventsServer(0, SECRET, host="localhost")
+        runtime = BotRuntime(sc, p, tick=0.01, events_server=server)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            await asyncio.sleep(0.05)
+            for n in range(1, 6):
+                status, _ = await asyncio.get_running_loop().run_in_executor(
+                    None, post, server.port,
+                    callback(message("%d points to Gryffindor" % n)))
+                self.assertEqual(status, 200)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        self.assertEqual(p.points["Gryffindor"], 15)
+        texts = [kwargs["text"]
+                 for _, kwargs, _ in sc.calls_to("chat.postMessage")]
+        lines = "\n".join(texts).split("\n")
+        self.assertEqual([line.split()[3] for line in lines],
+                         ["1", "2", "3", "4", "5"])
+
+    def test_one_worker(self):
+        """Slack only calls one Request URL, so other workers would never
+        get their events"""
+        with mock.patch("main.USE_EVENTS_API", True), \
+                mock.patch("main.TOURNAMENT_WORKERS", 2), \
+                mock.patch("main.run_worker") as run_worker, \
+                mock.patch("multiprocessing.Process") as process:
+            with self.assertRaises(ValueError):
+                main.main()
+        run_worker.assert_not_called()
+        process.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+"""
+Local stand-ins for the services the bot talks to, for tests and benchmarks
+"""
+from collections import deque
+import random
+import threading
+import time
+
+from google.api_core import exceptions
+
+
+class FakeSlackClient(object):
+    """In-process stand-in for slackclient.SlackClient
+
+    Events given to `push` are returned by the next `rtm_read`. Web API calls
+    sleep `api_latency` seconds, then are recorded in `calls` as
+    (method, kwargs, time.perf_counter()). users.list, users.info and
+    channels.info answer from `users` (id -> name), every member of which is
+    in every channel; other methods answer {"ok": True}.
+
+    With `channel_rate` set, posts and uploads to a channel more often than
+    that many a second are rate limited like Slack does, with a Retry-After
+    of `retry_after` seconds, and recorded in `ratelimited` instead.
+
+    Pushed messages with a ts are also kept as the channel's history, for
+    conversations.history. `kill` drops the RTM connection: rtm_read then
+    raises, and events pushed before the next rtm_connect only make it
+    into the history.
+
+    With `error_rate` set, that fraction of Web API calls fail with an
+    internal_error, recorded in `errors`. Uploaded files' sizes are added
+    up in `bytes_uploaded`.
+    """
+
+    def __init__(self, api_latency=0.0, users=None, channel_rate=None,
+                 retry_after=1, error_rate=0.0, seed=0):
+        self.api_latency = api_latency
+        self.users = users or {}
+        self.channel_rate = channel_rate
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.errors = []
+        self.bytes_uploaded = 0
+        self.connects = 0
+        self.events = deque()
+        self.history = {}
+        self.connected = True
+        self.refuse_connects = 0
+        self.calls = []
+        self.ratelimited = []
+        self.last_post = {}
+        self._lock = threading.Lock()
+
+    def rtm_connect(self, **kwargs):
+        self.connects += 1
+        if self.refuse_connects:
+            self.refuse_connects -= 1
+            return False
+        self.connected = True
+        return True
+
+    def kill(self, refuse_connects=0):
+        """Drop the connection, and refuse the next `refuse_connects`"""
+        self.connected = False
+        self.refuse_connects = refuse_connects
+        self.events.clear()
+
+    def push(self, event):
+        if event.get("type") == "message" and "ts" in event:
+            message = {k: v for k, v in event.items() if k != "channel"}
+            self.history.setdefault(event.get("channel"), []).append(message)
+        if self.connected:
+            self.events.append(event)
+
+    def rtm_read(self):
+        if not self.connected:
+            raise ConnectionError("Connection to RTM lost")
+        batch = []
+        while self.events:
+            batch.append(self.events.popleft())
+        return batch
+
+    def api_call(self, method, timeout=None, **kwargs):
+        if self.api_latency:
+            time.sleep(self.api_latency)
+        with self._lock:
+            now = time.perf_counter()
+            if self._over_rate(method, kwargs, now):
+                self.ratelimited.append((method, kwargs, now))
+                return {"ok": False, "error": "ratelimited",
+                        "headers": {"Retry-After": str(self.retry_after)}}
+            if self.error_rate and self.random.random() < self.error_rate:
+                self.errors.append((method, kwargs, now))
+                return {"ok": False, "error": "internal_error"}
+            self.calls.append((method, kwargs, now))
+        handler = getattr(self, "_" + method.replace(".", "_"), None)
+        return handler(**kwargs) if handler else {"ok": True}
+
+    def _over_rate(self, method, kwargs, now):
+        if not self.channel_rate or method not in ("chat.postMessage",
+                                                   "files.upload"):
+            return False
+        channel = kwargs.get("channel") or kwargs.get("channels")
+        last = self.last_post.get(channel)
+        if last is not None and now - last < 1 / self.channel_rate:
+            return True
+        self.last_post[channel] = now
+        return False
+
+    def _files_upload(self, file=None, **kwargs):
+        if file is not None:
+            data = file[1] if isinstance(file, tuple) else file
+            with self._lock:
+                self.bytes_uploaded += len(data.getvalue())
+        return {"ok": True}
+
+    def _users_list(self, limit=0, cursor=None, **kwargs):
+        ids = sorted(self.users)
+        start = int(cursor or 0)
+        end = start + (limit or len(ids))
+        return {
+            "ok": True,
+            "members": [{"id": i, "name": self.users[i]}
+                        for i in ids[start:end]],
+            "response_metadata": {
+                "next_cursor": str(end) if end < len(ids) else ""},
+        }
+
+    def _users_info(self, user=None, **kwargs):
+        if user not in self.users:
+            return {"ok": False, "error": "user_not_found"}
+        return {"ok": True, "user": {"id": user, "name": self.users[user]}}
+
+    def _channels_info(self, channel=None, **kwargs):
+        return {"ok": True,
+                "channel": {"id": channel, "members": sorted(self.users)}}
+
+    def _conversations_history(self, channel=None, oldest=None, limit=100,
+                               cursor=None, **kwargs):
+        # Newest first, like Slack
+        messages = [m for m in reversed(self.history.get(channel, []))
+                    if oldest is None or float(m["ts"]) > float(oldest)]
+        start = int(cursor or 0)
+        end = start + limit
+        return {
+            "ok": True,
+            "messages": [dict(m) for m in messages[start:end]],
+            "has_more": end < len(messages),
+            "response_metadata": {
+                "next_cursor": str(end) if end < len(messages) else ""},
+        }
+
+    def calls_to(self, method):
+        with self._lock:
+            return [c for c in self.calls if c[0] == method]
+
+
+class FakeBlob(object):
+    def __init__(self, bucket, name, generation=None, metadata=None):
+        self.bucket = bucket
+        self.name = name
+        self.generation = generation
+        self.metadata = metadata
+
+    def upload_from_string(self, data, client=None, if_generation_match=None,
+                           **kwargs):
+        self.bucket.request()
+        with self.bucket.lock:
+            current = self.bucket.generation(self.name)
+            if if_generation_match is not None and \
+                    if_generation_match != current:
+                self.bucket.conflicts += 1
+                raise exceptions.PreconditionFailed(
+                    "generation %s != %s" % (if_generation_match, current))
+            self.bucket.objects[self.name] = data
+            self.bucket.generations[self.name] = current + 1
+            self.bucket.metadata[self.name] = dict(self.metadata or {})
+            self.bucket.uploads += 1
+            lost = self.bucket.lose_next > 0
+            if lost:
+                self.bucket.lose_next -= 1
+        if lost:
+            raise exceptions.GatewayTimeout("injected timeout after upload")
+
+    def download_as_string(self, client=None, **kwargs):
+        self.bucket.request()
+        with self.bucket.lock:
+            return self.bucket.objects[self.name]
+
+
+class FakeBucket(object):
+    """In-memory stand-in for a google.cloud.storage Bucket
+
+    Objects have generations, and uploads honor `if_generation_match` like
+    GCS (0 meaning the object must not exist yet). Every request sleeps
+    `latency` seconds, then fails with a 503 if `fail_next` is set (counting
+    it down) or with probability `failure_rate`. While `lose_next` is set,
+    uploads land but then time out.
+    """
+
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_next = 0
+        self.lose_next = 0
+        self.objects = {}
+        self.generations = {}
+        self.metadata = {}
+        self.uploads = 0
+        self.conflicts = 0
+        self.failures = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def request(self):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            fail = self.fail_next > 0 or \
+                self.random.random() < self.failure_rate
+            if self.fail_next > 0:
+                self.fail_next -= 1
+            if fail:
+                self.failures += 1
+        if fail:
+            raise exceptions.ServiceUnavailable("injected failure")
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.request()
+        with self.lock:
+            if name not in self.objects:
+                return None
+            return FakeBlob(self, name, self.generation(name),
+                            dict(self.metadata.get(name, {})))
+
+    def generation(self, name):
+        if name not in self.objects:
+            return 0
+        # Objects put straight into `objects` are on their first generation
+        return self.generations.get(name, 1)
@@ -1,29 +1,85 @@
+import io
 import unittest
 
+from PIL import Image
+
 from consts import HOUSES
-from cup_image import image_for_scores
+from cup_image import (
+    ENCODINGS, CupRenderer, calculate_scales, calculate_scales_batch,
+    image_for_scores
+)
+
+CASES = {
+    "empty": [0, 0, 0, 0],
+    "extreme": [1, 1200, 1, 1200],
+    "extreme_empty": [0, 1200, 0, 1200],
+    "same_early": [1, 1, 1, 1],
+    "close_early": [1, 10, 1, 20],
+    "same": [400, 400, 400, 400],
+    "close_middle": [610, 620, 580, 600],
+    "close_late": [1000, 1100, 1000, 1200],
+    "leader": [500, 600, 700, 1000],
+}
+
+
+def scores_for(case):
+    return {HOUSES[i]: points for i, points in enumerate(CASES[case])}
 
 
 class TestImageRender(unittest.TestCase):
 
     def test_generate_image(self):
-        cases = {
-            "empty": [0, 0, 0, 0],
-            "extreme": [1, 1200, 1, 1200],
-            "extreme_empty": [0, 1200, 0, 1200],
-            "same_early": [1, 1, 1, 1],
-            "close_early": [1, 10, 1, 20],
-            "same": [400, 400, 400, 400],
-            "close_middle": [610, 620, 580, 600],
-            "close_late": [1000, 1100, 1000, 1200],
-            "leader": [500, 600, 700, 1000],
-        }
-        for case, scores in cases.items():
-            outfile = image_for_scores({
-                HOUSES[i]: scores[i] for i, _ in enumerate(HOUSES)
-            }, imgname=case)
+        for case in CASES:
+            outfile = image_for_scores(scores_for(case), imgname=case)
             print(f"Image outputted to: {outfile}")
 
+    def test_renderer_cache(self):
+        renderer = CupRenderer(cache_size=2)
+        first = renderer.png_for_scores(scores_for("leader"))
+        self.assertIs(first, renderer.png_for_scores(scores_for("leader")))
+
+        renderer.png_for_scores(scores_for("same"))
+        renderer.png_for_scores(scores_for("empty"))
+        self.assertEqual(len(renderer._cache), 2)
+        self.assertNotIn(CupRenderer.cache_key(scores_for("leader")),
+                         renderer._cache)
+
+        # Re-rendering an evicted board gives the same image
+        self.assertEqual(first, renderer.png_for_scores(scores_for("leader")))
+
+    def test_scaled_to_cap(self):
+        scores = scores_for("close_middle")
+        default = calculate_scales(scores)
+        small = calculate_scales(scores, max_points=650)
+        for house in HOUSES:
+            self.assertGreater(small[house], default[house])
+        self.assertEqual(
+            calculate_scales_batch([scores], max_points=650),
+            {house: [scale] for house, scale in small.items()})
+
+        renderer = CupRenderer()
+        self.assertNotEqual(renderer.png_for_scores(scores),
+                            renderer.png_for_scores(scores, max_points=650))
+
+    def test_encodings(self):
+        image = CupRenderer().render(scores_for("leader"))
+        sizes = {}
+        for mode, encoding in ENCODINGS.items():
+            data = encoding.encode(image)
+            sizes[mode] = len(data)
+            decoded = Image.open(io.BytesIO(data))
+            self.assertEqual(decoded.format, encoding.format)
+            self.assertEqual(decoded.size,
+                             (round(image.width * encoding.scale),
+                              round(image.height * encoding.scale)))
+        self.assertLess(sizes["palette"], sizes["png"] / 2)
+        self.assertLess(sizes["webp"], sizes["png"] / 2)
+        self.assertLess(sizes["thumbnail"], sizes["palette"])
+
+        # Lossless WebP keeps every pixel
+        webp = Image.open(io.BytesIO(ENCODINGS["webp"].encode(image)))
+        self.assertEqual(webp.convert("RGBA").tobytes(), image.tobytes())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,209 @@
+"""
+Append-only log of every award, compacted into periodic snapshots
+
+The log lives on local disk so awards survive a crash between
+PointCounter.award_points and the next upload to the bucket. Startup loads
+the latest snapshot and replays only the awards logged after it, and only
+those the store doesn't have yet are written to it again.
+"""
+from collections import Counter
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+import uuid
+
+import logs
+from consts import (
+    LEDGER_FSYNC_BATCH, LEDGER_COMPACT_INTERVAL, LEDGER_COMPACT_EVENTS
+)
+
+log = logs.get_logger("ledger")
+
+LOG_NAME = "ledger.jsonl"
+SNAPSHOT_NAME = "snapshot.json"
+STORED_NAME = "stored.json"
+
+
+class PointsLedger(object):
+    """Local append-only award log with snapshot compaction
+
+    Each award is one JSON line: seq, time, awarder, house, delta (the points
+    asked for), clamped (the points trimmed to keep the house within zero
+    and MAX_POINTS) and the source message ts. Lines are fsync'ed every
+    `fsync_batch` awards, and whenever `sync` is called.
+
+    The seq of the last award written to the store is kept apart from the
+    snapshot, since the log is compacted less often than the store is
+    written. `writer_id` names this ledger's updates to the store, which
+    apply each seq only once.
+    """
+
+    def __init__(self, directory, fsync_batch=LEDGER_FSYNC_BATCH,
+                 compact_interval=LEDGER_COMPACT_INTERVAL,
+                 compact_events=LEDGER_COMPACT_EVENTS):
+        self.directory = directory
+        self.log_path = os.path.join(directory, LOG_NAME)
+        self.snapshot_path = os.path.join(directory, SNAPSHOT_NAME)
+        self.stored_path = os.path.join(directory, STORED_NAME)
+        self.fsync_batch = fsync_batch
+        self.compact_interval = compact_interval
+        self.compact_events = compact_events
+        self.seq = 0
+        self.tail = Counter()
+        self.writer_id = uuid.uuid4().hex
+        self.stored_seq = 0
+        self.unsynced = 0
+        self.since_compaction = 0
+        self.last_compaction = time.time()
+        # Awards are appended by the bot loop while syncs and compactions
+        # run in a worker thread
+        self._lock = threading.RLock()
+        os.makedirs(directory, exist_ok=True)
+        self._log = None
+
+    def load(self) -> Optional[Counter]:
+        """Points as of the last logged award, or None without any history
+
+        The change made by the awards logged since the snapshot that the
+        store doesn't have yet is left in `tail`.
+        """
+        points = None
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path) as f:
+                snapshot = json.load(f)
+            points = Counter(snapshot["points"])
+            snapshot_seq = snapshot["seq"]
+        self.seq = snapshot_seq
+        if os.path.exists(self.stored_path):
+            with open(self.stored_path) as f:
+                stored = json.load(f)
+            self.writer_id = stored["writer"]
+            self.stored_seq = stored["seq"]
+
+        replayed = 0
+        self.tail = Counter()
+        if os.path.exists(self.log_path):
+            points = points if points is not None else Counter()
+            for event in self._read_log():
+                if event["seq"] > snapshot_seq:
+                    delta = event["delta"] + event["clamped"]
+                    points[event["house"]] += delta
+                    if event["seq"] > self.stored_seq:
+                        self.tail[event["house"]] += delta
+                    self.seq = max(self.seq, event["seq"])
+                    replayed += 1
+        self.since_compaction = replayed
+        log.info("Loaded points ledger: seq=%d, replayed %d awards",
+                 self.seq, replayed)
+        return points
+
+    def _read_log(self):
+        with open(self.log_path) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # A torn write from a crash; nothing after it was synced
+                    log.warning("Skipping unreadable ledger line: %r", line)
+                    return
+
+    def append(self, awarder, house, delta, clamped=0, ts=None):
+        with self._lock:
+            self.seq += 1
+            event = {
+                "seq": self.seq,
+                "time": time.time(),
+                "awarder": awarder,
+                "house": house,
+                "delta": delta,
+                "clamped": clamped,
+                "ts": ts,
+            }
+            if self._log is None:
+                self._log = open(self.log_path, "a")
+            self._log.write(json.dumps(event) + "\n")
+            self.unsynced += 1
+            self.since_compaction += 1
+            if self.unsynced >= self.fsync_batch:
+                self.sync()
+
+    def append_many(self, awards):
+        """Append a batch of (awarder, house, delta, clamped, ts) awards"""
+        with self._lock:
+            now = time.time()
+            lines = []
+            for awarder, house, delta, clamped, ts in awards:
+                self.seq += 1
+                lines.append(json.dumps({
+                    "seq": self.seq,
+                    "time": now,
+                    "awarder": awarder,
+                    "house": house,
+                    "delta": delta,
+                    "clamped": clamped,
+                    "ts": ts,
+                }) + "\n")
+            if self._log is None:
+                self._log = open(self.log_path, "a")
+            self._log.write("".join(lines))
+            self.unsynced += len(lines)
+            self.since_compaction += len(lines)
+            if self.unsynced >= self.fsync_batch:
+                self.sync()
+
+    def sync(self):
+        """Make every appended award durable"""
+        with self._lock:
+            if self._log is not None and self.unsynced:
+                self._log.flush()
+                os.fsync(self._log.fileno())
+                self.unsynced = 0
+
+    def due_for_compaction(self) -> bool:
+        return self.since_compaction > 0 and (
+            self.since_compaction >= self.compact_events or
+            time.time() - self.last_compaction >= self.compact_interval)
+
+    def mark_stored(self, seq):
+        """Record that the awards up to `seq` are in the store"""
+        with self._lock:
+            _write_atomically(self.stored_path, json.dumps(
+                {"writer": self.writer_id, "seq": seq}))
+            self.stored_seq = seq
+
+    def compact(self, points: Dict[str, int], seq):
+        """Write `points`, the totals as of award `seq`, as the snapshot and
+        drop the awards it covers from the log"""
+        with self._lock:
+            self.sync()
+            _write_atomically(self.snapshot_path,
+                              json.dumps({"seq": seq, "points": points}))
+            tail = []
+            if os.path.exists(self.log_path):
+                tail = [json.dumps(e) + "\n" for e in self._read_log()
+                        if e["seq"] > seq]
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            _write_atomically(self.log_path, "".join(tail))
+            self.since_compaction = len(tail)
+            self.last_compaction = time.time()
+
+    def close(self):
+        with self._lock:
+            self.sync()
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+
+def _write_atomically(path, data):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
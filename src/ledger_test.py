@@ -0,0 +1,88 @@
+"""
+Test that awards survive a crash through the points ledger
+"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from consts import MAX_POINTS
+from ledger import PointsLedger
+from main import PointCounter
+
+TEST_PREFECTS = ["prefect"]
+
+
+class TestPointsLedger(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def counter(self, **kwargs):
+        p = PointCounter(TEST_PREFECTS, ledger=PointsLedger(self.directory),
+                         **kwargs)
+        p.store = None
+        return p
+
+    def log_lines(self):
+        with open(os.path.join(self.directory, "ledger.jsonl")) as f:
+            return [json.loads(line) for line in f]
+
+    def test_replay_after_crash(self):
+        p = self.counter()
+        p.award_points("10 points to Gryffindor", "prefect", ts="1.0")
+        p.award_points("oNe point from Gryffindor", "prefect", ts="2.0")
+        p.award_points("5 points to everybody", "prefect", ts="3.0")
+        # Crash before any upload, only the periodic sync happened
+        p.write_update(None)
+
+        p2 = self.counter()
+        self.assertEqual(p2.points["Gryffindor"], 14)
+        self.assertEqual(p2.points["Slytherin"], 5)
+
+        event = self.log_lines()[0]
+        self.assertEqual(event["awarder"], "prefect")
+        self.assertEqual(event["house"], "Gryffindor")
+        self.assertEqual(event["delta"], 10)
+        self.assertEqual(event["ts"], "1.0")
+
+    def test_replay_clamping(self):
+        p = self.counter()
+        p.award_points("%d points to Gryffindor" % (MAX_POINTS + 10),
+                       "prefect")
+        p.award_points("20 points from Ravenclaw", "prefect")
+        p.write_update(None)
+
+        self.assertEqual(self.log_lines()[0]["clamped"], -10)
+        p2 = self.counter()
+        self.assertEqual(p2.points["Gryffindor"], MAX_POINTS)
+        self.assertEqual(p2.points["Ravenclaw"], 0)
+
+    def test_compaction(self):
+        p = self.counter()
+        p.award_points("10 points to Gryffindor", "prefect")
+        p.post_update(force=True)
+        self.assertEqual(self.log_lines(), [])
+
+        p.award_points("3 points to Gryffindor", "prefect")
+        p.write_update(None)
+        self.assertEqual(len(self.log_lines()), 1)
+
+        p2 = self.counter()
+        self.assertEqual(p2.points["Gryffindor"], 13)
+
+    def test_reset_drops_history(self):
+        p = self.counter()
+        p.award_points("10 points to Gryffindor", "prefect")
+        p.write_update(None)
+
+        self.counter(reset=True)
+        self.assertEqual(self.counter().points["Gryffindor"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
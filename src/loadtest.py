@@ -0,0 +1,235 @@
+"""
+End-to-end load test of the bot against local fake Slack and GCS services
+
+Run from the `src` directory:
+
+    python loadtest.py --rate 200 --seconds 30
+    python loadtest.py --api-latency 0.05 --slack-errors 0.01 --drops 2
+
+The real `main.main` runs in this process, with slackclient's SlackClient
+replaced by a FakeSlackClient and the points bucket by a FakeBucket. Traffic
+from the TrafficGenerator is pushed to the fake RTM connection at `rate`
+events a second, each award from its own user, so its announcement can be
+found by the awarder's mention. After pushing, the bot is given time to
+post the scoreboard image before it's stopped.
+"""
+import argparse
+import functools
+import json
+import os
+import re
+import shutil
+import signal
+import tempfile
+import threading
+import time
+
+import mock
+
+from consts import (
+    OUTBOX_DRAIN_TIMEOUT, POINTS_FILE, SCOREBOARD_MIN_INTERVAL
+)
+from fakes import FakeBucket, FakeSlackClient
+import main
+import metrics
+from prefects import PrefectResolver
+from traffic import TrafficGenerator
+
+# Only awards are announced whoever makes them
+AWARD_RE = re.compile(r"^\w+ points? to ")
+MENTION_RE = re.compile(r"<@(L\d+)>")
+RESULTS = ("handled", "filtered", "duplicate")
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+class LoadTest(object):
+    """Drives `main.main` with traffic and measures what comes out of it
+
+    :param rate: events pushed a second
+    :param seconds: how long to push them for
+    :param api_latency: seconds every Slack Web API call takes
+    :param slack_errors: fraction of Slack calls that fail
+    :param bucket_latency: seconds every bucket request takes
+    :param bucket_errors: fraction of bucket requests that fail
+    :param drops: times the RTM connection is dropped while pushing
+    :param settle: seconds to wait after pushing before stopping the bot
+    """
+    # Long enough for the scoreboard to go quiet and be posted
+    SETTLE = SCOREBOARD_MIN_INTERVAL + 2
+
+    def __init__(self, rate=100, seconds=10, api_latency=0.01,
+                 slack_errors=0.0, bucket_latency=0.05, bucket_errors=0.0,
+                 drops=0, settle=SETTLE, seed=0):
+        self.rate = rate
+        self.seconds = seconds
+        self.drops = drops
+        self.settle = settle
+        self.seed = seed
+        self.sc = FakeSlackClient(api_latency, users={"U0000": "prefect"},
+                                  error_rate=slack_errors, seed=seed)
+        self.bucket = FakeBucket(latency=bucket_latency,
+                                 failure_rate=bucket_errors, seed=seed)
+        self.bucket.objects[POINTS_FILE] = json.dumps([{}])
+        # Awarder -> when the award was pushed
+        self.pushed = {}
+        self.pushed_events = 0
+        self.feed_seconds = None
+        self.processed = None
+        self.backlog = None
+        self.reconnects = metrics.RTM_RECONNECTS.value()
+
+    def events(self):
+        generator = TrafficGenerator(self.seed)
+        n = 0
+        while True:
+            for event in generator.events(1000):
+                if AWARD_RE.match(event.get("text", "")):
+                    n += 1
+                    event["user"] = "L%07d" % n
+                yield event
+
+    def feed(self):
+        """Push events at `rate` a second for `seconds`, then stop the bot"""
+        while not self.sc.connects:
+            time.sleep(0.01)
+        base = processed()
+        events = self.events()
+        drop_at = [self.seconds * (i + 1) / (self.drops + 1)
+                   for i in range(self.drops)]
+        start = time.perf_counter()
+        elapsed = 0
+        while elapsed < self.seconds:
+            due = int(elapsed * self.rate)
+            while self.pushed_events < due:
+                event = next(events)
+                if event.get("user", "").startswith("L"):
+                    self.pushed[event["user"]] = time.perf_counter()
+                self.sc.push(event)
+                self.pushed_events += 1
+            if drop_at and elapsed >= drop_at[0]:
+                drop_at.pop(0)
+                self.sc.kill(refuse_connects=1)
+            time.sleep(0.005)
+            elapsed = time.perf_counter() - start
+        self.feed_seconds = elapsed
+        self.processed = processed() - base
+        self.backlog = len(self.sc.events)
+        time.sleep(self.settle)
+        os.kill(os.getpid(), signal.SIGTERM)
+
+    def run(self) -> dict:
+        directory = tempfile.mkdtemp()
+        feeder = threading.Thread(target=self.feed, name="loadtest",
+                                  daemon=True)
+        try:
+            with mock.patch("slackclient.SlackClient",
+                            return_value=self.sc), \
+                    mock.patch("main.get_client"), \
+                    mock.patch("main.get_bucket", return_value=self.bucket), \
+                    mock.patch("main.TOURNAMENT_WORKERS", 1), \
+                    mock.patch("main.METRICS_PORT", 0), \
+                    mock.patch("tournaments.LEDGER_DIR", directory), \
+                    mock.patch("main.PrefectResolver", functools.partial(
+                        PrefectResolver, cache_path=os.path.join(
+                            directory, "prefects.json"))), \
+                    open(os.devnull, "w") as devnull, \
+                    mock.patch("sys.stdout", devnull):
+                feeder.start()
+                main.main()
+            feeder.join(OUTBOX_DRAIN_TIMEOUT)
+        finally:
+            shutil.rmtree(directory)
+        return self.results()
+
+    def results(self) -> dict:
+        announced = {}
+        for _, kwargs, when in self.sc.calls_to("chat.postMessage"):
+            for user in MENTION_RE.findall(kwargs.get("text") or ""):
+                announced.setdefault(user, when)
+        latencies = [when - self.pushed[user]
+                     for user, when in announced.items()
+                     if user in self.pushed]
+        calls = {}
+        for method, _, _ in self.sc.calls:
+            calls[method] = calls.get(method, 0) + 1
+        return {
+            "offered/s": self.rate,
+            "events": self.pushed_events,
+            "throughput/s": self.processed / self.feed_seconds,
+            "backlog": self.backlog,
+            "awards": len(self.pushed),
+            "announced": len(latencies),
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "slack calls": calls,
+            "slack errors": len(self.sc.errors),
+            "ratelimited": len(self.sc.ratelimited),
+            "bytes uploaded": self.sc.bytes_uploaded,
+            "bucket uploads": self.bucket.uploads,
+            "bucket failures": self.bucket.failures,
+            "reconnects": metrics.RTM_RECONNECTS.value() - self.reconnects,
+        }
+
+
+def processed():
+    """Events the bot has finished with so far"""
+    return sum(metrics.MESSAGES.value(result=result) for result in RESULTS)
+
+
+def print_results(results):
+    print("offered %d events/s, handled %.0f events/s, %d left unread" % (
+        results["offered/s"], results["throughput/s"], results["backlog"]))
+    print("%d of %d awards announced" % (results["announced"],
+                                         results["awards"]))
+    if results["announced"]:
+        print("receipt to announcement: p50 %.3fs, p95 %.3fs, p99 %.3fs" % (
+            results["p50"], results["p95"], results["p99"]))
+    print("slack calls: %s" % ", ".join(
+        "%s %d" % call for call in sorted(results["slack calls"].items())))
+    print("slack errors %d, rate limited %d, %d bytes uploaded" % (
+        results["slack errors"], results["ratelimited"],
+        results["bytes uploaded"]))
+    print("bucket uploads %d, failures %d; RTM reconnects %d" % (
+        results["bucket uploads"], results["bucket failures"],
+        results["reconnects"]))
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--rate", type=float, default=100,
+                        help="events pushed a second")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--api-latency", type=float, default=0.01)
+    parser.add_argument("--slack-errors", type=float, default=0.0,
+                        help="fraction of Slack calls that fail")
+    parser.add_argument("--bucket-latency", type=float, default=0.05)
+    parser.add_argument("--bucket-errors", type=float, default=0.0,
+                        help="fraction of bucket requests that fail")
+    parser.add_argument("--drops", type=int, default=0,
+                        help="times the RTM connection is dropped")
+    parser.add_argument("--settle", type=float, default=LoadTest.SETTLE,
+                        help="seconds to wait for the last announcements")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    results = LoadTest(
+        rate=args.rate, seconds=args.seconds, api_latency=args.api_latency,
+        slack_errors=args.slack_errors, bucket_latency=args.bucket_latency,
+        bucket_errors=args.bucket_errors, drops=args.drops,
+        settle=args.settle, seed=args.seed).run()
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    run()
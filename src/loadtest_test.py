@@ -0,0 +1,26 @@
+"""
+Test the end-to-end load test harness on a short run
+"""
+import unittest
+
+from loadtest import LoadTest
+
+
+class TestLoadTest(unittest.TestCase):
+
+    def test_short_run(self):
+        results = LoadTest(rate=50, seconds=1, api_latency=0.001,
+                           bucket_latency=0.001, drops=1, settle=2).run()
+        self.assertGreaterEqual(results["events"], 45)
+        self.assertGreater(results["throughput/s"], 0)
+        self.assertGreater(results["awards"], 0)
+        # The outbox is drained when the bot stops, and messages missed
+        # while disconnected are caught up on
+        self.assertEqual(results["announced"], results["awards"])
+        self.assertLessEqual(results["p50"], results["p99"])
+        self.assertGreater(results["slack calls"]["chat.postMessage"], 0)
+        self.assertEqual(results["reconnects"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,106 @@
+"""
+Structured logging for the bot
+
+Records are handed to a queue as they are, and formatted as JSON lines and
+written by a listener thread, so logging costs the bot loop little more
+than a queue put. Fields given as `extra` end up as keys of the JSON
+object. RTM event traces are DEBUG records and are sampled, since every
+event in every channel would otherwise be logged.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+from consts import LOG_LEVEL, LOG_EVENT_SAMPLE, LOG_QUEUE_SIZE
+import metrics
+
+ROOT = "hogwarts"
+
+# Attributes every LogRecord has, which aren't extra fields
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def get_logger(name) -> logging.Logger:
+    return logging.getLogger("%s.%s" % (ROOT, name))
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queues records without formatting them, dropping them when full"""
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.LOGS_DROPPED.inc()
+
+
+class EventSampler(object):
+    """Decides which RTM events get traced: a `rate` fraction of them"""
+
+    def __init__(self, rate=LOG_EVENT_SAMPLE, seed=None):
+        self.rate = rate
+        self._random = random.Random(seed)
+
+    def sample(self) -> bool:
+        return self.rate >= 1 or self._random.random() < self.rate
+
+
+_log = get_logger("events")
+_sampler = EventSampler()
+_listener = None
+
+
+def trace_event(event):
+    """Log a sampled RTM event, if DEBUG logging is on"""
+    if _log.isEnabledFor(logging.DEBUG) and _sampler.sample():
+        _log.debug("event", extra={"event": event})
+
+
+def setup(level=LOG_LEVEL, stream=None, event_sample=LOG_EVENT_SAMPLE,
+          queue_size=LOG_QUEUE_SIZE):
+    """Send the bot's logs through a queue to JSON lines on `stream`"""
+    global _listener, _sampler
+    shutdown()
+    handler = logging.StreamHandler(stream or sys.stdout)
+    handler.setFormatter(JsonFormatter())
+    records = queue.Queue(queue_size)
+    _listener = logging.handlers.QueueListener(records, handler)
+    _listener.start()
+
+    root = logging.getLogger(ROOT)
+    root.handlers = [DroppingQueueHandler(records)]
+    root.setLevel(level)
+    root.propagate = False
+    _sampler = EventSampler(event_sample)
+
+
+def shutdown():
+    """Write out any queued records and stop the listener"""
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+    logging.getLogger(ROOT).handlers = []
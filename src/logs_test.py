@@ -0,0 +1,79 @@
+"""
+Test the queued JSON logging and event trace sampling
+"""
+import io
+import json
+import logging
+import queue
+import unittest
+
+import logs
+import metrics
+
+
+class TestLogs(unittest.TestCase):
+
+    def setUp(self):
+        self.stream = io.StringIO()
+
+    def tearDown(self):
+        logs.shutdown()
+
+    def lines(self):
+        logs.shutdown()
+        return [json.loads(line) for line in self.stream.getvalue().split("\n")
+                if line]
+
+    def test_json_lines(self):
+        logs.setup("INFO", stream=self.stream)
+        log = logs.get_logger("test")
+        log.info("Flushed %d awards", 3, extra=dict(seconds=0.5))
+        log.debug("Not logged")
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            log.exception("Failed")
+        lines = self.lines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(lines[0]["msg"], "Flushed 3 awards")
+        self.assertEqual(lines[0]["level"], "INFO")
+        self.assertEqual(lines[0]["logger"], "hogwarts.test")
+        self.assertEqual(lines[0]["seconds"], 0.5)
+        self.assertIn("ZeroDivisionError", lines[1]["exc"])
+
+    def test_event_traces_need_debug(self):
+        logs.setup("INFO", stream=self.stream, event_sample=1)
+        logs.trace_event({"type": "user_typing"})
+        self.assertEqual(self.lines(), [])
+
+        self.stream = io.StringIO()
+        logs.setup("DEBUG", stream=self.stream, event_sample=1)
+        logs.trace_event({"type": "user_typing"})
+        self.assertEqual(self.lines()[0]["event"], {"type": "user_typing"})
+
+    def test_event_sampling(self):
+        sampler = logs.EventSampler(0.1, seed=0)
+        sampled = sum(sampler.sample() for _ in range(10000))
+        self.assertAlmostEqual(sampled / 10000, 0.1, delta=0.02)
+        self.assertFalse(any(logs.EventSampler(0).sample()
+                             for _ in range(100)))
+
+    def test_formatting_is_left_to_the_listener(self):
+        records = queue.Queue(2)
+        handler = logs.DroppingQueueHandler(records)
+        record = logging.makeLogRecord(
+            {"msg": "%s", "args": ({"type": "message"},)})
+        handler.handle(record)
+        self.assertIs(records.get_nowait(), record)
+        self.assertEqual(record.args, ({"type": "message"},))
+
+    def test_full_queue_drops(self):
+        handler = logs.DroppingQueueHandler(queue.Queue(1))
+        dropped = metrics.LOGS_DROPPED.value()
+        for _ in range(3):
+            handler.handle(logging.makeLogRecord({"msg": "hi"}))
+        self.assertEqual(metrics.LOGS_DROPPED.value(), dropped + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,33 +1,55 @@
 #!/usr/local/bin/python
+import asyncio
 from collections import Counter
-import json
-import os
+import concurrent.futures
+from concurrent.futures import ThreadPoolExecutor
+import io
+import multiprocessing
 import re
+import signal
+import threading
 import time
-from typing import Union, Tuple, Optional, List
+from typing import Dict, Union, Tuple, Optional, List
+import uuid
 
-from google.auth import exceptions
-from slackclient import SlackClient
-import google.cloud.storage
+import requests
 
 import points_util
 import cup_image
+import logs
+import metrics
+import standings
+from events_api import EventsServer
+from ledger import PointsLedger
+from reconnect import Backoff, RecentSet, channel_history
+from persistence import PointsWriter
+from prefects import PrefectResolver
+from render_service import RenderService
+from scoreboard import ScoreboardScheduler
+from outbox import Outbox, ANNOUNCEMENT, SAYS
+from storage import BucketStore, PointsStore, SqliteStore, clamp
+from tournaments import (
+    DEFAULT_NAME, Tournament, TournamentRegistry, load_tournaments
+)
 from consts import (
     HOUSES, SLACK_TOKEN, PREFECTS, ANNOUNCERS, CHANNEL, ADMIN_CHANNEL,
-    POINTS_FILE, BUCKET_NAME, PUBLIC_CHANNEL, MAX_POINTS, BOT_ID,
-    SPECIAL_SUBJECT
+    POINTS_FILE, BUCKET_NAME, MAX_POINTS, BOT_ID, IMAGE_MODE,
+    SPECIAL_SUBJECT, UPLOAD_TIMEOUT, RTM_POLL_INTERVAL, RUNTIME_WORKERS,
+    TOURNAMENT_WORKERS, OUTBOX_DRAIN_TIMEOUT, METRICS_PORT, MAX_LOOP_LAG,
+    USE_EVENTS_API, EVENTS_PORT, SLACK_SIGNING_SECRET, STORE_LOAD_RETRY_BASE,
+    STORE_LOAD_RETRY_MAX, POINTS_STORE, SQLITE_PATH
 )
 
+log = logs.get_logger("main")
 
-nth = {
-    1: "first",
-    2: "second",
-    3: "third",
-    4: "fourth"
-}
+# Standings asked for before the stored points are loaded
+LOADING_REPLY = "The house points are still loading, ask again in a moment"
 
 
 def get_client():
+    # Imported on first use: it's slow to import and isn't needed until
+    # the points are loaded
+    import google.cloud.storage
     return google.cloud.storage.Client()
 
 
@@ -35,40 +57,204 @@ def get_bucket(client):
     return client.get_bucket(BUCKET_NAME)
 
 
+def get_store(points_file, max_points=MAX_POINTS, kind=None) -> PointsStore:
+    """The store for `points_file`, of the POINTS_STORE kind by default"""
+    if (kind or POINTS_STORE) == "sqlite":
+        return SqliteStore(SQLITE_PATH, points_file, max_points=max_points)
+    client = get_client()
+    return BucketStore(get_bucket(client), points_file, client,
+                       max_points=max_points)
+
+
 class PointCounter(object):
     def __init__(self, prefects=PREFECTS,
                  announcers=ANNOUNCERS, points_file=POINTS_FILE,
-                 reset=False):
-        self.client = None
-        self.bucket = None
-        try:
-            self.client = get_client()
-            self.bucket = get_bucket(self.client)
-            data = json.loads(
-                self.bucket.get_blob(points_file).download_as_string())
-            self.points = Counter(data[0])
-        except (exceptions.DefaultCredentialsError, AttributeError) as e:
-            print("Exception reading points file!\n%s" % e)
-            self.points = Counter()
+                 reset=False, ledger=None, houses=HOUSES,
+                 max_points=MAX_POINTS, admin_channel=ADMIN_CHANNEL,
+                 background_load=False):
+        """
+        :param ledger: a PointsLedger recording every award. When it has
+            history, the points are restored from it instead of the store.
+        :param reset: start from zero points, overwriting the stored points
+            on the first update
+        :param background_load: open the points store (see `get_store`),
+            and read it if need be, on a background thread. Awards can be
+            made straight away, starting from the ledger's snapshot (or
+            zero), and are merged with the stored points once they are
+            read.
+        """
+        self.store = None
+        self.ledger = ledger
+        restored = ledger.load() if ledger else None
         if reset:
-            self.points = Counter()
+            restored = None
+        self.points = Counter() if restored is None else restored
+        # Awards not written to the store yet, in total and one by one
+        self.deltas = Counter()
+        self.awards: List[tuple] = []
+        if restored is not None:
+            self.deltas.update(ledger.tail)
+        # Without history of our own, the stored points are the starting
+        # point
+        self._read_store = restored is None and not reset
+        self.overwrite_store = reset
+        self.houses = list(houses)
+        self.max_points = max_points
+        self.admin_channel = admin_channel
         self.prefects = prefects
         self.announcers = announcers
         self.points_file = points_file
-        self.points_dirty = False
+        self.points_dirty = bool(self.deltas) or reset
+        # House awards since the last pending_update
+        self.dirty_awards = 0
+        # Names our updates to the store, numbered by the ledger's seq if
+        # there is one, so the store applies each of them once
+        self.writer_id = ledger.writer_id if ledger else uuid.uuid4().hex
+        self.updates = 0
+        # Held while points change or are snapshotted, so snapshots can be
+        # taken from a background writer
+        self.lock = threading.RLock()
+        self.index = standings.StandingsIndex(self.points, self.houses)
+        # Set once the store is loaded (or known to be unavailable); no
+        # updates are written before then
+        self.store_loaded = threading.Event()
+        if background_load:
+            threading.Thread(target=self.load_store, name="load-points",
+                             kwargs=dict(seq=ledger.seq if ledger else 0),
+                             daemon=True).start()
+        else:
+            self.load_store()
+
+    def load_store(self, backoff=None, seq=None):
+        """Open the points store, and catch up with the stored points if the
+        ledger didn't have them
+
+        Failures other than missing credentials are retried. `seq` is the
+        ledger's seq before any award made while loading, which stay in the
+        log until they're stored.
+        """
+        from google.auth import exceptions
+        backoff = backoff or Backoff(STORE_LOAD_RETRY_BASE,
+                                     STORE_LOAD_RETRY_MAX)
+        if seq is None:
+            seq = self.ledger.seq if self.ledger else 0
+        while True:
+            store = None
+            try:
+                store = get_store(self.points_file, self.max_points)
+                stored = store.read()[0] if self._read_store else None
+                break
+            except (exceptions.DefaultCredentialsError, AttributeError) as e:
+                log.warning("Exception reading points file: %s", e)
+                store = stored = None
+                break
+            except Exception:
+                if store is None:
+                    # Getting the bucket failed; failed reads of the points
+                    # file are counted by the store
+                    metrics.GCS_ERRORS.inc(operation="read")
+                delay = backoff.next()
+                log.exception("Couldn't load the points, retrying in %.1fs",
+                              delay)
+                time.sleep(delay)
+        with self.lock:
+            self.store = store
+            if stored is not None:
+                self.merge_stored(stored)
+            elif self.loading():
+                # Nothing to add the awards to, so they're clamped as they
+                # are
+                self.merge_stored(Counter())
+            if self.ledger and (self._read_store or self.overwrite_store):
+                # Start the ledger's history from what the bucket had
+                self.ledger.compact(dict(stored or {}), seq)
+            # Under the lock, so no award is left unclamped
+            self.store_loaded.set()
+
+    def loading(self) -> bool:
+        """Whether the points are only the awards made since starting, with
+        the stored points still to be added to them
+
+        They aren't clamped until then: that's left to `merge_stored`.
+        """
+        return self._read_store and not self.store_loaded.is_set()
+
+    def post_update(self, force=False):
+        self.write_update(self.pending_update(force=force))
 
-    def post_update(self):
-        if self.points_dirty:
+    def pending_update(self, force=False) -> Optional[dict]:
+        """The awards to write, if there are any
+
+        The update can be handed to `write_update` on any thread, and
+        handed again if that fails. The ledger is compacted with it when
+        that's due, or with `force`.
+        """
+        with self.lock:
+            if not self.points_dirty or not self.store_loaded.is_set():
+                return None
             self.points_dirty = False
-            if self.bucket:
-                self.bucket.blob(self.points_file).upload_from_string(
-                    # NOTE: we post as array in format for KPI datatset
-                    json.dumps([self.points]), client=self.client)
+            self.dirty_awards = 0
+            deltas, self.deltas = self.deltas, Counter()
+            awards, self.awards = self.awards, []
+            if self.ledger:
+                seq = self.ledger.seq
             else:
-                print("No bucket setting found - not updating.")
-
-    def get_points_from(self, message, awarder):
-        amount = points_util.detect_points(message)
+                self.updates += 1
+                seq = self.updates
+            return {
+                "points": dict(self.points),
+                "deltas": dict(deltas),
+                "awards": awards,
+                "seq": seq,
+                "compact": bool(self.ledger) and (
+                    force or self.ledger.due_for_compaction()),
+            }
+
+    def write_update(self, update: Optional[dict]):
+        if self.ledger:
+            self.ledger.sync()
+        if not update:
+            return
+        stored = update["points"]
+        if self.store:
+            if self.overwrite_store:
+                stored = self.store.apply(update["points"], base=Counter(),
+                                          awards=update["awards"],
+                                          writer=self.writer_id,
+                                          seq=update["seq"])
+                self.overwrite_store = False
+            else:
+                # Skipped by the store if an earlier attempt got through
+                stored = self.store.apply(update["deltas"],
+                                          awards=update["awards"],
+                                          writer=self.writer_id,
+                                          seq=update["seq"])
+            self.merge_stored(stored)
+            if self.ledger:
+                self.ledger.mark_stored(update["seq"])
+        else:
+            log.info("No bucket setting found - not updating.")
+        if update["compact"]:
+            try:
+                self.ledger.compact(dict(stored), update["seq"])
+            except Exception as e:
+                # The awards are stored; the log keeps them until the next
+                # compaction that's due
+                log.warning("Exception compacting the points ledger: %s", e)
+
+    def merge_stored(self, stored):
+        """Catch up with the stored points, which include other instances'
+        awards"""
+        with self.lock:
+            self.points = Counter({
+                house: clamp(stored.get(house, 0) + self.deltas[house],
+                             self.max_points)
+                for house in set(stored) | set(self.deltas)
+            })
+            self.index.set_points(self.points)
+
+    def get_points_from(self, message, awarder, parsed=None):
+        amount = (parsed or points_util.parse(message)).points
         # only prefects can award over one point at a time
         if awarder not in self.prefects:
             amount = max(min(amount, 1), 0)
@@ -115,129 +301,671 @@ class PointCounter(object):
             f"{points_util.pluralized_points(abs(points))} " \
             f"{cls.get_house_emoji(house)} {down_icon}"
 
-    def award_points(self, message, awarder, channel=None
-                     ) -> List[Union[str, Tuple[str, str]]]:
-        points = self.get_points_from(message, awarder)
-        houses = points_util.get_houses_from(message)
+    def award_points(self, message, awarder, channel=None, parsed=None,
+                     ts=None) -> List[Union[str, Tuple[str, str]]]:
+        """Award the points in `message`
+
+        :param parsed: the message's ParsedMessage, if already parsed
+        :param ts: the Slack timestamp of the message, for the ledger
+        """
+        points, houses, special_user, reason, says = self._award_in(
+            message, awarder, parsed)
+        messages = []
+        if points and houses:
+            with self.lock:
+                for house in houses:
+                    messages.extend(self._award_house(
+                        house, points, awarder, special_user, reason, ts))
+        elif special_user and channel == self.admin_channel and says:
+            messages.append((says, special_user))
+
+        return messages
+
+    def _award_in(self, message, awarder, parsed=None):
+        """The points, houses, special user, reason and "says" text of the
+        award in `message`"""
+        parsed = parsed or points_util.parse(message)
+        points = self.get_points_from(message, awarder, parsed=parsed)
+        houses = [h for h in parsed.houses if h in self.houses]
         special_user: Optional[str] = None
         reason = ''
         says = ''
         if awarder in self.prefects:
-            special_user = points_util.get_subject_from(message)
-            reason = points_util.get_reason(message)
-            says = points_util.get_says(message)
-        print(f"Rendering message: houses={houses}, points={points} special_user={special_user}")
-        messages = []
-        if points and houses:
-            for house in houses:
-                self.points[house] += points
-                self.points_dirty = True
-                messages.append(self.message_for(house, points, awarder,
-                                                 special_user=special_user,
-                                                 reason=reason))
-                if self.points[house] > MAX_POINTS:
-                    self.points[house] = MAX_POINTS
-                    messages.append(
-                        "%s already has the maximum number of points!" % house)
-                elif self.points[house] < 0:
-                    self.points[house] = 0
+            special_user = parsed.subject
+            reason = parsed.reason
+            says = parsed.says
+        log.debug("Rendering message", extra=dict(
+            houses=houses, points=points, special_user=special_user))
+        return points, houses, special_user, reason, says
+
+    def award_many(self, events: List[dict], parsed=None
+                   ) -> Tuple[Dict[str, dict], List[list]]:
+        """Award the points in a batch of messages, e.g. an rtm_read()
+
+        The points end up as if `award_points` had been called on each
+        message in turn, clamping included, but each house's points and
+        standings are only updated once.
+
+        :param events: messages with their "text", "user", and optionally
+            "channel" and "ts"
+        :param parsed: each message's ParsedMessage, if already parsed
+        :return: a summary of each house awarded points, with its new
+            "points", the net "delta" applied, the number of "awards" and
+            the points "clamped" away; and, for each message, what
+            `award_points` would have returned
+        """
+        attributions = [[] for _ in events]
+        awards = []
+        for i, event in enumerate(events):
+            points, houses, special_user, reason, says = self._award_in(
+                event["text"], event["user"], parsed and parsed[i])
+            if points and houses:
+                awards.extend((i, house, points, special_user, reason)
+                              for house in houses)
+            elif special_user and event.get("channel") == \
+                    self.admin_channel and says:
+                attributions[i].append((says, special_user))
+        if not awards:
+            return {}, attributions
+
+        summary = {}
+        recorded = []
+        with self.lock:
+            loading = self.loading()
+            for i, house, points, special_user, reason in awards:
+                awarder = events[i]["user"]
+                house_summary = summary.get(house)
+                if house_summary is None:
+                    house_summary = summary[house] = {
+                        "points": self.points[house], "delta": 0,
+                        "awards": 0, "clamped": 0}
+                # Clamped after each award, like award_points
+                total = house_summary["points"] + points
+                messages = attributions[i]
+                messages.append(self.message_for(
+                    house, points, awarder, special_user=special_user,
+                    reason=reason))
+                clamped = 0
+                if not loading and total > self.max_points:
+                    clamped = self.max_points - total
+                    metrics.CLAMPS.inc(limit="max")
                     messages.append(
-                        "%s already at zero points!" % house)
-        elif special_user and channel == ADMIN_CHANNEL and says:
-            messages.append((says, special_user))
-
+                        "%s already has the maximum number of points!"
+                        % house)
+                elif not loading and total < 0:
+                    clamped = -total
+                    metrics.CLAMPS.inc(limit="zero")
+                    messages.append("%s already at zero points!" % house)
+                house_summary["points"] = total + clamped
+                house_summary["delta"] += points + clamped
+                house_summary["awards"] += 1
+                house_summary["clamped"] += clamped
+                recorded.append((awarder, house, points, clamped,
+                                 events[i].get("ts")))
+
+            for house, house_summary in summary.items():
+                self.points[house] = house_summary["points"]
+                self.deltas[house] += house_summary["delta"]
+            self.points_dirty = True
+            self.dirty_awards += len(recorded)
+            now = time.time()
+            self.awards.extend((now,) + award for award in recorded)
+            self.index.record_many(
+                (awarder, house, points + clamped, _award_time(ts))
+                for awarder, house, points, clamped, ts in recorded)
+            if self.ledger:
+                self.ledger.append_many(recorded)
+        return summary, attributions
+
+    def _award_house(self, house, points, awarder, special_user, reason, ts):
+        messages = []
+        self.points[house] += points
+        self.points_dirty = True
+        self.dirty_awards += 1
+        messages.append(self.message_for(house, points, awarder,
+                                         special_user=special_user,
+                                         reason=reason))
+        clamped = 0
+        # While loading, `merge_stored` clamps them instead
+        loading = self.loading()
+        if not loading and self.points[house] > self.max_points:
+            clamped = self.max_points - self.points[house]
+            self.points[house] = self.max_points
+            metrics.CLAMPS.inc(limit="max")
+            messages.append(
+                "%s already has the maximum number of points!" % house)
+        elif not loading and self.points[house] < 0:
+            clamped = -self.points[house]
+            self.points[house] = 0
+            metrics.CLAMPS.inc(limit="zero")
+            messages.append(
+                "%s already at zero points!" % house)
+        self.deltas[house] += points + clamped
+        self.awards.append((time.time(), awarder, house, points, clamped, ts))
+        self.index.record(awarder, house, points + clamped, _award_time(ts))
+        if self.ledger:
+            self.ledger.append(awarder, house, points, clamped, ts)
         return messages
 
     def print_status(self):
-        for place, (house, points) in enumerate(sorted(self.points.items(), key=lambda x: x[-1])):
-            yield "In %s place, %s with %d points" % (
-                nth[len(HOUSES) - place], house, points)
-
-
-def is_hogwarts_related(message):
-    return (
+        if self.loading():
+            yield LOADING_REPLY
+            return
+        with self.lock:
+            lines = standings.status(self.index)
+        yield from reversed(lines)
+
+    def answer_query(self, parsed, user, channel=None) -> Optional[str]:
+        """The reply to a standings query, if it's from an announcer in the
+        admin channel"""
+        if channel != self.admin_channel or user not in self.announcers:
+            return None
+        if self.loading():
+            return LOADING_REPLY
+        with self.lock:
+            return standings.answer(self.index, parsed.text)
+
+
+def _award_time(ts) -> Optional[float]:
+    """When the award with Slack timestamp `ts` was made"""
+    try:
+        return float(ts)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_hogwarts_related(message, channels=frozenset({CHANNEL, ADMIN_CHANNEL})
+                        ) -> Optional[points_util.ParsedMessage]:
+    """Return the parsed message text if the bot should act on it
+
+    The result can be handed to PointCounter.award_points to save parsing
+    the text twice.
+
+    :param channels: the channels the bot listens on
+    """
+    if not (
         message.get("type", '') == "message" and
-        message.get("channel", '') in {CHANNEL, ADMIN_CHANNEL} and
+        message.get("channel", '') in channels and
         "text" in message and
-        ("user" in message and message["user"] != BOT_ID) and
-        (
-            # Points message
-            ("point" in message["text"].lower() and
-                points_util.get_houses_from(message["text"])) or
-            # Simple says
-            ("say" in message["text"].lower() and
-                points_util.get_subject_from(message["text"]))
-        )
-    )
-
-
-def convert_name_to_id(sc, channel, prefect_names):
-    """Convert the given username into ids"""
-    prefect_ids = []
-
-    prefect_name_set = set(prefect_names)
-    channel_info = sc.api_call("channels.info", channel=channel)
-    user_list = channel_info['channel']['members']
-
-    for user_id in user_list:
-        profile = sc.api_call("users.info", user=user_id)
-        user_name = profile.get('user', {}).get('name')
-        if user_name in prefect_name_set:
-            prefect_ids.append(user_id)
-
-    print("Got prefect ids: {}".format(prefect_ids))
+        ("user" in message and message["user"] != BOT_ID)
+    ):
+        return None
+    if not points_util.maybe_relevant(message["text"]):
+        return None
+    with metrics.STAGE_SECONDS.time(stage="parse"):
+        parsed = points_util.parse(message["text"])
+    if (
+        # Points message
+        ("point" in parsed.text and parsed.houses) or
+        # Simple says
+        ("say" in parsed.text and parsed.subject) or
+        standings.is_query(parsed.text)
+    ):
+        return parsed
+    return None
+
+
+def announcement_for(m, channel=CHANNEL) -> dict:
+    """chat.postMessage arguments for a message returned by award_points"""
+    if isinstance(m, tuple):
+        m, special_char = m
+        slack_info = SPECIAL_SUBJECT.get(special_char, {})
+        return dict(channel=channel, as_user=False,
+                    username=slack_info.get('name'),
+                    icon_emoji=slack_info.get('emoji'),
+                    text=m)
+    return dict(channel=channel, as_user=True, text=m)
+
+
+def upload_scores_image(sc, scores, channel=CHANNEL, timeout=UPLOAD_TIMEOUT,
+                        rendering=None, max_points=MAX_POINTS):
+    """Upload the house cup image for `scores` to `channel`
+
+    The image is streamed from memory through the Slack client, so no temp
+    file is written and the token never ends up on a command line.
+
+    :param rendering: a RenderService future of the image, if it's already
+        being rendered
+    :param max_points: the cap the bars are scaled towards
+    """
+    if rendering is None:
+        png = cup_image.get_renderer().png_for_scores(scores, max_points)
+    else:
+        try:
+            png = rendering.result()
+        except concurrent.futures.CancelledError:
+            # A newer scoreboard is queued behind this one
+            log.info("Skipping stale scoreboard")
+            return {"ok": True}
+    start = time.time()
+    try:
+        with metrics.STAGE_SECONDS.time(stage="upload_image"):
+            encoding = cup_image.ENCODINGS[IMAGE_MODE]
+            filename = "house_points." + encoding.extension
+            response = sc.api_call(
+                "files.upload", timeout=timeout,
+                file=(filename, io.BytesIO(png), encoding.mime),
+                filename=filename, title="House Points", channels=channel)
+    except requests.exceptions.RequestException as e:
+        log.warning("Exception uploading image: %s", e)
+        return None
+    log.info("Uploaded image", extra=dict(
+        bytes=len(png), seconds=round(time.time() - start, 3),
+        ok=response.get("ok")))
+    return response
+
+
+class BotRuntime(object):
+    """Asyncio runtime for the bot
+
+    RTM events are dispatched as soon as they are read. Slack calls, image
+    renders and bucket uploads run in a thread pool so they never hold up
+    message handling, and posts to Slack go through a rate limited Outbox.
+    Given a RenderService, images are rendered in its processes instead.
+    Given an EventsServer, events come from Events API callbacks and are
+    handled on its worker threads.
+    """
+
+    def __init__(self, sc, counter=None, scoreboard=None, executor=None,
+                 writer=None, poll_interval=RTM_POLL_INTERVAL, tick=1,
+                 stop_signals=(), tournaments=None, renderer=None,
+                 events_server=None, backoff=None):
+        """
+        :param tournaments: a TournamentRegistry of started tournaments.
+            Without it, `counter` (and optionally `scoreboard` and `writer`)
+            make up the default tournament.
+        :param events_server: an events_api.EventsServer to take events
+            from, instead of RTM
+        :param backoff: the reconnect.Backoff between RTM connection
+            attempts
+        """
+        self.sc = sc
+        if tournaments is None:
+            t = Tournament(DEFAULT_NAME)
+            t.counter, t.scoreboard, t.writer = counter, scoreboard, writer
+            tournaments = TournamentRegistry([t])
+        for t in tournaments:
+            t.scoreboard = t.scoreboard or ScoreboardScheduler(
+                houses=t.houses, max_points=t.max_points)
+            t.writer = t.writer or PointsWriter(t.counter)
+        self.tournaments = tournaments
+        metrics.QUEUE_DEPTH.set_function(
+            lambda: sum(t.writer.queue_depth() for t in tournaments),
+            queue="points")
+        # Signals that stop the bot after a final flush of the points
+        self.stop_signals = stop_signals
+        self.executor = executor or ThreadPoolExecutor(RUNTIME_WORKERS)
+        self.poll_interval = poll_interval
+        # How often the scoreboard is checked
+        self.tick = tick
+        self.outbox = Outbox(sc, self.in_executor)
+        self.renderer = renderer
+        self.events_server = events_server
+        metrics.QUEUE_DEPTH.set_function(self.outbox.depth, queue="slack")
+        self.backoff = backoff or Backoff()
+        # Messages already handled, and the latest ts handled per channel,
+        # to catch up from after a reconnect
+        self.processed = RecentSet()
+        self.last_ts: Dict[str, str] = {}
+        # When rtm_read last succeeded
+        self.last_read = None
+        self.connected = False
+        self.loop = None
+        self.running = False
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.running = True
+        for sig in self.stop_signals:
+            self.loop.add_signal_handler(sig, self.stop)
+        for t in self.tournaments:
+            t.writer.start()
+        outbox = self.loop.create_task(self.outbox.run())
+        background = [self.loop.create_task(self.refresh_scoreboard()),
+                      self.loop.create_task(self.measure_loop_lag())]
+        try:
+            if self.events_server:
+                await self.serve_events()
+            else:
+                await self.read_events()
+        finally:
+            for task in background:
+                task.cancel()
+            await asyncio.gather(*background, return_exceptions=True)
+            if not await self.outbox.drain(OUTBOX_DRAIN_TIMEOUT):
+                log.warning("Dropping %d unsent Slack posts",
+                            self.outbox.depth())
+            outbox.cancel()
+            await asyncio.gather(outbox, return_exceptions=True)
+            await asyncio.gather(*[self.in_executor(t.writer.stop)
+                                   for t in self.tournaments])
+
+    def stop(self):
+        self.running = False
+
+    def ready(self) -> bool:
+        """Whether the bot is handling events, and keeping up with them"""
+        return (self.running and
+                (self.connected or self.events_server is not None) and
+                metrics.LOOP_LAG.value() < MAX_LOOP_LAG)
+
+    async def measure_loop_lag(self):
+        while True:
+            start = self.loop.time()
+            await asyncio.sleep(self.tick)
+            metrics.LOOP_LAG.set(self.loop.time() - start - self.tick)
+
+    async def read_events(self):
+        await self.connect()
+        while self.running:
+            try:
+                events = self.sc.rtm_read()
+            except Exception as e:
+                log.warning("Lost the RTM connection: %r", e)
+                metrics.RTM_RECONNECTS.inc()
+                self.connected = False
+                if await self.connect():
+                    await self.catch_up()
+                continue
+            self.last_read = time.time()
+            self.dispatch_batch(events)
+            if events:
+                # Let the announcements get going before reading again
+                await asyncio.sleep(0)
+            else:
+                await self.wait_readable()
+
+    async def connect(self) -> bool:
+        """Connect to RTM, retrying until connected or stopped"""
+        while self.running:
+            try:
+                self.connected = bool(
+                    await self.in_executor(self.sc.rtm_connect))
+            except Exception as e:
+                log.warning("Exception connecting to RTM: %r", e)
+            if self.connected:
+                self.backoff.reset()
+                if self.last_read is None:
+                    self.last_read = time.time()
+                return True
+            delay = self.backoff.next()
+            log.warning("RTM connection failed, retrying in %.1fs", delay)
+            await asyncio.sleep(delay)
+        return False
+
+    async def catch_up(self):
+        """Handle the messages posted while disconnected
+
+        Each channel's history is read from the last message handled in it,
+        or from the last successful read. A channel whose history can't be
+        read is skipped.
+        """
+        channels = sorted(set().union(*[t.channels
+                                         for t in self.tournaments]))
+        since = "%.6f" % self.last_read
+        histories = await asyncio.gather(*[
+            self.in_executor(channel_history, self.sc, channel,
+                             self.last_ts.get(channel, since))
+            for channel in channels], return_exceptions=True)
+        missed = []
+        for channel, history in zip(channels, histories):
+            if isinstance(history, Exception):
+                log.warning("Couldn't catch up on %s: %r", channel, history)
+                continue
+            missed.extend(history)
+        log.info("Caught up on %d messages", len(missed))
+        self.dispatch_batch(missed)
+
+    async def serve_events(self):
+        """Take events from Events API callbacks until stopped"""
+        self.events_server.start(self.handle_in_worker)
+        try:
+            while self.running:
+                await asyncio.sleep(self.tick)
+        finally:
+            # Awards already acknowledged still get made
+            await self.in_executor(self.events_server.stop)
+            await asyncio.sleep(0)
+
+    async def wait_readable(self):
+        """Wait for the RTM websocket to have data, or `poll_interval`"""
+        websocket = getattr(getattr(self.sc, 'server', None), 'websocket',
+                            None)
+        if websocket is None:
+            await asyncio.sleep(self.poll_interval)
+            return
+        fd = websocket.sock.fileno()
+        ready = self.loop.create_future()
+        self.loop.add_reader(
+            fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            # Still time out, as TLS may have buffered data already
+            await asyncio.wait_for(ready, self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.loop.remove_reader(fd)
+
+    def dispatch_batch(self, events):
+        """Dispatch an rtm_read() batch, awarding each tournament's points
+        in one go"""
+        for result in self.handle_batch(events):
+            self.deliver(*result)
+
+    def dispatch(self, message):
+        """Handle one RTM event"""
+        self.deliver(*self.handle(message))
+
+    def handle(self, message
+               ) -> Tuple[Optional[Tournament], List[Tuple[dict, int]]]:
+        """Award the points in one event, off the loop if need be
+
+        Returns the tournament whose points changed, if any, and the posts
+        to make with their priorities, for `deliver`.
+        """
+        return self.handle_batch([message])[0]
+
+    def handle_batch(self, messages
+                     ) -> List[Tuple[Optional[Tournament],
+                                     List[Tuple[dict, int]]]]:
+        """`handle` each of `messages`
+
+        The awards for each tournament are made with a single
+        PointCounter.award_many.
+        """
+        results = [(None, [])] * len(messages)
+        # Tournament -> the index, message and parse of each award
+        awards: Dict[Tournament, list] = {}
+
+        def award(t):
+            batch = awards.pop(t, None)
+            if not batch:
+                return
+            start = time.perf_counter()
+            _, attributions = t.counter.award_many(
+                [message for _, message, _ in batch],
+                parsed=[parsed for _, _, parsed in batch])
+            # Timed per message, as when they were awarded one at a time
+            seconds = (time.perf_counter() - start) / len(batch)
+            for (i, _, _), awarded in zip(batch, attributions):
+                metrics.STAGE_SECONDS.observe(seconds, stage="award_points")
+                results[i] = self.posts_for(t, awarded)
+
+        for i, message in enumerate(messages):
+            logs.trace_event(message)
+            if not self.first_delivery(message):
+                metrics.MESSAGES.inc(result="duplicate")
+                continue
+            t = self.tournaments.route(message)
+            parsed = t and is_hogwarts_related(message, t.channels)
+            if not parsed:
+                metrics.MESSAGES.inc(result="filtered")
+                continue
+            metrics.MESSAGES.inc(result="handled")
+            if standings.is_query(parsed.text):
+                # Answered with the awards made before the query
+                award(t)
+                answer = t.counter.answer_query(parsed, message['user'],
+                                                channel=message['channel'])
+                if answer:
+                    results[i] = None, [(announcement_for(
+                        answer, message['channel']), SAYS)]
+                continue
+            awards.setdefault(t, []).append((i, message, parsed))
+        for t in list(awards):
+            award(t)
+        return results
+
+    @staticmethod
+    def posts_for(t: Tournament, awarded
+                  ) -> Tuple[Optional[Tournament], List[Tuple[dict, int]]]:
+        """The `handle` result for the messages from one award"""
+        announcements = [announcement_for(m, t.channel) for m in awarded]
+        # HACK: Avoid seeing "says" messages
+        if any('point' in a['text'] for a in announcements):
+            return t, [(kwargs, ANNOUNCEMENT) for kwargs in announcements]
+        return None, [(kwargs, SAYS) for kwargs in announcements]
+
+    def first_delivery(self, message) -> bool:
+        """Record a message as handled, returning False if it already was"""
+        ts, channel = message.get("ts"), message.get("channel")
+        if message.get("type") != "message" or not ts or not channel:
+            return True
+        if not self.processed.add((channel, ts)):
+            return False
+        # A channel's messages are handled one at a time
+        if float(ts) > float(self.last_ts.get(channel, 0)):
+            self.last_ts[channel] = ts
+        return True
+
+    def deliver(self, changed: Optional[Tournament], posts):
+        """Queue the results of `handle`; on the loop"""
+        if changed:
+            changed.scoreboard.note_change()
+            changed.writer.notify()
+        for kwargs, priority in posts:
+            self.outbox.post(kwargs, priority)
+
+    def handle_in_worker(self, event):
+        """Handle an Events API event on an EventsServer worker thread"""
+        changed, posts = self.handle(event)
+        if changed or posts:
+            # Callbacks run in the order they're scheduled, so each
+            # channel's posts stay in order
+            self.loop.call_soon_threadsafe(self.deliver, changed, posts)
+
+    async def refresh_scoreboard(self):
+        while True:
+            for t in self.tournaments:
+                scores = t.scoreboard.poll(t.counter.points)
+                if scores:
+                    # Start rendering while the upload waits its turn
+                    max_points = t.scoreboard.max_points
+                    rendering = self.renderer and self.renderer.submit(
+                        scores, t.channel, max_points)
+                    self.outbox.upload(t.channel, upload_scores_image,
+                                       self.sc, scores, t.channel,
+                                       UPLOAD_TIMEOUT, rendering, max_points)
+            await asyncio.sleep(self.tick)
+
+    def in_executor(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, fn, *args)
+
+
+def start_tournaments(sc, tournaments: TournamentRegistry, resolver=None,
+                      background_load=True) -> TournamentRegistry:
+    """Create each tournament's PointCounter, restoring the points from its
+    ledger while the prefects resolve
+
+    The bucket is loaded in the background unless `background_load` is
+    false, and the prefect ids keep being refreshed in the background.
+    """
+    def update_prefects(*args):
+        for t in tournaments:
+            t.counter.prefects = resolver.ids_for(t.prefect_names)
+            # Announcers are the prefects, as in consts
+            t.counter.announcers = t.counter.prefects
+
+    def start_counter(t):
+        t.counter = PointCounter(
+            prefects=[], points_file=t.points_file, houses=t.houses,
+            max_points=t.max_points, admin_channel=t.admin_channel,
+            ledger=PointsLedger(t.ledger_dir) if t.ledger_dir else None,
+            background_load=background_load)
+
+    resolver = resolver or PrefectResolver(
+        sc, set().union(*[t.prefect_names for t in tournaments]))
+    with ThreadPoolExecutor(1 + len(tournaments)) as startup:
+        resolved = startup.submit(resolver.resolve)
+        for started in [startup.submit(start_counter, t)
+                        for t in tournaments]:
+            started.result()
+        resolved.result()
+    update_prefects()
+    resolver.on_refresh = update_prefects
+    resolver.start()
+    return tournaments
+
+
+def run_worker(worker=0, workers=1):
+    """Run the bot for this worker's share of the tournaments"""
+    logs.setup()
+    tournaments = load_tournaments().partition(worker, workers)
+    if not tournaments:
+        log.info("Worker %d has no tournaments", worker)
+        return
+    renderer = RenderService()
+    # The workers load Pillow and the images while the bot connects
+    renderer.warm(wait=False)
+    from slackclient import SlackClient
+    sc = metrics.InstrumentedSlackClient(SlackClient(SLACK_TOKEN))
+    start_tournaments(sc, tournaments)
+    log.info("Worker %d running %s", worker, [t.name for t in tournaments])
     # sc.api_call(
     #     "chat.postMessage", channel=CHANNEL,
-    #     as_user=True, text="Your prefects will be: {}".format(
-    #         ",".join([f"<@{u}>" for u in prefect_ids])
-    #     ))
-
-    return prefect_ids
+    #     as_user=True,
+    #     text="I'm alive!")
+    events_server = None
+    if USE_EVENTS_API:
+        events_server = EventsServer(EVENTS_PORT, SLACK_SIGNING_SECRET)
+    # The runtime connects to RTM itself, and reconnects when dropped
+    runtime = BotRuntime(sc, tournaments=tournaments, renderer=renderer,
+                         stop_signals=(signal.SIGTERM, signal.SIGINT),
+                         events_server=events_server)
+    # Each worker serves its metrics on the next port up
+    metrics.MetricsServer(METRICS_PORT + worker,
+                          ready=runtime.ready).start()
+    asyncio.run(runtime.run())
+    renderer.shutdown()
+    logs.shutdown()
 
 
 def main():
-    sc = SlackClient(SLACK_TOKEN)
-    if sc.rtm_connect():
-        p = PointCounter(prefects=convert_name_to_id(sc, PUBLIC_CHANNEL,
-                                                     PREFECTS))
-        # sc.api_call(
-        #     "chat.postMessage", channel=CHANNEL,
-        #     as_user=True,
-        #     text="I'm alive!")
-        while True:
-            messages = sc.rtm_read()
-            seen_point_messages = False
-            for message in messages:
-                print("Message: %s" % message)
-                if is_hogwarts_related(message):
-                    print('is_hogwarts_related')
-                    for m in p.award_points(message['text'], message['user'],
-                                            channel=message['channel']):
-                        if isinstance(m, tuple):
-                            m, special_char = m
-                            slack_info = SPECIAL_SUBJECT.get(special_char, {})
-                            sc.api_call(
-                                "chat.postMessage",
-                                channel=CHANNEL,
-                                as_user=False,
-                                username=slack_info.get('name'),
-                                icon_emoji=slack_info.get('emoji'),
-                                text=m)
-                        else:
-                            sc.api_call("chat.postMessage", channel=CHANNEL,
-                                        as_user=True,
-                                        text=m)
-                        # HACK: Avoid seeing "says" messages
-                        seen_point_messages = ('point' in m)
-            # NOTE: the following rendering is slow, try to limit it's use
-            if seen_point_messages:
-                os.system(
-                    "curl -F file=@%s -F title=%s -F channels=%s -F token=%s https://slack.com/api/files.upload"
-                    % (cup_image.image_for_scores(p.points), '"House Points"', CHANNEL, SLACK_TOKEN))
-            time.sleep(1)
-            p.post_update()
-    else:
-        print("Connection Failed, invalid token?")
+    if USE_EVENTS_API and TOURNAMENT_WORKERS > 1:
+        # Slack posts every event to the one Request URL, so only one
+        # worker would get any
+        raise ValueError("The Events API needs TOURNAMENT_WORKERS = 1, "
+                         "not %d" % TOURNAMENT_WORKERS)
+    if TOURNAMENT_WORKERS == 1:
+        run_worker()
+        return
+    processes = [
+        multiprocessing.Process(target=run_worker,
+                                args=(worker, TOURNAMENT_WORKERS))
+        for worker in range(TOURNAMENT_WORKERS)
+    ]
+    for process in processes:
+        process.start()
+
+    def forward(signum, frame):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, forward)
+    signal.signal(signal.SIGINT, forward)
+    for process in processes:
+        process.join()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,261 @@
+"""
+Counters, gauges and latency histograms for the bot's hot paths
+
+Metrics are kept in process and served in the Prometheus text format by
+MetricsServer, along with a readiness check for Kubernetes.
+"""
+import bisect
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+# Seconds; parsing takes microseconds, uploads take seconds
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace(
+            '"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs)
+
+
+class Metric(object):
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels[name] for name in self.labels)
+
+    def samples(self):
+        """(name suffix, label values, extra labels, value) to expose"""
+        with self._lock:
+            return [("", key, (), value)
+                    for key, value in sorted(self._values.items())]
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.help),
+                 "# TYPE %s %s" % (self.name, self.kind)]
+        for suffix, key, extra, value in self.samples():
+            lines.append("%s%s%s %s" % (
+                self.name, suffix, format_labels(self.labels, key, extra),
+                repr(float(value))))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from a function when
+    scraped"""
+    kind = "gauge"
+
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, fn, **labels):
+        with self._lock:
+            self._functions[self._key(labels)] = fn
+
+    def value(self, **labels):
+        key = self._key(labels)
+        if key in self._functions:
+            return self._functions[key]()
+        return self._values.get(key, 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+        values.update((key, fn()) for key, fn in functions.items())
+        return [("", key, (), value) for key, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, then +Inf, then the sum
+                counts = [0] * (len(self.buckets) + 2)
+                self._values[key] = counts
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        counts = self._values.get(self._key(labels))
+        return sum(counts[:-1]) if counts else 0
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            values = {key: list(counts)
+                      for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                le = bound if bound == "+Inf" else repr(float(bound))
+                samples.append(("_bucket", key, [("le", le)], total))
+            samples.append(("_sum", key, (), counts[-1]))
+            samples.append(("_count", key, (), total))
+        return samples
+
+
+class Registry(object):
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(m.render() for m in self.metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.add(Histogram(
+    "hogwarts_stage_seconds", "Time spent in each stage of handling",
+    labels=("stage",)))
+MESSAGES = REGISTRY.add(Counter(
+    "hogwarts_messages_total",
+    "Messages seen, by whether they were filtered out, handled or seen "
+    "before",
+    labels=("result",)))
+CLAMPS = REGISTRY.add(Counter(
+    "hogwarts_clamps_total",
+    "Awards that hit the points cap or zero", labels=("limit",)))
+RENDER_CACHE = REGISTRY.add(Counter(
+    "hogwarts_render_cache_total", "Scoreboard image cache lookups",
+    labels=("result",)))
+LOOP_LAG = REGISTRY.add(Gauge(
+    "hogwarts_loop_lag_seconds",
+    "How late the event loop last woke up from a sleep"))
+SLACK_CALL_SECONDS = REGISTRY.add(Histogram(
+    "hogwarts_slack_call_seconds", "Slack Web API call latency",
+    labels=("method",)))
+SLACK_ERRORS = REGISTRY.add(Counter(
+    "hogwarts_slack_errors_total", "Failed Slack Web API calls",
+    labels=("method", "error")))
+GCS_ERRORS = REGISTRY.add(Counter(
+    "hogwarts_gcs_errors_total", "Failed points bucket reads and writes",
+    labels=("operation",)))
+STORE_CONFLICTS = REGISTRY.add(Counter(
+    "hogwarts_store_conflicts_total",
+    "Points file writes that lost a race with another instance"))
+LOGS_DROPPED = REGISTRY.add(Counter(
+    "hogwarts_logs_dropped_total",
+    "Log records dropped because the log queue was full"))
+RTM_RECONNECTS = REGISTRY.add(Counter(
+    "hogwarts_rtm_reconnects_total", "Times the RTM connection was lost"))
+QUEUE_DEPTH = REGISTRY.add(Gauge(
+    "hogwarts_queue_depth", "Work waiting to be done", labels=("queue",)))
+
+
+class InstrumentedSlackClient(object):
+    """Wraps a SlackClient to time its Web API calls and count failures"""
+
+    def __init__(self, sc):
+        self.sc = sc
+
+    def __getattr__(self, name):
+        return getattr(self.sc, name)
+
+    def api_call(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            response = self.sc.api_call(method, *args, **kwargs)
+        except Exception as e:
+            SLACK_ERRORS.inc(method=method, error=type(e).__name__)
+            raise
+        finally:
+            SLACK_CALL_SECONDS.observe(time.perf_counter() - start,
+                                       method=method)
+        if not response.get("ok", True):
+            SLACK_ERRORS.inc(method=method, error=response.get("error"))
+        return response
+
+
+class MetricsServer(object):
+    """Serves /metrics, and /ready with a 503 while `ready()` is false"""
+
+    def __init__(self, port, ready=lambda: True, registry=REGISTRY,
+                 host=""):
+        registry_, ready_ = registry, ready
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    status, body = 200, registry_.render()
+                elif self.path == "/ready":
+                    status, body = (200, "ok\n") if ready_() else (
+                        503, "not ready\n")
+                else:
+                    status, body = 404, "not found\n"
+                body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type",
+                                 "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever,
+                                        name="metrics", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
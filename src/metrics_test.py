@@ -0,0 +1,174 @@
+"""
+Test the metrics and the endpoint serving them
+"""
+import asyncio
+import json
+import unittest
+import urllib.error
+import urllib.request
+
+from google.api_core import exceptions
+import mock
+
+from consts import CHANNEL
+from fakes import FakeBucket, FakeSlackClient
+from main import BotRuntime, PointCounter
+import metrics
+from reconnect import Backoff
+from storage import BucketStore
+
+TEST_PREFECTS = ["prefect"]
+TEST_POINTS = "points.json"
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        h = metrics.Histogram("test_seconds", "Test", labels=("stage",),
+                              buckets=(0.1, 1))
+        h.observe(0.05, stage="a")
+        h.observe(0.5, stage="a")
+        h.observe(5, stage="a")
+        self.assertEqual(h.count(stage="a"), 3)
+        self.assertEqual(h.render().split("\n"), [
+            "# HELP test_seconds Test",
+            "# TYPE test_seconds histogram",
+            'test_seconds_bucket{stage="a",le="0.1"} 1.0',
+            'test_seconds_bucket{stage="a",le="1.0"} 2.0',
+            'test_seconds_bucket{stage="a",le="+Inf"} 3.0',
+            'test_seconds_sum{stage="a"} 5.55',
+            'test_seconds_count{stage="a"} 3.0',
+        ])
+
+    def test_counter_and_gauge(self):
+        c = metrics.Counter("test_total", "Test", labels=("result",))
+        c.inc(result="ok")
+        c.inc(2, result="ok")
+        c.inc(result='"bad"')
+        self.assertEqual(c.value(result="ok"), 3)
+        self.assertIn('test_total{result="\\"bad\\""} 1.0', c.render())
+
+        g = metrics.Gauge("test_depth", "Test")
+        g.set(4)
+        self.assertEqual(g.value(), 4)
+        g.set_function(lambda: 7)
+        self.assertIn("test_depth 7.0", g.render())
+
+    def test_slack_errors(self):
+        sc = metrics.InstrumentedSlackClient(
+            FakeSlackClient(users={"U1": "harry"}))
+        before = metrics.SLACK_ERRORS.value(method="users.info",
+                                            error="user_not_found")
+        self.assertTrue(sc.api_call("users.info", user="U1")["ok"])
+        self.assertFalse(sc.api_call("users.info", user="U2")["ok"])
+        self.assertEqual(
+            metrics.SLACK_ERRORS.value(method="users.info",
+                                       error="user_not_found"), before + 1)
+        self.assertGreaterEqual(
+            metrics.SLACK_CALL_SECONDS.count(method="users.info"), 2)
+        # Everything else goes to the wrapped client
+        self.assertEqual(sc.users, {"U1": "harry"})
+
+    def test_gcs_read_errors(self):
+        bucket = FakeBucket()
+        bucket.objects[TEST_POINTS] = json.dumps([{"Gryffindor": 10}])
+        store = BucketStore(bucket, TEST_POINTS)
+        before = metrics.GCS_ERRORS.value(operation="read")
+
+        bucket.fail_next = 1
+        with self.assertRaises(exceptions.ServiceUnavailable):
+            store.read()
+        self.assertEqual(metrics.GCS_ERRORS.value(operation="read"),
+                         before + 1)
+
+        # Another instance writes between our read and write, and the
+        # re-read after the conflict fails
+        read = bucket.get_blob
+
+        def conflicting_read(name):
+            blob = read(name)
+            bucket.generations[name] = blob.generation + 1
+            return blob
+
+        with mock.patch.object(bucket, "get_blob", conflicting_read), \
+                mock.patch("storage.time.sleep",
+                           lambda _: setattr(bucket, "fail_next", 1)):
+            with self.assertRaises(exceptions.ServiceUnavailable):
+                store.apply({"Gryffindor": 5})
+        self.assertEqual(store.conflicts, 1)
+        self.assertEqual(metrics.GCS_ERRORS.value(operation="read"),
+                         before + 2)
+
+        # Loading retries both getting the bucket and reading from it
+        with mock.patch("main.get_client"), \
+                mock.patch("main.get_bucket", return_value=bucket) as get:
+            p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS)
+            p.store_loaded.clear()
+            get.side_effect = [exceptions.ServiceUnavailable("down"),
+                               bucket, bucket]
+            bucket.fail_next = 1
+            p.load_store(Backoff(0.001, 0.01))
+        self.assertTrue(p.store_loaded.is_set())
+        self.assertEqual(metrics.GCS_ERRORS.value(operation="read"),
+                         before + 4)
+
+    def test_server(self):
+        ready = [False]
+        server = metrics.MetricsServer(0, ready=lambda: ready[0],
+                                       host="127.0.0.1")
+        server.start()
+        url = "http://127.0.0.1:%d" % server.port
+        try:
+            with urllib.request.urlopen(url + "/metrics") as response:
+                self.assertIn(b"# TYPE hogwarts_stage_seconds histogram",
+                              response.read())
+            with self.assertRaises(urllib.error.HTTPError) as e:
+                urllib.request.urlopen(url + "/ready")
+            self.assertEqual(e.exception.code, 503)
+            ready[0] = True
+            with urllib.request.urlopen(url + "/ready") as response:
+                self.assertEqual(response.status, 200)
+        finally:
+            server.stop()
+
+
+class TestRuntimeMetrics(unittest.TestCase):
+
+    def test_messages_and_clamps(self):
+        sc = FakeSlackClient()
+        p = PointCounter(TEST_PREFECTS, reset=True)
+        p.store = None
+        runtime = BotRuntime(sc, p, tick=0.01)
+        handled = metrics.MESSAGES.value(result="handled")
+        filtered = metrics.MESSAGES.value(result="filtered")
+        clamps = metrics.CLAMPS.value(limit="zero")
+        awards = metrics.STAGE_SECONDS.count(stage="award_points")
+        readiness = []
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            for text in ("10 points from Gryffindor", "hello",
+                         "5 points to Slytherin"):
+                sc.push({"type": "message", "channel": CHANNEL,
+                         "user": "prefect", "text": text})
+            sc.push({"type": "presence_change", "user": "prefect"})
+            await asyncio.sleep(0.1)
+            readiness.append(runtime.ready())
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        self.assertEqual(readiness, [True])
+        self.assertFalse(runtime.ready())
+        self.assertEqual(metrics.MESSAGES.value(result="handled"),
+                         handled + 2)
+        self.assertEqual(metrics.MESSAGES.value(result="filtered"),
+                         filtered + 2)
+        self.assertEqual(metrics.CLAMPS.value(limit="zero"), clamps + 1)
+        self.assertEqual(
+            metrics.STAGE_SECONDS.count(stage="award_points"), awards + 2)
+        self.assertLess(metrics.LOOP_LAG.value(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,272 @@
+"""
+Outbound queue for the bot's Slack posts and uploads
+
+Slack rate limits posts per channel, and an award to everybody makes four
+announcements at once. Posts go through a priority queue instead:
+announcements before "says" lines before scoreboard images, each channel
+paced by a token bucket, with one send per channel in flight so posts stay
+in order. Announcements queued for the same channel and persona within
+`merge_window` seconds of each other go out as one post, and a rate limited
+send waits out the Retry-After before it's tried again.
+"""
+import asyncio
+from collections import deque
+import itertools
+import time
+
+import requests
+
+import logs
+from consts import (
+    OUTBOX_MERGE_WINDOW, OUTBOX_CHANNEL_RATE, OUTBOX_CHANNEL_BURST,
+    OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY
+)
+
+log = logs.get_logger("outbox")
+
+ANNOUNCEMENT = 0
+SAYS = 1
+IMAGE = 2
+
+
+class TokenBucket(object):
+    """Allows `rate` sends a second, in bursts of up to `burst`"""
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait(self, now) -> float:
+        """Seconds until a send is allowed"""
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+def retry_after(response):
+    """Seconds Slack asked us to wait if `response` was rate limited"""
+    if not response or response.get("error") != "ratelimited":
+        return None
+    headers = {k.lower(): v for k, v in response.get("headers", {}).items()}
+    return float(headers.get("retry-after", 1))
+
+
+class Outgoing(object):
+    __slots__ = ("priority", "seq", "channel", "key", "kwargs", "send",
+                 "enqueued", "attempts", "not_before")
+
+    def __init__(self, priority, seq, channel, key, kwargs, send, enqueued):
+        self.priority = priority
+        self.seq = seq
+        self.channel = channel
+        # Queued items with the same key can be merged into one send
+        self.key = key
+        self.kwargs = kwargs
+        self.send = send
+        self.enqueued = enqueued
+        self.attempts = 0
+        self.not_before = 0.0
+
+    def sort_key(self):
+        return self.priority, self.seq
+
+
+class Outbox(object):
+    """Sends the bot's Slack calls from the event loop, `run` being its task
+
+    Sends run through `in_executor`, which takes a function and its
+    arguments and returns an awaitable.
+    """
+
+    def __init__(self, sc, in_executor, merge_window=OUTBOX_MERGE_WINDOW,
+                 rate=OUTBOX_CHANNEL_RATE, burst=OUTBOX_CHANNEL_BURST,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retry_delay=OUTBOX_RETRY_DELAY, clock=time.perf_counter):
+        self.sc = sc
+        self.in_executor = in_executor
+        self.merge_window = merge_window
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.clock = clock
+
+        self.queues = {}
+        self.buckets = {}
+        self.blocked_until = {}
+        self.in_flight = set()
+        self._seq = itertools.count()
+        self._wake = None
+
+        self.sent = 0
+        self.merged = 0
+        self.replaced = 0
+        self.ratelimited = 0
+        self.errors = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=1000)
+
+    def post(self, kwargs, priority=ANNOUNCEMENT):
+        """Queue a chat.postMessage with arguments `kwargs`"""
+        channel = kwargs["channel"]
+        key = None
+        if priority == ANNOUNCEMENT:
+            key = (priority, kwargs.get("as_user"), kwargs.get("username"),
+                   kwargs.get("icon_emoji"))
+            now = self.clock()
+            for item in self.queues.get(channel, ()):
+                if (item.key == key and
+                        now - item.enqueued <= self.merge_window):
+                    item.kwargs["text"] += "\n" + kwargs["text"]
+                    self.merged += 1
+                    return
+        self._enqueue(priority, channel, key, dict(kwargs),
+                      self._post_message)
+
+    def upload(self, channel, upload, *args):
+        """Queue `upload(*args)`, which returns the Slack response
+
+        An upload still waiting for the same channel is replaced, as the
+        newer one supersedes it.
+        """
+        key = (IMAGE,)
+        queue = self.queues.get(channel, [])
+        for item in queue:
+            if item.key == key:
+                queue.remove(item)
+                self.replaced += 1
+                break
+        self._enqueue(IMAGE, channel, key, {},
+                      lambda kwargs: upload(*args))
+
+    def _post_message(self, kwargs):
+        return self.sc.api_call("chat.postMessage", **kwargs)
+
+    def _enqueue(self, priority, channel, key, kwargs, send):
+        item = Outgoing(priority, next(self._seq), channel, key, kwargs, send,
+                        self.clock())
+        queue = self.queues.setdefault(channel, [])
+        queue.append(item)
+        queue.sort(key=Outgoing.sort_key)
+        if channel not in self.buckets:
+            self.buckets[channel] = TokenBucket(self.rate, self.burst,
+                                                item.enqueued)
+        if self._wake:
+            self._wake.set()
+
+    def depth(self) -> int:
+        """Sends not yet made, including those in flight"""
+        return sum(len(q) for q in self.queues.values()) + len(self.in_flight)
+
+    def stats(self) -> dict:
+        latencies = sorted(self.latencies)
+        return {
+            "depth": self.depth(),
+            "sent": self.sent,
+            "merged": self.merged,
+            "replaced": self.replaced,
+            "ratelimited": self.ratelimited,
+            "errors": self.errors,
+            "dropped": self.dropped,
+            "p50_latency": latencies[len(latencies) // 2] if latencies else 0,
+            "max_latency": latencies[-1] if latencies else 0,
+        }
+
+    def _next_ready(self, now):
+        """The next item to send and None, or None and how long to wait"""
+        best, wait = None, None
+        for channel, queue in self.queues.items():
+            if not queue or channel in self.in_flight:
+                continue
+            head = queue[0]
+            until = max(self.blocked_until.get(channel, 0), head.not_before,
+                        now + self.buckets[channel].wait(now)) - now
+            if until <= 0:
+                if best is None or head.sort_key() < best.sort_key():
+                    best = head
+            elif wait is None or until < wait:
+                wait = until
+        return best, wait
+
+    async def run(self):
+        self._wake = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        sending = set()
+        try:
+            while True:
+                now = self.clock()
+                item, wait = self._next_ready(now)
+                if item:
+                    self.queues[item.channel].pop(0)
+                    self.buckets[item.channel].take(now)
+                    self.in_flight.add(item.channel)
+                    task = loop.create_task(self._send(item))
+                    sending.add(task)
+                    task.add_done_callback(sending.discard)
+                    continue
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            await asyncio.gather(*sending, return_exceptions=True)
+
+    async def _send(self, item):
+        item.attempts += 1
+        try:
+            response = await self.in_executor(item.send, item.kwargs)
+        except requests.exceptions.RequestException as e:
+            log.warning("Exception sending to %s: %s", item.channel, e)
+            response = None
+        except Exception:
+            # A bug, but it mustn't take the queue down with it
+            log.exception("Error sending to %s", item.channel)
+            response = None
+        finally:
+            self.in_flight.discard(item.channel)
+        delay = retry_after(response)
+        if delay is not None:
+            self.ratelimited += 1
+            self.blocked_until[item.channel] = self.clock() + delay
+            self._retry(item, 0)
+        elif not response:
+            self.errors += 1
+            self._retry(item, self.retry_delay * 2 ** (item.attempts - 1))
+        else:
+            if not response.get("ok"):
+                # Not worth retrying, e.g. channel_not_found
+                self.errors += 1
+                log.warning("Slack error for %s: %s", item.channel,
+                            response.get("error"))
+            self.sent += 1
+            self.latencies.append(self.clock() - item.enqueued)
+        self._wake.set()
+
+    def _retry(self, item, delay):
+        if item.attempts >= self.max_attempts:
+            self.dropped += 1
+            log.error("Giving up sending to %s after %d attempts",
+                      item.channel, item.attempts)
+            return
+        item.not_before = self.clock() + delay
+        queue = self.queues[item.channel]
+        queue.append(item)
+        queue.sort(key=Outgoing.sort_key)
+
+    async def drain(self, timeout):
+        """Wait up to `timeout` seconds for everything queued to be sent"""
+        deadline = self.clock() + timeout
+        while self.depth() and self.clock() < deadline:
+            await asyncio.sleep(0.01)
+        return not self.depth()
@@ -0,0 +1,191 @@
+"""
+Test the outbound Slack queue against a fake API that rate limits
+"""
+import asyncio
+import functools
+import unittest
+
+from fakes import FakeSlackClient
+from consts import CHANNEL
+from main import BotRuntime, PointCounter
+from outbox import Outbox, ANNOUNCEMENT, SAYS, TokenBucket, retry_after
+
+TEST_PREFECTS = ["prefect"]
+
+
+def send_all(sc, queue, **kwargs):
+    """Queue posts with `queue(outbox)` and run the outbox until they're sent
+
+    Returns the outbox.
+    """
+    async def run():
+        loop = asyncio.get_running_loop()
+        outbox = Outbox(
+            sc, lambda fn, *args: loop.run_in_executor(None, fn, *args),
+            **kwargs)
+        queue(outbox)
+        task = loop.create_task(outbox.run())
+        drained = await outbox.drain(10)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return outbox, drained
+
+    outbox, drained = asyncio.run(run())
+    assert drained, outbox.stats()
+    return outbox
+
+
+def posted(sc, channel=None):
+    return [kwargs["text"] for _, kwargs, _ in sc.calls_to("chat.postMessage")
+            if channel in (None, kwargs["channel"])]
+
+
+class TestOutbox(unittest.TestCase):
+
+    def test_announcements_are_merged(self):
+        sc = FakeSlackClient()
+        lines = ["%s gets 10 points" % house for house in
+                 ("Gryffindor", "Hufflepuff", "Ravenclaw", "Slytherin")]
+
+        def queue(outbox):
+            for line in lines:
+                outbox.post(dict(channel="c", as_user=True, text=line))
+            outbox.post(dict(channel="c", as_user=False, username="Snape",
+                             text="takes away 5 points"))
+            outbox.post(dict(channel="other", as_user=True, text="hi"))
+
+        outbox = send_all(sc, queue)
+        self.assertEqual(posted(sc, "c"),
+                         ["\n".join(lines), "takes away 5 points"])
+        self.assertEqual(posted(sc, "other"), ["hi"])
+        self.assertEqual(outbox.merged, 3)
+
+    def test_priorities(self):
+        sc = FakeSlackClient()
+
+        def queue(outbox):
+            outbox.upload("c", functools.partial(
+                sc.api_call, "files.upload", channels="c"))
+            outbox.post(dict(channel="c", as_user=False, text="ho ho ho"),
+                        SAYS)
+            outbox.post(dict(channel="c", as_user=True, text="10 points"),
+                        ANNOUNCEMENT)
+
+        send_all(sc, queue)
+        self.assertEqual([method for method, _, _ in sc.calls],
+                         ["chat.postMessage", "chat.postMessage",
+                          "files.upload"])
+        self.assertEqual(posted(sc), ["10 points", "ho ho ho"])
+
+    def test_newer_upload_replaces_queued_one(self):
+        sc = FakeSlackClient()
+
+        def queue(outbox):
+            for i in range(3):
+                outbox.upload("c", functools.partial(
+                    sc.api_call, "files.upload", n=i))
+
+        outbox = send_all(sc, queue)
+        uploads = [kwargs for _, kwargs, _ in sc.calls_to("files.upload")]
+        self.assertEqual(uploads, [{"n": 2}])
+        self.assertEqual(outbox.replaced, 2)
+
+    def test_token_bucket_paces_channel(self):
+        sc = FakeSlackClient()
+
+        def queue(outbox):
+            for i in range(5):
+                outbox.post(dict(channel="c", text=str(i)), SAYS)
+
+        send_all(sc, queue, rate=20, burst=1)
+        times = [sent for _, _, sent in sc.calls_to("chat.postMessage")]
+        self.assertGreaterEqual(times[-1] - times[0], 4 / 20 * 0.9)
+
+    def test_honors_retry_after(self):
+        sc = FakeSlackClient(channel_rate=5, retry_after=0.3)
+
+        def queue(outbox):
+            for i in range(4):
+                outbox.post(dict(channel="c", text=str(i)), SAYS)
+
+        outbox = send_all(sc, queue, rate=1000, burst=1000)
+        self.assertEqual(posted(sc), ["0", "1", "2", "3"])
+        self.assertTrue(sc.ratelimited)
+        self.assertEqual(outbox.ratelimited, len(sc.ratelimited))
+        # Once limited, nothing is tried again before the Retry-After is up
+        for _, _, limited in sc.ratelimited:
+            later = [sent for _, _, sent in sc.ratelimited + sc.calls
+                     if sent > limited]
+            self.assertGreaterEqual(min(later) - limited, 0.3 * 0.9)
+        stats = outbox.stats()
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["sent"], 4)
+        self.assertGreater(stats["max_latency"], 0.3)
+
+    def test_gives_up_after_max_attempts(self):
+        sc = FakeSlackClient(channel_rate=0.001, retry_after=0.01)
+
+        def queue(outbox):
+            outbox.post(dict(channel="c", text="first"), SAYS)
+            outbox.post(dict(channel="c", text="second"), SAYS)
+
+        outbox = send_all(sc, queue, max_attempts=3)
+        self.assertEqual(posted(sc), ["first"])
+        self.assertEqual(outbox.dropped, 1)
+        self.assertEqual(len(sc.ratelimited), 3)
+
+    def test_retries_unexpected_errors(self):
+        sc = FakeSlackClient()
+        attempts = []
+
+        def upload(channel):
+            attempts.append(channel)
+            if len(attempts) == 1:
+                raise ValueError("not a Slack error")
+            return {"ok": True}
+
+        outbox = send_all(sc, lambda outbox: outbox.upload("c", upload, "c"),
+                          retry_delay=0.01)
+        self.assertEqual(attempts, ["c", "c"])
+        self.assertEqual(outbox.errors, 1)
+        self.assertEqual(outbox.sent, 1)
+
+    def test_retry_after(self):
+        self.assertIsNone(retry_after({"ok": True}))
+        self.assertIsNone(retry_after(None))
+        self.assertEqual(retry_after({"ok": False, "error": "ratelimited",
+                                      "headers": {"retry-after": "30"}}), 30)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=2, burst=2, now=0)
+        bucket.take(0)
+        bucket.take(0)
+        self.assertAlmostEqual(bucket.wait(0), 0.5)
+        self.assertAlmostEqual(bucket.wait(0.25), 0.25)
+        self.assertEqual(bucket.wait(10), 0)
+
+
+class TestRuntimeOutbox(unittest.TestCase):
+
+    def test_award_to_everybody_is_one_post(self):
+        sc = FakeSlackClient()
+        p = PointCounter(TEST_PREFECTS, reset=True)
+        p.store = None
+        runtime = BotRuntime(sc, p, tick=0.01)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            sc.push({"type": "message", "channel": CHANNEL,
+                     "user": "prefect", "text": "10 points to everybody"})
+            await asyncio.sleep(0.2)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        posts = posted(sc)
+        self.assertEqual(len(posts), 1)
+        self.assertEqual(posts[0].count("gets 10 points"), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+Write-behind persistence of the points, off the bot loop
+
+Uploads to the bucket take a full round trip and can fail transiently, so
+they run on a background thread that flushes on a schedule and retries
+failures with exponential backoff.
+"""
+import random
+import threading
+import time
+from typing import Optional
+
+import logs
+import metrics
+from consts import (
+    FLUSH_INTERVAL, FLUSH_AWARDS, FLUSH_BACKOFF_BASE, FLUSH_BACKOFF_MAX,
+    FLUSH_SHUTDOWN_TIMEOUT
+)
+
+log = logs.get_logger("persistence")
+
+
+class PointsWriter(object):
+    """Background writer for a PointCounter
+
+    The points are uploaded at most every `flush_interval` seconds, or as
+    soon as `flush_awards` house awards are waiting, whichever comes first.
+    A failed upload is retried after `backoff_base` seconds, doubling up to
+    `backoff_max`, and the awards made in the meantime are written after it.
+    The ledger is only compacted when that's due, and on the final flush.
+    """
+
+    def __init__(self, counter, flush_interval=FLUSH_INTERVAL,
+                 flush_awards=FLUSH_AWARDS, backoff_base=FLUSH_BACKOFF_BASE,
+                 backoff_max=FLUSH_BACKOFF_MAX):
+        self.counter = counter
+        self.flush_interval = flush_interval
+        self.flush_awards = flush_awards
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # An update that was taken from the counter but failed to write; it
+        # may have been stored regardless, so it's retried as it is
+        self.unwritten: Optional[dict] = None
+        self.failures = 0
+        self.flushes = 0
+        self.errors = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+
+        # Held while flushing, so the final flush in `stop` waits for one
+        # still running on the writer thread
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="points-writer",
+                                        daemon=True)
+        self._thread.start()
+
+    def notify(self):
+        """Tell the writer points were awarded"""
+        if self.counter.dirty_awards >= self.flush_awards:
+            self._wake.set()
+
+    def stop(self, timeout=FLUSH_SHUTDOWN_TIMEOUT) -> bool:
+        """Stop the writer after a final flush, return whether it succeeded"""
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+        deadline = time.time() + timeout
+        while not self.flush(force=True):
+            if time.time() >= deadline:
+                log.error("Giving up on the final points flush!")
+                return False
+            time.sleep(min(self.backoff_delay(),
+                           max(0, deadline - time.time())))
+        return True
+
+    def queue_depth(self) -> int:
+        """House awards not yet written to the bucket"""
+        return self.counter.dirty_awards + (
+            1 if self.unwritten is not None else 0)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth(),
+            "flushes": self.flushes,
+            "errors": self.errors,
+            "failures": self.failures,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+        }
+
+    def backoff_delay(self) -> float:
+        if not self.failures:
+            return 0
+        delay = min(self.backoff_base * 2 ** (self.failures - 1),
+                    self.backoff_max)
+        # Jitter so replicas don't retry in lockstep
+        return delay * random.uniform(0.5, 1)
+
+    def flush(self, force=False) -> bool:
+        """Write any pending points now, return whether that succeeded
+
+        With `force`, the ledger is compacted as well.
+        """
+        with self._flush_lock:
+            if self.unwritten is not None and \
+                    not self._write(self.unwritten):
+                return False
+            return self._write(self.counter.pending_update(force=force))
+
+    def _write(self, update: Optional[dict]) -> bool:
+        self.unwritten = None
+        start = time.time()
+        try:
+            with metrics.STAGE_SECONDS.time(stage="write_update"):
+                self.counter.write_update(update)
+        except Exception as e:
+            self.unwritten = update
+            self.failures += 1
+            self.errors += 1
+            metrics.GCS_ERRORS.inc(operation="write")
+            log.warning("Exception writing points (attempt %d): %s",
+                        self.failures, e)
+            return False
+        self.failures = 0
+        if update:
+            self.flushes += 1
+            self.last_flush_latency = time.time() - start
+            self.max_flush_latency = max(self.max_flush_latency,
+                                         self.last_flush_latency)
+            log.info("Flushed points", extra=dict(
+                seconds=round(self.last_flush_latency, 3),
+                waiting=self.queue_depth()))
+        return True
+
+    def _run(self):
+        next_flush = time.time() + self.flush_interval
+        while not self._stopping:
+            self._wake.wait(max(0, next_flush - time.time()))
+            self._wake.clear()
+            if self._stopping:
+                break
+            if self.failures and time.time() < next_flush:
+                # Enough awards are waiting, but we're backing off
+                continue
+            if self.flush():
+                next_flush = time.time() + self.flush_interval
+            else:
+                next_flush = time.time() + self.backoff_delay()
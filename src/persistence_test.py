@@ -0,0 +1,193 @@
+"""
+Test the write-behind points writer against a flaky, slow fake bucket
+"""
+import asyncio
+import json
+import os
+import shutil
+import signal
+import tempfile
+import time
+import unittest
+
+import mock
+
+from fakes import FakeBucket, FakeSlackClient
+from ledger import PointsLedger
+from main import BotRuntime, PointCounter
+from persistence import PointsWriter
+from storage import BucketStore
+
+TEST_PREFECTS = ["prefect"]
+TEST_POINTS = "points.json"
+
+
+def stored_points(bucket):
+    return json.loads(bucket.objects[TEST_POINTS])[0]
+
+
+class TestPointsWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = FakeBucket(latency=0.01)
+        self.p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                              reset=True)
+        self.p.store = BucketStore(self.bucket, TEST_POINTS)
+
+    def wait_for(self, condition, timeout=2):
+        deadline = time.time() + timeout
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_flush_after_awards(self):
+        writer = PointsWriter(self.p, flush_interval=60, flush_awards=3)
+        writer.start()
+        for _ in range(2):
+            self.p.award_points("1 point to Gryffindor", "prefect")
+            writer.notify()
+        time.sleep(0.1)
+        self.assertEqual(self.bucket.uploads, 0)
+        self.assertEqual(writer.queue_depth(), 2)
+
+        self.p.award_points("1 point to Gryffindor", "prefect")
+        writer.notify()
+        self.wait_for(lambda: self.bucket.uploads == 1)
+        self.assertEqual(stored_points(self.bucket)["Gryffindor"], 3)
+        self.assertEqual(writer.queue_depth(), 0)
+        self.assertGreater(writer.stats()["last_flush_latency"], 0)
+        writer.stop()
+
+    def test_flush_after_interval(self):
+        writer = PointsWriter(self.p, flush_interval=0.05, flush_awards=100)
+        writer.start()
+        self.p.award_points("1 point to Gryffindor", "prefect")
+        self.wait_for(lambda: self.bucket.uploads == 1)
+        writer.stop()
+        self.assertEqual(self.bucket.uploads, 1)
+
+    def test_retry_with_backoff(self):
+        self.bucket.fail_next = 3
+        writer = PointsWriter(self.p, flush_interval=0.01, flush_awards=100,
+                              backoff_base=0.02, backoff_max=0.1)
+        writer.start()
+        self.p.award_points("5 points to Gryffindor", "prefect")
+        # Awards made while failing are picked up by the retry
+        self.p.award_points("5 points to Slytherin", "prefect")
+        self.wait_for(lambda: self.bucket.uploads == 1)
+        writer.stop()
+        self.assertEqual(writer.stats()["errors"], 3)
+        self.assertEqual(stored_points(self.bucket),
+                         {"Gryffindor": 5, "Slytherin": 5})
+
+    def test_final_flush_retries(self):
+        writer = PointsWriter(self.p, flush_interval=60, backoff_base=0.01)
+        writer.start()
+        self.p.award_points("5 points to Gryffindor", "prefect")
+        self.bucket.fail_next = 2
+        self.assertTrue(writer.stop(timeout=2))
+        self.assertEqual(stored_points(self.bucket)["Gryffindor"], 5)
+
+    def test_stop_during_slow_flush(self):
+        """The final flush waits for the writer thread's, which fails"""
+        self.bucket.latency = 0.3
+        self.bucket.fail_next = 1
+        writer = PointsWriter(self.p, flush_interval=60, flush_awards=1,
+                              backoff_base=0.01)
+        writer.start()
+        self.p.award_points("5 points to Gryffindor", "prefect")
+        writer.notify()
+        time.sleep(0.05)
+        # Gives up waiting for the thread while it's still flushing
+        self.assertTrue(writer.stop(timeout=0.05))
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 5})
+        self.assertIsNone(writer.unwritten)
+
+    def test_final_flush_on_sigterm(self):
+        sc = FakeSlackClient()
+        writer = PointsWriter(self.p, flush_interval=60)
+        runtime = BotRuntime(sc, self.p, writer=writer,
+                             stop_signals=(signal.SIGTERM,))
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            sc.push({"type": "message", "channel": "channel",
+                     "user": "prefect", "text": "7 points to Ravenclaw"})
+            await asyncio.sleep(0.1)
+            os.kill(os.getpid(), signal.SIGTERM)
+            await asyncio.wait_for(task, 5)
+
+        asyncio.run(run())
+        self.assertEqual(stored_points(self.bucket)["Ravenclaw"], 7)
+
+
+class TestPointsWriterLedger(unittest.TestCase):
+    """Every award is stored once, whatever fails between the ledger, the
+    bucket and the compaction"""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.bucket = FakeBucket()
+
+    def counter(self):
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                         ledger=PointsLedger(self.directory))
+        p.store = BucketStore(self.bucket, TEST_POINTS)
+        return p
+
+    def log_length(self):
+        with open(os.path.join(self.directory, "ledger.jsonl")) as f:
+            return len(f.readlines())
+
+    def test_compaction_when_due(self):
+        p = self.counter()
+        writer = PointsWriter(p)
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.assertTrue(writer.flush())
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 5})
+        self.assertEqual(self.log_length(), 1)
+
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.assertTrue(writer.stop())
+        self.assertEqual(self.log_length(), 0)
+
+    def test_restart_after_flush(self):
+        p = self.counter()
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.assertTrue(PointsWriter(p).flush())
+
+        # Restarted before the log was compacted
+        p2 = self.counter()
+        self.assertEqual(p2.points["Gryffindor"], 5)
+        p2.award_points("1 point to Gryffindor", "prefect")
+        self.assertTrue(PointsWriter(p2).flush())
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 6})
+
+    def test_retry_after_lost_upload(self):
+        p = self.counter()
+        writer = PointsWriter(p)
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.bucket.lose_next = 1
+        self.assertFalse(writer.flush())
+        p.award_points("1 point to Gryffindor", "prefect")
+        self.assertTrue(writer.flush())
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 6})
+        self.assertIsNone(writer.unwritten)
+
+    def test_failed_compaction(self):
+        p = self.counter()
+        writer = PointsWriter(p)
+        p.ledger.compact = mock.Mock(side_effect=OSError("disk full"))
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.assertTrue(writer.stop())
+        self.assertTrue(writer.flush(force=True))
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 5})
+
+        p2 = self.counter()
+        self.assertFalse(p2.deltas)
+        self.assertEqual(p2.points["Gryffindor"], 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
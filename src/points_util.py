@@ -1,7 +1,83 @@
 import re
+from typing import List, Optional
 
 from consts import SPECIAL_SUBJECT, HOUSES
 
+# A number on its own, e.g. "....1 point" but not "1s and 0s"
+NUMBER_RE = re.compile(r"(?<!\w)\d+(?!\w)")
+AWARD_RE = re.compile(r"points? (?:to|for)")
+DEDUCTION_RE = re.compile(r"points? from")
+# Forgive house misspellings: any word with one of these in it is the house
+HOUSE_PREFIXES = {
+    "raven": "Ravenclaw",
+    "huff": "Hufflepuff",
+    "gryf": "Gryffindor",
+    "slyt": "Slytherin",
+}
+
+
+def _any_of(words):
+    return "(?:%s)" % "|".join(re.escape(w) for w in words)
+
+
+# Only a message that mentions points (as both polarity phrases do) and a
+# house, says something with a special subject in it, or is a standings
+# query, can be acted on. One anchored match rules the rest out without
+# lowercasing or splitting them, so this can have false positives but never
+# false negatives.
+RELEVANT_RE = re.compile(
+    r"(?=.*?point)(?=.*?%s)|(?=.*?say)(?=.*?%s)|\s*standings" % (
+        _any_of(list(HOUSE_PREFIXES) + ["everybody"]),
+        _any_of(SPECIAL_SUBJECT)),
+    re.IGNORECASE | re.DOTALL)
+
+
+class ParsedMessage(object):
+    """Everything the bot reads from a message, from a single parse
+
+    `amount` is the number of points mentioned and `polarity` is 1 for an
+    award, -1 for a deduction and 0 otherwise.
+    """
+    __slots__ = ('text', 'amount', 'polarity', 'houses', 'subject', 'reason',
+                 'says')
+
+    def __init__(self, text, amount, polarity, houses, subject, reason, says):
+        self.text = text
+        self.amount = amount
+        self.polarity = polarity
+        self.houses = houses
+        self.subject = subject
+        self.reason = reason
+        self.says = says
+
+    @property
+    def points(self):
+        return self.amount * self.polarity
+
+    def __repr__(self):
+        return "ParsedMessage(points=%d, houses=%s, subject=%s)" % (
+            self.points, self.houses, self.subject)
+
+
+def parse(message) -> ParsedMessage:
+    """Tokenize `message` once and extract everything from it"""
+    tokens = message.lower().split()
+    text = ' '.join(tokens)
+    return ParsedMessage(
+        text=text,
+        amount=_amount(text),
+        polarity=_polarity(text),
+        houses=_houses(tokens),
+        subject=_subject(tokens),
+        reason=get_reason(message),
+        says=get_says(message),
+    )
+
+
+def maybe_relevant(message) -> bool:
+    """Quick check that `message` is worth parsing"""
+    return RELEVANT_RE.match(message) is not None
+
 
 def clean(message):
     """Standardize spacing and capitalization"""
@@ -14,54 +90,77 @@ def pluralized_points(num_points):
     return "%d points" % num_points
 
 
-def detect_points(message):
-    amounts = [amount for amount in re.split(r"\W", clean(message))
-               if amount.isdigit()]
-    if len(amounts) == 0 and 'one' in clean(message):
-        amounts = [1]
-    if len(amounts) >= 1:
-        return int(amounts[0]) * detect_point_polarity(message)
-    else:
-        return 0
+ORDINALS = ["first", "second", "third", "fourth", "fifth", "sixth",
+            "seventh", "eighth", "ninth", "tenth"]
 
 
-def detect_point_polarity(message):
-    """Discern whether this is a point awarding or deduction"""
-    message = clean(message)
-    if any(x in message for x in ["points to", "point to", "point for", "points for"]):
+def ordinal(n) -> str:
+    """The place `n` in words, e.g. "first" for 1"""
+    if n <= len(ORDINALS):
+        return ORDINALS[n - 1]
+    if 10 <= n % 100 <= 20:
+        return "%dth" % n
+    return "%d%s" % (n, {1: "st", 2: "nd", 3: "rd"}.get(n % 10, "th"))
+
+
+def _amount(text) -> int:
+    match = NUMBER_RE.search(text)
+    if match:
+        return int(match.group())
+    if 'one' in text:
+        return 1
+    return 0
+
+
+def _polarity(text) -> int:
+    if AWARD_RE.search(text):
         return 1
-    elif any(x in message for x in ["points from", "point from"]):
+    elif DEDUCTION_RE.search(text):
         return -1
     else:
         return 0
 
 
+def _houses(tokens) -> List[str]:
+    if 'everybody' in tokens:
+        return list(HOUSES)
+    # dict keeps the first mention of each house in order
+    return list(dict.fromkeys(
+        house for house in map(proper_name_for, tokens) if house))
+
+
+def _subject(tokens) -> Optional[str]:
+    # allow "mr. filch", "prof dumbledor, etc."
+    first_words = tokens[0:2]
+    for s in SPECIAL_SUBJECT.keys():
+        if s.lower() in first_words:
+            return s
+    return None
+
+
+def detect_points(message):
+    text = clean(message)
+    return _amount(text) * _polarity(text)
+
+
+def detect_point_polarity(message):
+    """Discern whether this is a point awarding or deduction"""
+    return _polarity(clean(message))
+
+
 def proper_name_for(house):
     """Forgive house misspelling"""
-    if "raven" in house:
-        return "Ravenclaw"
-    if "huff" in house:
-        return "Hufflepuff"
-    if "gryf" in house:
-        return "Gryffindor"
-    if "slyt" in house:
-        return "Slytherin"
+    for prefix, name in HOUSE_PREFIXES.items():
+        if prefix in house:
+            return name
 
 
 def get_houses_from(message):
-    tokenized = clean(message).split()
-    if 'everybody' in tokenized:
-        return HOUSES
-    return list(set(proper_name_for(w) for w in tokenized if proper_name_for(w)))
+    return _houses(clean(message).split())
 
 
 def get_subject_from(message):
-    for s in SPECIAL_SUBJECT.keys():
-        # allow "mr. filch", "prof dumbledor, etc."
-        for word in message.lower().split()[0:2]:
-            if s.lower() == word:
-                return s
-    return None
+    return _subject(message.lower().split())
 
 
 def get_reason(message) -> str:
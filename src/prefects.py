@@ -0,0 +1,121 @@
+"""
+Resolve prefect user names to Slack ids
+
+Looking every channel member up with users.info costs one API call per
+member, so instead the whole workspace is listed a page at a time with
+users.list. The name -> id map is cached on disk and refreshed in the
+background once it is older than its TTL.
+"""
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+import logs
+from consts import PREFECT_CACHE_PATH, PREFECT_CACHE_TTL, USERS_PAGE_SIZE
+
+log = logs.get_logger("prefects")
+
+
+def fetch_user_ids(sc, page_size=USERS_PAGE_SIZE) -> Dict[str, str]:
+    """Map of user name -> id for every active user in the workspace"""
+    user_ids = {}
+    cursor = None
+    while True:
+        kwargs = {"limit": page_size}
+        if cursor:
+            kwargs["cursor"] = cursor
+        response = sc.api_call("users.list", **kwargs)
+        if not response.get("ok"):
+            raise RuntimeError("users.list failed: %s" %
+                               response.get("error"))
+        for member in response.get("members", []):
+            if not member.get("deleted"):
+                user_ids[member["name"]] = member["id"]
+        cursor = response.get("response_metadata", {}).get("next_cursor")
+        if not cursor:
+            return user_ids
+
+
+class PrefectResolver(object):
+    """Prefect names -> ids, backed by an on-disk cache of all user ids
+
+    :param on_refresh: called with the new prefect ids after each
+        background refresh
+    """
+
+    def __init__(self, sc, prefect_names, cache_path=PREFECT_CACHE_PATH,
+                 ttl=PREFECT_CACHE_TTL,
+                 on_refresh: Optional[Callable[[List[str]], None]] = None):
+        self.sc = sc
+        self.prefect_names = list(prefect_names)
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.on_refresh = on_refresh
+        self.user_ids: Dict[str, str] = {}
+        self.fetched = 0.0
+        self._thread = None
+
+    def prefect_ids(self) -> List[str]:
+        return self.ids_for(self.prefect_names)
+
+    def ids_for(self, names) -> List[str]:
+        return [self.user_ids[name] for name in names
+                if name in self.user_ids]
+
+    def resolve(self) -> List[str]:
+        """Prefect ids, from the cache if there is one
+
+        Only a missing cache blocks on the Slack API; a stale one is used
+        while it is refreshed in the background.
+        """
+        if not self._read_cache():
+            self.refresh()
+        ids = self.prefect_ids()
+        log.info("Got prefect ids: %s", ids)
+        return ids
+
+    def refresh(self):
+        self.user_ids = fetch_user_ids(self.sc)
+        self.fetched = time.time()
+        self._write_cache()
+
+    def start(self):
+        """Keep refreshing the ids in the background every `ttl` seconds"""
+        self._thread = threading.Thread(target=self._run,
+                                        name="prefect-resolver", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(max(0, self.fetched + self.ttl - time.time()))
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning("Exception refreshing prefects: %s", e)
+                # Try again in a while rather than spinning
+                self.fetched = time.time() - self.ttl + min(self.ttl, 60)
+                continue
+            if self.on_refresh:
+                self.on_refresh(self.prefect_ids())
+
+    def _read_cache(self) -> bool:
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.user_ids = cache["users"]
+        self.fetched = cache["fetched"]
+        return True
+
+    def _write_cache(self):
+        directory = os.path.dirname(self.cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Worker processes share the cache
+        tmp = "%s.%d.tmp" % (self.cache_path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump({"fetched": self.fetched, "users": self.user_ids}, f)
+        os.replace(tmp, self.cache_path)
@@ -0,0 +1,59 @@
+"""
+Test bulk, cached prefect resolution against a fake Slack API
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from fakes import FakeSlackClient
+from prefects import PrefectResolver, fetch_user_ids
+
+USERS = {"U%04d" % i: "user%d" % i for i in range(450)}
+
+
+class TestPrefectResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_path = os.path.join(self.directory, "prefects.json")
+        self.sc = FakeSlackClient(users=dict(USERS))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def resolver(self, **kwargs):
+        return PrefectResolver(self.sc, ["user3", "user400", "nobody"],
+                               cache_path=self.cache_path, **kwargs)
+
+    def test_paginated_listing(self):
+        self.assertEqual(fetch_user_ids(self.sc, page_size=200)["user449"],
+                         "U0449")
+        self.assertEqual(len(self.sc.calls_to("users.list")), 3)
+
+    def test_resolve_uses_cache(self):
+        self.assertEqual(self.resolver().resolve(), ["U0003", "U0400"])
+        calls = len(self.sc.calls)
+        self.assertEqual(self.resolver().resolve(), ["U0003", "U0400"])
+        self.assertEqual(len(self.sc.calls), calls)
+        self.assertFalse(self.sc.calls_to("users.info"))
+
+    def test_stale_cache_refreshes_in_background(self):
+        self.resolver().resolve()
+        self.sc.users["U9999"] = "user3"
+        del self.sc.users["U0003"]
+
+        refreshed = []
+        resolver = self.resolver(ttl=0.05, on_refresh=refreshed.append)
+        # The stale ids are answered straight away
+        self.assertEqual(resolver.resolve(), ["U0003", "U0400"])
+        resolver.start()
+        deadline = time.time() + 2
+        while not refreshed and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(refreshed[0], ["U9999", "U0400"])
+
+
+if __name__ == "__main__":
+    unittest.main()
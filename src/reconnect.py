@@ -0,0 +1,100 @@
+"""
+Helpers for riding out a dropped RTM connection
+
+BotRuntime reconnects with jittered exponential Backoff, then fetches the
+messages it missed with `channel_history`. Messages can then arrive twice,
+from the history and from RTM, so the ones already handled are kept in a
+RecentSet.
+"""
+from collections import OrderedDict
+import random
+import threading
+import time
+from typing import Dict, List
+
+import logs
+from consts import (
+    CATCHUP_MAX_PAGES, CATCHUP_PAGE_SIZE, PROCESSED_TS_SIZE,
+    RTM_RECONNECT_BASE, RTM_RECONNECT_MAX
+)
+from outbox import retry_after
+
+log = logs.get_logger("reconnect")
+
+
+class Backoff(object):
+    """Delays that double from `base` up to `cap` seconds, each picked at
+    random below that, so reconnecting bots don't all retry at once"""
+
+    def __init__(self, base=RTM_RECONNECT_BASE, cap=RTM_RECONNECT_MAX,
+                 seed=None):
+        self.base = base
+        self.cap = cap
+        self.attempts = 0
+        self._random = random.Random(seed)
+
+    def next(self) -> float:
+        ceiling = min(self.cap, self.base * 2 ** self.attempts)
+        self.attempts += 1
+        return self._random.uniform(0, ceiling)
+
+    def reset(self):
+        self.attempts = 0
+
+
+class RecentSet(object):
+    """The last `size` keys added, least recently added dropped first"""
+
+    def __init__(self, size=PROCESSED_TS_SIZE):
+        self.size = size
+        self._keys = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key) -> bool:
+        """Add `key`, returning whether it's new"""
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys[key] = None
+            if len(self._keys) > self.size:
+                self._keys.popitem(last=False)
+            return True
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def channel_history(sc, channel, oldest, page_size=CATCHUP_PAGE_SIZE,
+                    max_pages=CATCHUP_MAX_PAGES) -> List[Dict]:
+    """Messages posted to `channel` after the Slack timestamp `oldest`,
+    oldest first, as RTM would have delivered them"""
+    messages = []
+    cursor = None
+    for _ in range(max_pages):
+        kwargs = dict(channel=channel, oldest=oldest, limit=page_size)
+        if cursor:
+            kwargs["cursor"] = cursor
+        response = sc.api_call("conversations.history", **kwargs)
+        wait = retry_after(response)
+        if wait is not None:
+            time.sleep(wait)
+            continue
+        if not response.get("ok"):
+            log.warning("Couldn't read %s history: %s", channel,
+                        response.get("error"))
+            break
+        messages.extend(response.get("messages", []))
+        cursor = (response.get("response_metadata") or {}).get(
+            "next_cursor")
+        if not response.get("has_more") or not cursor:
+            break
+    else:
+        log.warning("Gave up reading %s history after %d pages", channel,
+                    max_pages)
+    for message in messages:
+        message.setdefault("channel", channel)
+    # Pages come newest first
+    return sorted(messages, key=lambda m: float(m.get("ts", 0)))
@@ -0,0 +1,179 @@
+"""
+Test reconnecting to RTM and catching up on the messages missed meanwhile
+"""
+import asyncio
+import time
+import unittest
+
+import mock
+
+from consts import ADMIN_CHANNEL, CHANNEL
+from fakes import FakeSlackClient
+from main import BotRuntime, PointCounter
+import metrics
+from reconnect import Backoff, RecentSet, channel_history
+
+TEST_PREFECTS = ["prefect"]
+
+
+def award(n, channel=CHANNEL):
+    return {"type": "message", "channel": channel, "user": "prefect",
+            "text": "%d points to Gryffindor" % n,
+            # Unique, and after the runtime's last read
+            "ts": "%.6f" % (time.time() + n * 1e-6)}
+
+
+class TestBackoff(unittest.TestCase):
+
+    def test_jittered_doubling(self):
+        backoff = Backoff(base=1, cap=10, seed=0)
+        delays = [backoff.next() for _ in range(8)]
+        for attempt, delay in enumerate(delays):
+            self.assertLessEqual(delay, min(10, 2 ** attempt))
+            self.assertGreaterEqual(delay, 0)
+        self.assertGreater(len(set(delays)), 1)
+        backoff.reset()
+        self.assertLessEqual(backoff.next(), 1)
+
+
+class TestRecentSet(unittest.TestCase):
+
+    def test_forgets_oldest(self):
+        seen = RecentSet(3)
+        self.assertTrue(seen.add("a"))
+        self.assertFalse(seen.add("a"))
+        for key in "bcd":
+            seen.add(key)
+        self.assertEqual(len(seen), 3)
+        self.assertNotIn("a", seen)
+        self.assertIn("d", seen)
+
+
+class TestChannelHistory(unittest.TestCase):
+
+    def test_pages(self):
+        sc = FakeSlackClient()
+        events = [dict(award(1), ts="%d.000100" % (1000 + n))
+                  for n in range(45)]
+        for event in events:
+            sc.push(event)
+        messages = channel_history(sc, CHANNEL, "1004.000100", page_size=10)
+        self.assertEqual([m["ts"] for m in messages],
+                         [e["ts"] for e in events[5:]])
+        self.assertEqual(messages[0]["channel"], CHANNEL)
+        self.assertEqual(len(sc.calls_to("conversations.history")), 4)
+
+    @mock.patch("time.sleep")
+    def test_waits_when_rate_limited(self, sleep):
+        sc = mock.Mock()
+        sc.api_call.side_effect = [
+            {"ok": False, "error": "ratelimited",
+             "headers": {"Retry-After": "3"}},
+            {"ok": True, "messages": [{"ts": "2.0"}, {"ts": "1.0"}],
+             "has_more": False},
+        ]
+        messages = channel_history(sc, CHANNEL, "0")
+        sleep.assert_called_once_with(3.0)
+        self.assertEqual([m["ts"] for m in messages], ["1.0", "2.0"])
+
+
+class TestReconnect(unittest.TestCase):
+    """The fake RTM connection is killed mid-stream"""
+
+    def setUp(self):
+        self.sc = FakeSlackClient()
+        self.p = PointCounter(TEST_PREFECTS, reset=True)
+        self.p.store = None
+        self.runtime = BotRuntime(self.sc, self.p, tick=0.01,
+                                  poll_interval=0.01,
+                                  backoff=Backoff(0.01, 0.05))
+
+    def run_runtime(self, script):
+        async def run():
+            task = asyncio.get_running_loop().create_task(self.runtime.run())
+            await script()
+            self.runtime.stop()
+            await task
+
+        asyncio.run(run())
+
+    def test_catches_up_after_drop(self):
+        reconnects = metrics.RTM_RECONNECTS.value()
+
+        async def script():
+            for n in range(1, 6):
+                self.sc.push(award(n))
+            await asyncio.sleep(0.1)
+            self.assertEqual(self.p.points["Gryffindor"], 15)
+            self.sc.kill(refuse_connects=2)
+            # Only posted to the channel, not sent over RTM
+            for n in range(6, 11):
+                self.sc.push(award(n))
+            await asyncio.sleep(0.4)
+            self.assertTrue(self.sc.connected)
+            self.sc.push(award(11))
+            await asyncio.sleep(0.1)
+
+        self.run_runtime(script)
+        self.assertEqual(self.p.points["Gryffindor"], sum(range(1, 12)))
+        self.assertEqual(metrics.RTM_RECONNECTS.value(), reconnects + 1)
+        self.assertEqual(self.sc.refuse_connects, 0)
+
+    def test_failed_history_is_skipped(self):
+        api_call = self.sc.api_call
+
+        def failing_history(method, **kwargs):
+            if method == "conversations.history" and \
+                    kwargs["channel"] == ADMIN_CHANNEL:
+                raise ConnectionError("connection reset")
+            return api_call(method, **kwargs)
+
+        async def script():
+            self.sc.push(award(1))
+            await asyncio.sleep(0.05)
+            self.sc.kill()
+            self.sc.push(award(2))
+            await asyncio.sleep(0.2)
+            # Still reading after the failed catch up
+            self.sc.push(award(3))
+            await asyncio.sleep(0.1)
+
+        with mock.patch.object(self.sc, "api_call", failing_history):
+            self.run_runtime(script)
+        self.assertEqual(self.p.points["Gryffindor"], 6)
+
+    def test_redelivery_counts_once(self):
+        first = award(5)
+
+        async def script():
+            self.sc.push(first)
+            await asyncio.sleep(0.05)
+            self.sc.kill()
+            await asyncio.sleep(0.1)
+            # Delivered again over RTM after reconnecting
+            self.sc.push(first)
+            await asyncio.sleep(0.1)
+
+        self.run_runtime(script)
+        self.assertEqual(self.p.points["Gryffindor"], 5)
+        # Catching up read the channel from the last message handled
+        oldest = {kwargs["channel"]: kwargs["oldest"] for _, kwargs, _
+                  in self.sc.calls_to("conversations.history")}
+        self.assertEqual(oldest[CHANNEL], first["ts"])
+
+    def test_not_ready_while_disconnected(self):
+        async def script():
+            await asyncio.sleep(0.05)
+            self.assertTrue(self.runtime.ready())
+            self.sc.kill(refuse_connects=1000)
+            await asyncio.sleep(0.1)
+            self.assertFalse(self.runtime.ready())
+            self.sc.refuse_connects = 0
+            await asyncio.sleep(0.1)
+            self.assertTrue(self.runtime.ready())
+
+        self.run_runtime(script)
+
+
+if __name__ == "__main__":
+    unittest.main()
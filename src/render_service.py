@@ -0,0 +1,110 @@
+"""
+House cup rendering in a process pool
+
+Compositing and PNG encoding hold the GIL for tens of milliseconds, so the
+bot hands them to worker processes instead, each with its own preloaded
+CupRenderer. Renders come back as futures of PNG bytes.
+"""
+import asyncio
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+from typing import Dict
+
+import cup_image
+from consts import HOUSES, MAX_POINTS, RENDER_WORKERS
+import logs
+import metrics
+
+log = logs.get_logger("render_service")
+
+
+def _load_renderer():
+    cup_image.get_renderer()
+
+
+def _render(scores, max_points=MAX_POINTS):
+    return cup_image.get_renderer().png_for_scores(scores, max_points)
+
+
+class RenderService(object):
+    """Renders score snapshots in `workers` processes
+
+    Each render is submitted under a key, e.g. the channel it's for; a
+    newer snapshot for the same key cancels the older one if it hasn't
+    started yet. `submit` returns a concurrent.futures.Future, `render`
+    awaits one from an asyncio loop.
+    """
+
+    def __init__(self, workers=RENDER_WORKERS):
+        self.workers = workers
+        # Workers are started fresh rather than forked from a process that
+        # may be running other threads
+        self.pool = concurrent.futures.ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_renderer)
+        self.cancelled = 0
+        self._latest: Dict[object, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+
+    def warm(self, wait=True):
+        """Start every worker and render once in each, so none is cold
+
+        Without `wait`, the workers warm up in the background.
+        """
+        start = time.perf_counter()
+        blank = {house: 0 for house in HOUSES}
+        futures = [self.pool.submit(_render, blank)
+                   for _ in range(self.workers)]
+
+        def warmed(_):
+            if all(future.done() for future in futures):
+                log.info("Warmed %d render workers in %.3fs", self.workers,
+                         time.perf_counter() - start)
+
+        if not wait:
+            for future in futures:
+                future.add_done_callback(warmed)
+            return
+        for future in futures:
+            future.result()
+        warmed(None)
+
+    def submit(self, scores, key=None,
+               max_points=MAX_POINTS) -> concurrent.futures.Future:
+        """Render `scores`, scaled towards `max_points`, in the pool,
+        superseding the last render for `key`"""
+        with self._lock:
+            stale = self._latest.get(key)
+            if stale is not None and stale.cancel():
+                self.cancelled += 1
+            future = self._submit(scores, max_points)
+            self._latest[key] = future
+        return future
+
+    def _submit(self, scores, max_points=MAX_POINTS):
+        start = time.perf_counter()
+
+        def done(future):
+            if not future.cancelled():
+                metrics.STAGE_SECONDS.observe(time.perf_counter() - start,
+                                              stage="render_pool")
+
+        future = self.pool.submit(_render, dict(scores), max_points)
+        future.add_done_callback(done)
+        return future
+
+    async def render(self, scores, key=None, max_points=MAX_POINTS) -> bytes:
+        return await asyncio.wrap_future(
+            self.submit(scores, key, max_points))
+
+    def png_for_scores(self, scores, max_points=MAX_POINTS) -> bytes:
+        """Render and wait, like CupRenderer.png_for_scores"""
+        return self._submit(scores, max_points).result()
+
+    def shutdown(self):
+        with self._lock:
+            for future in self._latest.values():
+                future.cancel()
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,139 @@
+"""
+Test rendering in the process pool, and that it leaves the bot loop alone
+"""
+import asyncio
+import concurrent.futures
+import threading
+import time
+import unittest
+
+from consts import CHANNEL, HOUSES
+from cup_image import CupRenderer
+from fakes import FakeSlackClient
+from main import BotRuntime, PointCounter
+from render_service import RenderService
+from scoreboard import ScoreboardScheduler
+
+TEST_PREFECTS = ["prefect"]
+
+
+def scores(n):
+    return {house: (n * (i + 1)) % 1200 for i, house in enumerate(HOUSES)}
+
+
+class TestRenderService(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.service = RenderService(workers=2)
+        cls.service.warm()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.service.shutdown()
+
+    def test_renders_same_png(self):
+        self.assertEqual(self.service.png_for_scores(scores(7)),
+                         CupRenderer().png_for_scores(scores(7)))
+
+    def test_async_render(self):
+        png = asyncio.run(self.service.render(scores(3), key="c"))
+        self.assertTrue(png.startswith(b"\x89PNG"))
+
+    def test_newer_snapshot_cancels_stale_render(self):
+        # Keep both workers busy so the next renders stay queued
+        busy = [self.service.submit(scores(100 + n), key=n) for n in range(4)]
+        stale = self.service.submit(scores(1), key="c")
+        latest = self.service.submit(scores(2), key="c")
+        self.assertTrue(stale.cancelled())
+        with self.assertRaises(concurrent.futures.CancelledError):
+            stale.result()
+        self.assertTrue(latest.result().startswith(b"\x89PNG"))
+        for future in busy:
+            future.result()
+
+    def test_runtime_uploads_pool_renders(self):
+        sc = FakeSlackClient()
+        p = PointCounter(TEST_PREFECTS, reset=True)
+        p.store = None
+        runtime = BotRuntime(sc, p, scoreboard=ScoreboardScheduler(0, 0),
+                             tick=0.01, renderer=self.service)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            sc.push({"type": "message", "channel": CHANNEL,
+                     "user": "prefect", "text": "5 points to Slytherin"})
+            await asyncio.sleep(0.5)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        uploads = sc.calls_to("files.upload")
+        self.assertEqual(len(uploads), 1)
+        _, kwargs, _ = uploads[0]
+        self.assertEqual(kwargs["file"][1].getvalue(),
+                         CupRenderer().png_for_scores(p.points))
+
+
+class TestRenderingUnderLoad(unittest.TestCase):
+    """Renders in the pool don't slow down handling messages"""
+
+    def handling_latencies(self, render_load=None):
+        sc = FakeSlackClient()
+        p = PointCounter(TEST_PREFECTS, reset=True)
+        p.store = None
+        runtime = BotRuntime(sc, p, tick=0.01, poll_interval=0.002)
+        latencies = []
+        dispatch_batch = runtime.dispatch_batch
+
+        def timed_dispatch_batch(events):
+            dispatch_batch(events)
+            latencies.extend(time.perf_counter() - event["pushed"]
+                             for event in events if "pushed" in event)
+
+        runtime.dispatch_batch = timed_dispatch_batch
+        stop = threading.Event()
+        if render_load:
+            loader = threading.Thread(target=render_load, args=(stop,))
+            loader.start()
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            for _ in range(50):
+                sc.push({"type": "message", "channel": CHANNEL,
+                         "user": "prefect", "text": "1 point to Gryffindor",
+                         "pushed": time.perf_counter()})
+                await asyncio.sleep(0.01)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        stop.set()
+        if render_load:
+            loader.join()
+        self.assertEqual(len(latencies), 50)
+        return sorted(latencies)
+
+    def test_pool_rendering_keeps_latency(self):
+        service = RenderService(workers=2)
+        service.warm()
+        renders = []
+
+        def render_in_pool(stop):
+            n = 0
+            while not stop.is_set():
+                n += 1
+                renders.append(service.submit(scores(n)).result())
+
+        try:
+            baseline = self.handling_latencies()
+            loaded = self.handling_latencies(render_in_pool)
+        finally:
+            service.shutdown()
+        self.assertGreater(len(renders), 5)
+        p95 = int(len(baseline) * 0.95)
+        self.assertLess(loaded[p95], baseline[p95] + 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,197 @@
+"""
+Animated replay of the standings over a whole event
+
+    python replay.py standings.jsonl replay.gif
+
+takes one JSON object of house -> points per line and writes a looping GIF
+with a frame per line.
+
+Frames are never rendered from scratch. The overlay is composited onto
+empty and full bars once; each frame then pastes a precomputed column of
+each, and draws the scores. The bar scales come from
+calculate_scales_batch a batch of frames at a time, and frames are
+written to the GIF as they are made, so memory doesn't grow with the
+number of frames.
+"""
+import argparse
+import itertools
+import json
+import sys
+from typing import Dict, Iterable, Iterator
+
+from PIL import GifImagePlugin, Image, ImageDraw
+
+from consts import HOUSES, REPLAY_BATCH, REPLAY_FRAME_MS
+import cup_image
+from cup_image import BAR_COLORS, BAR_RECTS, BAR_SPACE
+
+# The overlay is partly transparent; GIFs can't be, so it goes over the
+# white Slack shows it on
+MATTE = "#ffffff"
+
+
+def fill_top(house, scale) -> int:
+    """First row of the filled part of a bar, as ImageDraw rounds it"""
+    return int(cup_image.bar_fill_rect(house, scale)[1])
+
+
+class ReplayRenderer(object):
+    """Makes replay frames, all sharing one palette, from a CupRenderer's
+    assets"""
+
+    def __init__(self, renderer=None, batch_size=REPLAY_BATCH):
+        renderer = renderer or cup_image.get_renderer()
+        self.font = renderer.font
+        self.batch_size = batch_size
+
+        empty = self._flatten(renderer.background, renderer.overlay)
+        full = renderer.background.copy()
+        draw = ImageDraw.Draw(full)
+        for house in HOUSES:
+            draw.rectangle(BAR_RECTS[house], fill=BAR_COLORS[house][1])
+        del draw
+        full = self._flatten(full, renderer.overlay)
+
+        # One palette covering both, and the score text
+        both = Image.new("RGB", (empty.width, empty.height * 2))
+        both.paste(empty, (0, 0))
+        both.paste(full, (0, empty.height))
+        self.palette = both.quantize(255, method=Image.Quantize.FASTOCTREE)
+        self.base = self._to_palette(empty)
+        full = self._to_palette(full)
+
+        # The bar columns, empty and full
+        self.empty_bars = {}
+        self.full_bars = {}
+        for house in HOUSES:
+            x1, y1, x2, y2 = BAR_RECTS[house]
+            box = (x1, y1, x2 + 1, y2 + 1)
+            self.empty_bars[house] = self.base.crop(box)
+            self.full_bars[house] = full.crop(box)
+
+        # Where the scores go, and the background to clear them with
+        ascent, descent = self.font.getmetrics()
+        self.text_boxes = {}
+        self.text_backgrounds = {}
+        for house in HOUSES:
+            x1, _, x2, y2 = BAR_RECTS[house]
+            box = (x1, y2 + 1, x2 + 1,
+                   min(y2 + BAR_SPACE + ascent + descent + 1,
+                       self.base.height))
+            self.text_boxes[house] = box
+            self.text_backgrounds[house] = self.base.crop(box)
+        self.text_colors = {
+            house: self._palette_index(BAR_COLORS[house][0])
+            for house in HOUSES}
+
+        # The part of the image frames can differ in
+        boxes = [(BAR_RECTS[h][0], BAR_RECTS[h][1]) + self.text_boxes[h][2:]
+                 for h in HOUSES]
+        self.region = (min(b[0] for b in boxes), min(b[1] for b in boxes),
+                       max(b[2] for b in boxes), max(b[3] for b in boxes))
+
+    @staticmethod
+    def _flatten(bars, overlay):
+        image = Image.alpha_composite(bars, overlay)
+        flat = Image.new("RGB", image.size, MATTE)
+        flat.paste(image, mask=image.getchannel("A"))
+        return flat
+
+    def _to_palette(self, image):
+        return image.quantize(palette=self.palette, dither=Image.Dither.NONE)
+
+    def _palette_index(self, color):
+        return self._to_palette(Image.new("RGB", (1, 1), color)).getpixel(
+            (0, 0))
+
+    def frames(self, standings: Iterable[Dict[str, int]]
+               ) -> Iterator[Image.Image]:
+        """A palette image per standings
+
+        The same image is updated and yielded for every frame, so copy it
+        to keep one.
+        """
+        frame = self.base.copy()
+        draw = ImageDraw.Draw(frame)
+        tops = {}
+        texts = {}
+        standings = iter(standings)
+        while True:
+            batch = list(itertools.islice(standings, self.batch_size))
+            if not batch:
+                return
+            scales = cup_image.calculate_scales_batch(batch)
+            for i, scores in enumerate(batch):
+                for house in HOUSES:
+                    self._draw_bar(frame, house,
+                                   fill_top(house, scales[house][i]), tops)
+                    self._draw_score(frame, draw, house,
+                                     "%d" % scores.get(house, 0), texts)
+                yield frame
+
+    def _draw_bar(self, frame, house, top, tops):
+        if tops.get(house) == top:
+            return
+        tops[house] = top
+        x1, y1, x2, y2 = BAR_RECTS[house]
+        if top > y1:
+            frame.paste(self.empty_bars[house].crop(
+                (0, 0, x2 + 1 - x1, top - y1)), (x1, y1))
+        frame.paste(self.full_bars[house].crop(
+            (0, top - y1, x2 + 1 - x1, y2 + 1 - y1)), (x1, top))
+
+    def _draw_score(self, frame, draw, house, text, texts):
+        if texts.get(house) == text:
+            return
+        texts[house] = text
+        box = self.text_boxes[house]
+        frame.paste(self.text_backgrounds[house], box[:2])
+        x1, _, x2, y2 = BAR_RECTS[house]
+        w, _ = self.font.getsize(text)
+        draw.text(((x1 + x2 - w) * 0.5, y2 + BAR_SPACE), text,
+                  fill=self.text_colors[house], font=self.font)
+
+    def write_gif(self, standings: Iterable[Dict[str, int]], fp,
+                  duration=REPLAY_FRAME_MS, loop=0) -> int:
+        """Write a GIF of `standings` to the binary file `fp`
+
+        The first frame is whole; the rest only cover the bars and scores.
+        Returns the number of frames.
+        """
+        count = 0
+        for frame in self.frames(standings):
+            if count == 0:
+                # Pillow's GIF writer buffers every frame of an animation,
+                # so write the header and frames with its encoder directly
+                for chunk in GifImagePlugin._get_global_header(
+                        frame, {"loop": loop, "duration": duration}):
+                    fp.write(chunk)
+                image, offset = frame, (0, 0)
+            else:
+                image, offset = frame.crop(self.region), self.region[:2]
+            GifImagePlugin._write_frame_data(
+                fp, image, offset, {"duration": duration})
+            count += 1
+        if count:
+            fp.write(b";")
+        return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("standings",
+                        help="JSON lines of house -> points, or - for stdin")
+    parser.add_argument("output", help="GIF file to write")
+    parser.add_argument("--duration", type=int, default=REPLAY_FRAME_MS,
+                        help="milliseconds per frame")
+    args = parser.parse_args()
+
+    source = sys.stdin if args.standings == "-" else open(args.standings)
+    with source, open(args.output, "wb") as out:
+        standings = (json.loads(line) for line in source if line.strip())
+        count = ReplayRenderer().write_gif(standings, out, args.duration)
+    print("Wrote %d frames to %s" % (count, args.output))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Test the season replay GIF against single frame renders
+"""
+import io
+import random
+import unittest
+
+from PIL import Image
+
+from consts import HOUSES
+import cup_image
+from replay import ReplayRenderer
+
+
+def season(frames, seed=0):
+    rnd = random.Random(seed)
+    points = {house: 0 for house in HOUSES}
+    standings = []
+    for _ in range(frames):
+        house = rnd.choice(HOUSES)
+        points[house] = max(0, points[house] + rnd.randint(-5, 60))
+        standings.append(dict(points))
+    return standings
+
+
+class TestReplay(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.renderer = cup_image.CupRenderer()
+        # A small batch so frames span several
+        cls.replay = ReplayRenderer(cls.renderer, batch_size=7)
+
+    def test_batch_scales_match(self):
+        frames = season(100, seed=1) + [{}, {HOUSES[0]: 5}]
+        batch = cup_image.calculate_scales_batch(frames)
+        for i, frame in enumerate(frames):
+            scales = cup_image.calculate_scales(frame)
+            for house in HOUSES:
+                self.assertEqual(batch[house][i], scales[house])
+
+    def test_gif(self):
+        standings = season(30)
+        out = io.BytesIO()
+        self.assertEqual(self.replay.write_gif(standings, out), 30)
+
+        out.seek(0)
+        gif = Image.open(out)
+        self.assertEqual(gif.n_frames, 30)
+        self.assertEqual(gif.size, self.renderer.overlay.size)
+        for i, scores in enumerate(standings):
+            gif.seek(i)
+            frame = gif.convert("RGB")
+            expected = self.replay._to_palette(self.replay._flatten(
+                self.renderer.render(scores),
+                Image.new("RGBA", frame.size))).convert("RGB")
+            for house in HOUSES:
+                x1, y1, x2, y2 = cup_image.BAR_RECTS[house]
+                box = (x1, y1, x2 + 1, y2 + 1)
+                self.assertEqual(frame.crop(box).tobytes(),
+                                 expected.crop(box).tobytes(),
+                                 "frame %d, %s" % (i, house))
+
+    def test_no_frames(self):
+        out = io.BytesIO()
+        self.assertEqual(self.replay.write_gif([], out), 0)
+        self.assertEqual(out.getvalue(), b"")
+
+
+if __name__ == "__main__":
+    unittest.main()
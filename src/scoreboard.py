@@ -0,0 +1,80 @@
+"""
+Decide when the house cup image should be posted
+
+A burst of awards should produce one image with the final totals rather than
+one image per loop iteration.
+"""
+import time
+from typing import Dict, Optional
+
+from consts import (
+    HOUSES, MAX_POINTS, SCOREBOARD_MIN_INTERVAL, SCOREBOARD_MAX_STALENESS
+)
+
+
+def scores_key(scores: Dict[str, int]):
+    return tuple(sorted(scores.items()))
+
+
+class ScoreboardScheduler(object):
+    """Debounce scoreboard refreshes
+
+    A change is posted once no new change has arrived for `min_interval`
+    seconds (trailing edge), or once it has been waiting `max_staleness`
+    seconds during a long burst. Posts are never closer together than
+    `min_interval`, and standings identical to the last posted image are
+    not posted again.
+
+    Snapshots have every one of `houses`, with 0 for those without points,
+    and are rendered scaled towards `max_points`.
+    """
+
+    def __init__(self, min_interval=SCOREBOARD_MIN_INTERVAL,
+                 max_staleness=SCOREBOARD_MAX_STALENESS, clock=time.time,
+                 houses=HOUSES, max_points=MAX_POINTS):
+        self.houses = list(houses)
+        self.max_points = max_points
+        self.min_interval = min_interval
+        self.max_staleness = max(max_staleness, min_interval)
+        self.clock = clock
+        self.pending_since: Optional[float] = None
+        self.last_change: Optional[float] = None
+        self.last_post: Optional[float] = None
+        self.last_posted_key = None
+
+    def note_change(self, now=None):
+        """Record that the scores changed and the image is out of date"""
+        now = self.clock() if now is None else now
+        if self.pending_since is None:
+            self.pending_since = now
+        self.last_change = now
+
+    def poll(self, scores: Dict[str, int], now=None
+             ) -> Optional[Dict[str, int]]:
+        """Return a snapshot of `scores` if the image should be posted now
+
+        The snapshot is recorded as posted, so the caller is expected to
+        render and upload it.
+        """
+        if self.pending_since is None:
+            return None
+        now = self.clock() if now is None else now
+
+        if self.last_post is not None and \
+                now - self.last_post < self.min_interval:
+            return None
+        quiet = now - self.last_change >= self.min_interval
+        stale = now - self.pending_since >= self.max_staleness
+        if not (quiet or stale):
+            return None
+
+        self.pending_since = None
+        # The renderer draws a bar for every house
+        scores = dict({house: 0 for house in self.houses}, **scores)
+        key = scores_key(scores)
+        if key == self.last_posted_key:
+            # e.g. an award and its reversal inside the same burst
+            return None
+        self.last_posted_key = key
+        self.last_post = now
+        return scores
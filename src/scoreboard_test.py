@@ -0,0 +1,78 @@
+"""
+Test that scoring bursts are coalesced into few scoreboard images
+"""
+import unittest
+
+from consts import HOUSES
+from cup_image import CupRenderer
+from main import PointCounter
+from scoreboard import ScoreboardScheduler
+
+TEST_PREFECTS = ["prefect"]
+
+
+class TestScoreboardScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.p = PointCounter(TEST_PREFECTS, reset=True)
+        self.posted = []
+
+    def run_loop(self, scheduler, awards, seconds):
+        """Drive one loop iteration per second like main.main
+
+        :param awards: dict of second -> list of award messages
+        """
+        for now in range(seconds):
+            for message in awards.get(now, []):
+                if self.p.award_points(message, TEST_PREFECTS[0]):
+                    scheduler.note_change(now)
+            scores = scheduler.poll(self.p.points, now)
+            if scores:
+                self.posted.append(scores)
+
+    def test_burst_is_one_image(self):
+        scheduler = ScoreboardScheduler(min_interval=5, max_staleness=60)
+        awards = {
+            t: ["%d points to %s" % (t + 1, HOUSES[t % len(HOUSES)])] * 3
+            for t in range(20)
+        }
+        self.run_loop(scheduler, awards, 40)
+        self.assertEqual(len(self.posted), 1)
+        self.assertEqual(self.posted[0], dict(self.p.points))
+
+    def test_snapshot_renders(self):
+        """Houses without points yet are posted, and drawn, as 0"""
+        scheduler = ScoreboardScheduler(min_interval=5, max_staleness=60)
+        self.run_loop(scheduler, {0: ["5 points to Gryffindor"]}, 10)
+        self.assertEqual(self.posted, [
+            {"Gryffindor": 5, "Ravenclaw": 0, "Hufflepuff": 0,
+             "Slytherin": 0}])
+        self.assertTrue(CupRenderer().png_for_scores(self.posted[0]))
+
+    def test_long_burst_bounded_staleness(self):
+        scheduler = ScoreboardScheduler(min_interval=5, max_staleness=10)
+        awards = {t: ["1 point to Gryffindor"] for t in range(40)}
+        self.run_loop(scheduler, awards, 60)
+        # One image roughly every 10s while the burst goes on, the last one
+        # having the final totals
+        self.assertEqual(len(self.posted), 4)
+        self.assertEqual(self.posted[-1]["Gryffindor"], 40)
+
+    def test_min_interval_between_posts(self):
+        scheduler = ScoreboardScheduler(min_interval=5, max_staleness=5)
+        awards = {0: ["1 point to Gryffindor"], 5: ["1 point to Ravenclaw"],
+                  6: ["1 point to Slytherin"]}
+        self.run_loop(scheduler, awards, 20)
+        self.assertEqual(len(self.posted), 2)
+
+    def test_reversal_is_not_posted(self):
+        scheduler = ScoreboardScheduler(min_interval=2, max_staleness=10)
+        awards = {0: ["5 points to Gryffindor"],
+                  10: ["5 points from Gryffindor"],
+                  11: ["5 points to Gryffindor"]}
+        self.run_loop(scheduler, awards, 20)
+        self.assertEqual(len(self.posted), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
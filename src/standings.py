@@ -0,0 +1,197 @@
+"""
+Standings and award history, indexed as awards come in
+
+PointCounter records every award here, so the ranking stays sorted and
+the totals per awarder, and per house and awarder for each hour and day,
+are always up to date. Announcers query it from the admin channel:
+
+    standings                        the ranking
+    standings awarders [day|week]    who awarded the most
+    standings <house> [day|week]     a house's points by hour, or by day
+
+Answers don't depend on how many awards there have been: the ranking is
+updated with a bisect, and a day or week is at most 24 or 7 buckets.
+"""
+import bisect
+from collections import Counter
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import points_util
+from consts import (
+    HOUSES, STANDINGS_DAYS, STANDINGS_HOURS, STANDINGS_TOP_AWARDERS
+)
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+# Bucket width and count making up each period that can be asked for
+PERIODS = {
+    "day": (HOUR, 24),
+    "week": (DAY, 7),
+}
+
+
+class Buckets(object):
+    """Points per house and per awarder in each `width` seconds, for the
+    last `keep` of them"""
+
+    def __init__(self, width, keep):
+        self.width = width
+        self.keep = keep
+        self.latest = None
+        # Bucket start -> (points per house, points per awarder)
+        self._buckets: Dict[int, Tuple[Counter, Counter]] = {}
+
+    def start_of(self, when) -> int:
+        return int(when // self.width) * self.width
+
+    def add(self, when, awarder, house, points):
+        start = self.start_of(when)
+        bucket = self._buckets.get(start)
+        if bucket is None:
+            if self.latest is not None and (
+                    start <= self.latest - self.keep * self.width):
+                # Older than anything kept
+                return
+            bucket = self._buckets[start] = (Counter(), Counter())
+            if self.latest is None or start > self.latest:
+                self.latest = start
+                self._expire()
+        bucket[0][house] += points
+        bucket[1][awarder] += points
+
+    def _expire(self):
+        oldest = self.latest - self.keep * self.width
+        for start in [s for s in self._buckets if s <= oldest]:
+            del self._buckets[start]
+
+    def window(self, count, now) -> Iterable[Tuple[int, Counter, Counter]]:
+        """The `count` buckets up to and including the one `now` is in,
+        oldest first, skipping empty ones"""
+        end = self.start_of(now)
+        for start in range(end - (count - 1) * self.width, end + 1,
+                           self.width):
+            bucket = self._buckets.get(start)
+            if bucket:
+                yield (start,) + bucket
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class StandingsIndex(object):
+    """Incrementally updated ranking and award totals"""
+
+    def __init__(self, points: Optional[Dict[str, int]] = None,
+                 houses=HOUSES, hours=STANDINGS_HOURS, days=STANDINGS_DAYS):
+        self.points: Dict[str, int] = {}
+        # (-points, house), so the leader comes first
+        self._ranked: List[Tuple[int, str]] = []
+        # Points given by each awarder, ever
+        self.awarders = Counter()
+        self.buckets = {HOUR: Buckets(HOUR, hours), DAY: Buckets(DAY, days)}
+        self.set_points(points or {}, houses)
+
+    def set_points(self, points: Dict[str, int], houses=()):
+        """Replace the standings, e.g. with the stored points"""
+        names = set(houses) | set(self.points) | set(points)
+        self.points = {house: points.get(house, 0) for house in names}
+        self._ranked = sorted((-p, house) for house, p in self.points.items())
+
+    def record(self, awarder, house, points, when=None):
+        """Index an award of `points`, as applied after clamping"""
+        when = time.time() if when is None else when
+        old = self.points.get(house)
+        if old is not None:
+            del self._ranked[bisect.bisect_left(self._ranked, (-old, house))]
+        self.points[house] = (old or 0) + points
+        bisect.insort(self._ranked, (-self.points[house], house))
+        self.awarders[awarder] += points
+        for buckets in self.buckets.values():
+            buckets.add(when, awarder, house, points)
+
+    def record_many(self, awards: Iterable[Tuple[str, str, int,
+                                                 Optional[float]]]):
+        """Index a batch of (awarder, house, points, when) awards, ranking
+        the houses once"""
+        now = time.time()
+        changed = Counter()
+        for awarder, house, points, when in awards:
+            changed[house] += points
+            self.awarders[awarder] += points
+            for buckets in self.buckets.values():
+                buckets.add(now if when is None else when, awarder, house,
+                            points)
+        if changed:
+            for house, points in changed.items():
+                self.points[house] = self.points.get(house, 0) + points
+            self._ranked = sorted((-p, house)
+                                  for house, p in self.points.items())
+
+    def standings(self) -> List[Tuple[str, int]]:
+        """Houses and their points, leader first"""
+        return [(house, -points) for points, house in self._ranked]
+
+    def rank(self, house) -> int:
+        """1 for the leader; houses with the same points share a rank"""
+        return 1 + bisect.bisect_left(self._ranked, (-self.points[house],))
+
+    def top_awarders(self, n=STANDINGS_TOP_AWARDERS, period=None, now=None
+                     ) -> List[Tuple[str, int]]:
+        """The `n` awarders who gave the most points, in the last `period`
+        or ever"""
+        if period is None:
+            return self.awarders.most_common(n)
+        totals = Counter()
+        for _, _, awarders in self._window(period, now):
+            totals.update(awarders)
+        return totals.most_common(n)
+
+    def history(self, house, period="day", now=None
+                ) -> List[Tuple[int, int]]:
+        """(bucket start, points) for each hour of the last day, or day of
+        the last week, that `house` got or lost points in"""
+        return [(start, houses[house])
+                for start, houses, _ in self._window(period, now)
+                if houses[house]]
+
+    def _window(self, period, now):
+        width, count = PERIODS[period]
+        return self.buckets[width].window(
+            count, time.time() if now is None else now)
+
+
+def status(index: StandingsIndex) -> List[str]:
+    """A line per house, leader first"""
+    return ["In %s place, %s with %d points" % (
+        points_util.ordinal(index.rank(house)), house, points)
+        for house, points in index.standings()]
+
+
+def is_query(text) -> bool:
+    """Whether the cleaned message text is a standings query"""
+    return text.split(" ", 1)[0] == "standings"
+
+
+def answer(index: StandingsIndex, text, now=None) -> str:
+    """The reply to the standings query in the cleaned message `text`"""
+    words = text.split()[1:]
+    period = next((w for w in words if w in PERIODS), None)
+    if "awarders" in words:
+        top = index.top_awarders(period=period, now=now)
+        title = "Top awarders %s:" % (
+            "this %s" % period if period else "so far")
+        return "\n".join([title] + [
+            "%d. <@%s> %s" % (i + 1, awarder,
+                              points_util.pluralized_points(points))
+            for i, (awarder, points) in enumerate(top)])
+    houses = [h for h in map(points_util.proper_name_for, words)
+              if h in index.points]
+    if houses:
+        period = period or "day"
+        fmt = "%H:00" if period == "day" else "%a %d %b"
+        return "\n".join(["%s by %s (UTC), last %s:" % (
+            houses[0], "hour" if period == "day" else "day", period)] + [
+            "%s  %+d" % (time.strftime(fmt, time.gmtime(start)), points)
+            for start, points in index.history(houses[0], period, now)])
+    return "\n".join(status(index))
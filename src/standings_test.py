@@ -0,0 +1,159 @@
+"""
+Test the standings index and the admin channel queries answered from it
+"""
+import asyncio
+import random
+import unittest
+
+from consts import ADMIN_CHANNEL, CHANNEL, HOUSES
+from fakes import FakeSlackClient
+from main import BotRuntime, PointCounter
+import points_util
+from standings import DAY, HOUR, StandingsIndex, answer
+
+TEST_PREFECTS = ["prefect"]
+# Monday 2 March 2020, 00:00 UTC
+MONDAY = 1583107200
+
+
+class TestStandingsIndex(unittest.TestCase):
+
+    def test_ranking_follows_awards(self):
+        rnd = random.Random(0)
+        houses = ["House%d" % i for i in range(7)]
+        index = StandingsIndex(houses=houses)
+        points = {house: 0 for house in houses}
+        for _ in range(2000):
+            house = rnd.choice(houses)
+            delta = rnd.randint(-10, 20)
+            points[house] += delta
+            index.record("someone", house, delta, MONDAY)
+            self.assertEqual(
+                [p for _, p in index.standings()],
+                sorted(points.values(), reverse=True))
+        for house in houses:
+            self.assertEqual(index.rank(house), 1 + sum(
+                p > points[house] for p in points.values()))
+
+    def test_ties_share_a_place(self):
+        index = StandingsIndex({"Gryffindor": 5, "Slytherin": 5,
+                                "Ravenclaw": 9}, houses=HOUSES)
+        self.assertEqual(index.rank("Ravenclaw"), 1)
+        self.assertEqual(index.rank("Gryffindor"), 2)
+        self.assertEqual(index.rank("Slytherin"), 2)
+        self.assertEqual(index.rank("Hufflepuff"), 4)
+
+    def test_set_points(self):
+        index = StandingsIndex(houses=HOUSES)
+        index.record("a", "Gryffindor", 5)
+        index.set_points({"Slytherin": 8, "Gryffindor": 5})
+        self.assertEqual(index.standings()[:2],
+                         [("Slytherin", 8), ("Gryffindor", 5)])
+        self.assertEqual(len(index.standings()), 4)
+
+    def test_history(self):
+        index = StandingsIndex(houses=HOUSES)
+        index.record("a", "Gryffindor", 5, MONDAY + 10)
+        index.record("b", "Gryffindor", 3, MONDAY + 20)
+        index.record("a", "Gryffindor", -2, MONDAY + 2 * HOUR)
+        index.record("a", "Slytherin", 4, MONDAY + 3 * DAY)
+        now = MONDAY + 3 * DAY + HOUR
+        self.assertEqual(index.history("Gryffindor", "day", now), [])
+        self.assertEqual(index.history("Gryffindor", "day", MONDAY + 3 * HOUR),
+                         [(MONDAY, 8), (MONDAY + 2 * HOUR, -2)])
+        self.assertEqual(index.history("Gryffindor", "week", now),
+                         [(MONDAY, 6)])
+        self.assertEqual(index.top_awarders(period="week", now=now),
+                         [("a", 7), ("b", 3)])
+        self.assertEqual(index.top_awarders(period="day", now=now),
+                         [("a", 4)])
+        self.assertEqual(index.top_awarders(1), [("a", 7)])
+
+    def test_old_buckets_expire(self):
+        index = StandingsIndex(houses=HOUSES, hours=24, days=7)
+        for hour in range(24 * 30):
+            index.record("a", "Gryffindor", 1, MONDAY + hour * HOUR)
+        self.assertEqual(len(index.buckets[HOUR]), 24)
+        self.assertEqual(len(index.buckets[DAY]), 7)
+        # Too late for the buckets, but still counted in the standings
+        index.record("a", "Gryffindor", 1, MONDAY)
+        self.assertEqual(len(index.buckets[DAY]), 7)
+        self.assertEqual(index.points["Gryffindor"], 24 * 30 + 1)
+
+
+class TestQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.index = StandingsIndex(houses=HOUSES)
+        self.index.record("U1", "Gryffindor", 10, MONDAY + 60)
+        self.index.record("U2", "Slytherin", 3, MONDAY + HOUR)
+
+    def ask(self, text):
+        return answer(self.index, points_util.clean(text), now=MONDAY + HOUR)
+
+    def test_standings(self):
+        self.assertEqual(self.ask("standings").split("\n"), [
+            "In first place, Gryffindor with 10 points",
+            "In second place, Slytherin with 3 points",
+            "In third place, Hufflepuff with 0 points",
+            "In third place, Ravenclaw with 0 points",
+        ])
+
+    def test_awarders(self):
+        self.assertEqual(self.ask("Standings awarders week"),
+                         "Top awarders this week:\n"
+                         "1. <@U1> 10 points\n2. <@U2> 3 points")
+
+    def test_house_by_hour(self):
+        self.assertEqual(self.ask("standings gryff"),
+                         "Gryffindor by hour (UTC), last day:\n00:00  +10")
+        self.assertEqual(self.ask("standings slytherin week"),
+                         "Slytherin by day (UTC), last week:\nMon 02 Mar  +3")
+
+
+class TestStandingsCommands(unittest.TestCase):
+    """Announcers ask for the standings in the admin channel"""
+
+    def setUp(self):
+        self.p = PointCounter(TEST_PREFECTS, announcers=TEST_PREFECTS,
+                              reset=True)
+        self.p.store = None
+
+    def test_print_status_with_more_houses(self):
+        houses = ["House%d" % i for i in range(6)]
+        p = PointCounter(TEST_PREFECTS, reset=True, houses=houses)
+        p.store = None
+        for i, house in enumerate(houses):
+            p._award_house(house, i + 1, "prefect", None, "", None)
+        lines = list(p.print_status())
+        self.assertEqual(lines[0], "In sixth place, House0 with 1 points")
+        self.assertEqual(lines[-1], "In first place, House5 with 6 points")
+
+    def test_query_in_admin_channel(self):
+        sc = FakeSlackClient()
+        runtime = BotRuntime(sc, self.p, tick=0.01)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            for channel, user, text in [
+                    (CHANNEL, "prefect", "5 points to Gryffindor"),
+                    (CHANNEL, "prefect", "standings"),
+                    (ADMIN_CHANNEL, "student", "standings"),
+                    (ADMIN_CHANNEL, "prefect", "standings")]:
+                sc.push({"type": "message", "channel": channel,
+                         "user": user, "text": text})
+            await asyncio.sleep(0.2)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        posts = [kwargs for _, kwargs, _ in sc.calls_to("chat.postMessage")]
+        self.assertEqual(len(posts), 2)
+        answers = [p for p in posts if p["channel"] == ADMIN_CHANNEL]
+        self.assertEqual(len(answers), 1)
+        self.assertTrue(answers[0]["text"].startswith(
+            "In first place, Gryffindor with 5 points"))
+
+
+if __name__ == "__main__":
+    unittest.main()
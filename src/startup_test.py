@@ -0,0 +1,122 @@
+"""
+Test starting up without waiting for the points bucket or slow imports
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from fakes import FakeBucket
+from ledger import PointsLedger
+from main import LOADING_REPLY, PointCounter
+from reconnect import Backoff
+
+TEST_PREFECTS = ["prefect"]
+TEST_POINTS = "points.json"
+
+
+class SlowBucket(FakeBucket):
+    """A FakeBucket whose reads wait until `release` is set"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.release = threading.Event()
+
+    def get_blob(self, name):
+        self.release.wait(5)
+        return super().get_blob(name)
+
+
+class TestBackgroundLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = SlowBucket()
+        self.bucket.objects[TEST_POINTS] = json.dumps([{"Gryffindor": 10}])
+        patches = [mock.patch("main.get_client"),
+                   mock.patch("main.get_bucket", return_value=self.bucket)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_awards_before_loaded(self):
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                         background_load=True)
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.assertEqual(p.points["Gryffindor"], 5)
+        self.assertFalse(p.store_loaded.is_set())
+        # Nothing is written over the stored points before they're read
+        self.assertIsNone(p.pending_update(force=True))
+
+        self.bucket.release.set()
+        self.assertTrue(p.store_loaded.wait(2))
+        self.assertEqual(p.points["Gryffindor"], 15)
+        self.assertIsNotNone(p.pending_update(force=True))
+
+    def test_deduction_before_loaded(self):
+        self.bucket.objects[TEST_POINTS] = json.dumps([{"Gryffindor": 100}])
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                         background_load=True)
+        messages = p.award_points("10 points from Gryffindor", "prefect")
+        # Not clamped against the points awarded since starting
+        self.assertFalse(any("already at zero" in m for m in messages))
+        self.assertEqual(list(p.print_status()), [LOADING_REPLY])
+
+        self.bucket.release.set()
+        self.assertTrue(p.store_loaded.wait(2))
+        self.assertEqual(p.points["Gryffindor"], 90)
+        p.post_update(force=True)
+        self.assertEqual(
+            json.loads(self.bucket.objects[TEST_POINTS])[0]["Gryffindor"], 90)
+        self.assertIn("In first place, Gryffindor with 90 points",
+                      list(p.print_status()))
+
+    def test_crash_after_loading(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                         ledger=PointsLedger(directory), background_load=True)
+        p.award_points("5 points to Gryffindor", "prefect")
+        self.bucket.release.set()
+        self.assertTrue(p.store_loaded.wait(2))
+        # Crash before the first write
+        p.write_update(None)
+
+        p2 = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                          ledger=PointsLedger(directory))
+        self.assertEqual(p2.points["Gryffindor"], 15)
+        p2.post_update()
+        self.assertEqual(
+            json.loads(self.bucket.objects[TEST_POINTS])[0]["Gryffindor"], 15)
+
+    def test_retries(self):
+        self.bucket.release.set()
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS)
+        p.store_loaded.clear()
+        self.bucket.fail_next = 2
+        p.load_store(Backoff(0.001, 0.01))
+        self.assertTrue(p.store_loaded.is_set())
+        self.assertEqual(p.points["Gryffindor"], 10)
+        self.assertEqual(self.bucket.failures, 2)
+
+
+class TestLazyImports(unittest.TestCase):
+
+    def test_import_main(self):
+        slow = ["PIL.Image", "google.cloud.storage", "slackclient"]
+        code = ("import json, sys; import main; "
+                "print(json.dumps([m for m in %r if m in sys.modules]))"
+                % (slow,))
+        output = subprocess.check_output(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(json.loads(output.decode().splitlines()[-1]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
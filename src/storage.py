@@ -0,0 +1,268 @@
+"""
+Points storage shared between bot instances
+
+Each instance only ever adds its own awards (deltas) to the stored points.
+A PointsStore is either the points file in a GCS bucket, shared by any
+number of instances, or a SQLite database for a single node.
+
+Bucket writes are conditional on the generation that was read, so a
+concurrent write from another instance makes ours fail, and we re-read,
+merge and try again instead of overwriting its awards. SQLite writes are
+transactions, which also keep every award for the award history.
+
+An update can land and still fail, e.g. when the response times out, so
+updates are numbered per writer and the store skips one it already has
+instead of adding its deltas twice.
+"""
+from collections import Counter
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from consts import (
+    MAX_POINTS, SQLITE_SYNCHRONOUS, STORE_MAX_ATTEMPTS, STORE_RETRY_DELAY
+)
+import metrics
+
+
+class ConflictError(Exception):
+    """Too many concurrent writers for a conditional write to get through"""
+
+
+def clamp(points, max_points=MAX_POINTS):
+    return min(max(points, 0), max_points)
+
+
+class PointsStore(object):
+    """Where the points are kept
+
+    Awards are (time, awarder, house, delta, clamped, ts) tuples, as
+    PointCounter records them.
+    """
+
+    def read(self) -> Tuple[Counter, int]:
+        """The stored points and their generation, 0 if nothing is stored
+        yet"""
+        raise NotImplementedError
+
+    def apply(self, deltas: Dict[str, int], base=None,
+              awards: Iterable[tuple] = (), writer=None, seq=0) -> Counter:
+        """Add `deltas` to the stored points, return the new stored points
+
+        Totals are kept within zero and `max_points` after merging. With
+        `base`, the deltas are added to that instead, replacing whatever is
+        stored. `awards` are the awards that make up the deltas, for stores
+        that keep them. With `writer`, an update whose `seq` isn't past the
+        last one stored for that writer changes nothing.
+        """
+        raise NotImplementedError
+
+
+class BucketStore(PointsStore):
+    """The points file in a GCS bucket
+
+    The file keeps the KPI dataset format: a JSON array holding one
+    house -> points object.
+    """
+
+    def __init__(self, bucket, points_file, client=None,
+                 max_points=MAX_POINTS, max_attempts=STORE_MAX_ATTEMPTS,
+                 retry_delay=STORE_RETRY_DELAY):
+        self.bucket = bucket
+        self.points_file = points_file
+        self.client = client
+        self.max_points = max_points
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.conflicts = 0
+
+    def read(self) -> Tuple[Counter, int]:
+        points, generation, _ = self._read()
+        return points, generation
+
+    def _read(self) -> Tuple[Counter, int, Dict[str, str]]:
+        """The points, their generation and the file's metadata"""
+        # Counted here, so the re-reads after a conflict in `apply` are too
+        try:
+            blob = self.bucket.get_blob(self.points_file)
+            if blob is None:
+                return Counter(), 0, {}
+            return Counter(json.loads(blob.download_as_string())[0]), \
+                blob.generation, dict(blob.metadata or {})
+        except Exception:
+            metrics.GCS_ERRORS.inc(operation="read")
+            raise
+
+    def apply(self, deltas: Dict[str, int], base=None,
+              awards: Iterable[tuple] = (), writer=None, seq=0) -> Counter:
+        # Only the totals are kept in the file, and each writer's last seq
+        # in its metadata
+        # Like the storage client, only loaded for the first flush
+        from google.api_core import exceptions
+        key = "seq-%s" % writer
+        for attempt in range(self.max_attempts):
+            points, generation, metadata = self._read()
+            if writer and base is None and int(metadata.get(key, 0)) >= seq:
+                return points
+            if base is not None:
+                points = Counter(base)
+            for house, delta in deltas.items():
+                points[house] = clamp(points[house] + delta, self.max_points)
+            if writer:
+                metadata[key] = str(seq)
+            blob = self.bucket.blob(self.points_file)
+            blob.metadata = metadata
+            try:
+                blob.upload_from_string(
+                    # NOTE: we post as array in format for KPI datatset
+                    json.dumps([points]), client=self.client,
+                    if_generation_match=generation)
+                return points
+            except exceptions.PreconditionFailed:
+                self.conflicts += 1
+                metrics.STORE_CONFLICTS.inc()
+                time.sleep(random.uniform(0, self.retry_delay * 2 ** attempt))
+        raise ConflictError("Gave up writing %s after %d attempts" % (
+            self.points_file, self.max_attempts))
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS points (
+    file TEXT NOT NULL,
+    house TEXT NOT NULL,
+    points INTEGER NOT NULL,
+    PRIMARY KEY (file, house)
+);
+CREATE TABLE IF NOT EXISTS generations (
+    file TEXT PRIMARY KEY,
+    generation INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS awards (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    time REAL NOT NULL,
+    awarder TEXT,
+    house TEXT NOT NULL,
+    delta INTEGER NOT NULL,
+    clamped INTEGER NOT NULL,
+    ts TEXT
+);
+CREATE TABLE IF NOT EXISTS applied (
+    file TEXT NOT NULL,
+    writer TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    PRIMARY KEY (file, writer)
+);
+"""
+
+
+class SqliteStore(PointsStore):
+    """The points in a local SQLite database, with every award
+
+    The database is in WAL mode, so reads don't wait for a write, and each
+    `apply` is one transaction: the totals and the awards behind them are
+    committed together. Several points files can share a database.
+    """
+
+    def __init__(self, path, points_file, max_points=MAX_POINTS,
+                 synchronous=SQLITE_SYNCHRONOUS):
+        self.path = path
+        self.points_file = points_file
+        self.max_points = max_points
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Transactions are begun explicitly, and the connection is shared
+        # by the writer and loader threads under the lock
+        self.db = sqlite3.connect(path, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=%s" % synchronous)
+        self.db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def read(self) -> Tuple[Counter, int]:
+        with self._lock:
+            return self._read()
+
+    def _read(self) -> Tuple[Counter, int]:
+        points = Counter(dict(self.db.execute(
+            "SELECT house, points FROM points WHERE file = ?",
+            (self.points_file,))))
+        row = self.db.execute(
+            "SELECT generation FROM generations WHERE file = ?",
+            (self.points_file,)).fetchone()
+        return points, row[0] if row else 0
+
+    def apply(self, deltas: Dict[str, int], base=None,
+              awards: Iterable[tuple] = (), writer=None, seq=0) -> Counter:
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                points, generation = self._read()
+                if writer and base is None and \
+                        self._applied(writer) >= seq:
+                    self.db.execute("COMMIT")
+                    return points
+                if base is not None:
+                    points = Counter(base)
+                    self.db.execute("DELETE FROM points WHERE file = ?",
+                                    (self.points_file,))
+                for house, delta in deltas.items():
+                    points[house] = clamp(points[house] + delta,
+                                          self.max_points)
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO points VALUES (?, ?, ?)",
+                    [(self.points_file, house, p)
+                     for house, p in points.items()])
+                self.db.execute(
+                    "INSERT OR REPLACE INTO generations VALUES (?, ?)",
+                    (self.points_file, generation + 1))
+                self.db.executemany(
+                    "INSERT INTO awards (file, time, awarder, house, delta,"
+                    " clamped, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(self.points_file,) + tuple(award) for award in awards])
+                if writer:
+                    self.db.execute(
+                        "INSERT OR REPLACE INTO applied VALUES (?, ?, ?)",
+                        (self.points_file, writer, seq))
+                self.db.execute("COMMIT")
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+        return points
+
+    def _applied(self, writer) -> int:
+        row = self.db.execute(
+            "SELECT seq FROM applied WHERE file = ? AND writer = ?",
+            (self.points_file, writer)).fetchone()
+        return row[0] if row else 0
+
+    def history(self, house=None, awarder=None, since=None,
+                limit=100) -> List[dict]:
+        """The latest awards, newest first, optionally only those to
+        `house`, by `awarder` or made after the time `since`"""
+        where = ["file = ?"]
+        args: List[object] = [self.points_file]
+        for column, value, op in (("house", house, "="),
+                                  ("awarder", awarder, "="),
+                                  ("time", since, ">")):
+            if value is not None:
+                where.append("%s %s ?" % (column, op))
+                args.append(value)
+        args.append(limit)
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT time, awarder, house, delta, clamped, ts FROM awards"
+                " WHERE %s ORDER BY time DESC, id DESC LIMIT ?"
+                % " AND ".join(where), args).fetchall()
+        return [dict(zip(("time", "awarder", "house", "delta", "clamped",
+                          "ts"), row)) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self.db.close()
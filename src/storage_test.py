@@ -0,0 +1,200 @@
+"""
+Test that instances sharing one points file never lose each other's awards
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import unittest
+
+import mock
+
+from consts import HOUSES, MAX_POINTS
+from fakes import FakeBucket
+from ledger import PointsLedger
+from main import PointCounter
+from persistence import PointsWriter
+from storage import BucketStore, SqliteStore
+
+TEST_PREFECTS = ["prefect"]
+TEST_POINTS = "points.json"
+
+
+def stored_points(bucket):
+    return json.loads(bucket.objects[TEST_POINTS])[0]
+
+
+class TestBucketStore(unittest.TestCase):
+
+    def setUp(self):
+        self.bucket = FakeBucket(latency=0.001)
+
+    def counter(self, ledger=None):
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS,
+                         ledger=ledger)
+        p.store = BucketStore(self.bucket, TEST_POINTS, retry_delay=0.001,
+                              max_attempts=100)
+        p.points, _ = p.store.read()
+        return p
+
+    def test_missing_file(self):
+        store = BucketStore(self.bucket, TEST_POINTS)
+        self.assertEqual(store.read(), ({}, 0))
+        store.apply({"Gryffindor": 5})
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 5})
+
+    def test_update_applied_once(self):
+        store = BucketStore(self.bucket, TEST_POINTS)
+        self.bucket.lose_next = 1
+        with self.assertRaises(Exception):
+            store.apply({"Gryffindor": 5}, writer="w1", seq=1)
+        # The retry finds the upload that timed out did land
+        self.assertEqual(store.apply({"Gryffindor": 5}, writer="w1", seq=1),
+                         {"Gryffindor": 5})
+        store.apply({"Gryffindor": 1}, writer="w1", seq=2)
+        store.apply({"Gryffindor": 1}, writer="w2", seq=1)
+        self.assertEqual(stored_points(self.bucket), {"Gryffindor": 7})
+
+    def test_conflicting_write_is_merged(self):
+        self.bucket.objects[TEST_POINTS] = json.dumps([{"Gryffindor": 10}])
+        p1 = self.counter()
+        p2 = self.counter()
+        p1.award_points("5 points to Gryffindor", "prefect")
+        p2.award_points("7 points to Gryffindor", "prefect")
+        p1.post_update()
+        p2.post_update()
+        self.assertEqual(stored_points(self.bucket)["Gryffindor"], 22)
+        # Each instance catches up with the other's awards when it writes
+        self.assertEqual(p2.points["Gryffindor"], 22)
+
+    def test_merge_clamps(self):
+        self.bucket.objects[TEST_POINTS] = json.dumps([{"Gryffindor": 10}])
+        p = self.counter()
+        p.award_points("50 points from Gryffindor", "prefect")
+        p.award_points("%d points to Slytherin" % (MAX_POINTS + 1), "prefect")
+        p.post_update()
+        self.assertEqual(stored_points(self.bucket),
+                         {"Gryffindor": 0, "Slytherin": MAX_POINTS})
+
+    def test_unwritten_ledger_tail_after_restart(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.bucket.objects[TEST_POINTS] = json.dumps([{"Gryffindor": 10}])
+        p = self.counter(PointsLedger(directory))
+        p.award_points("5 points to Gryffindor", "prefect")
+        # Crash after syncing the ledger, before writing to the bucket
+        p.write_update(None)
+
+        p2 = self.counter(PointsLedger(directory))
+        p2.post_update(force=True)
+        self.assertEqual(stored_points(self.bucket)["Gryffindor"], 15)
+
+    def test_many_writers(self):
+        writers = 16
+        awards = 25
+        expected = {house: 0 for house in HOUSES}
+        lock = threading.Lock()
+        counters = [self.counter() for _ in range(writers)]
+
+        def write(p, seed):
+            rng = random.Random(seed)
+            for i in range(awards):
+                house = rng.choice(HOUSES)
+                amount = rng.randint(1, 5)
+                p.award_points("%d points to %s" % (amount, house),
+                               "prefect")
+                with lock:
+                    expected[house] += amount
+                if rng.random() < 0.3:
+                    p.post_update()
+            p.post_update()
+
+        threads = [threading.Thread(target=write, args=(p, seed))
+                   for seed, p in enumerate(counters)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(stored_points(self.bucket), expected)
+        self.assertGreater(self.bucket.conflicts, 0)
+
+
+class TestSqliteStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, "points.db")
+
+    def store(self, points_file=TEST_POINTS):
+        store = SqliteStore(self.path, points_file)
+        self.addCleanup(store.close)
+        return store
+
+    def test_apply(self):
+        store = self.store()
+        self.assertEqual(store.read(), ({}, 0))
+        store.apply({"Gryffindor": 5, "Slytherin": -5})
+        store.apply({"Gryffindor": MAX_POINTS})
+        self.assertEqual(store.read(), (
+            {"Gryffindor": MAX_POINTS, "Slytherin": 0}, 2))
+        store.apply({"Ravenclaw": 3}, base={"Hufflepuff": 1})
+        # Kept across restarts, and apart from other points files
+        self.assertEqual(self.store().read()[0],
+                         {"Hufflepuff": 1, "Ravenclaw": 3})
+        self.assertEqual(self.store("other.json").read(), ({}, 0))
+
+    def test_update_applied_once(self):
+        store = self.store()
+        award = (100.0, "U1", "Gryffindor", 5, 0, "1.0")
+        for _ in range(2):
+            store.apply({"Gryffindor": 5}, awards=[award], writer="w1", seq=1)
+        self.assertEqual(store.read(), ({"Gryffindor": 5}, 1))
+        self.assertEqual(len(store.history()), 1)
+        store.apply({"Gryffindor": 1}, writer="w2", seq=1)
+        self.assertEqual(store.read()[0], {"Gryffindor": 6})
+
+    def test_history(self):
+        store = self.store()
+        store.apply({"Gryffindor": 7}, awards=[
+            (100.0, "U1", "Gryffindor", 5, 0, "1.0"),
+            (200.0, "U2", "Gryffindor", 2, 0, "2.0")])
+        store.apply({"Slytherin": 0}, awards=[
+            (300.0, "U1", "Slytherin", -4, 4, "3.0")])
+        self.assertEqual([a["ts"] for a in store.history()],
+                         ["3.0", "2.0", "1.0"])
+        self.assertEqual([a["ts"] for a in store.history(house="Gryffindor")],
+                         ["2.0", "1.0"])
+        self.assertEqual([a["ts"] for a in store.history(awarder="U1",
+                                                         since=150)],
+                         ["3.0"])
+        self.assertEqual(store.history(limit=1)[0]["clamped"], 4)
+
+    def test_counter(self):
+        """A PointCounter on SQLite persists every award, with no bucket"""
+        with mock.patch("main.POINTS_STORE", "sqlite"), \
+                mock.patch("main.SQLITE_PATH", self.path), \
+                mock.patch("main.get_client", side_effect=AssertionError):
+            p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS)
+            self.addCleanup(p.store.close)
+            writer = PointsWriter(p)
+            p.award_points("5 points to Gryffindor", "prefect", ts="1.0")
+            p.award_points("1 point from Slytherin", "prefect", ts="2.0")
+            p.award_points("3 points to Gryffindor and Slytherin", "U1")
+            self.assertTrue(writer.flush())
+            restarted = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS)
+            self.addCleanup(restarted.store.close)
+        self.assertEqual(restarted.points, {"Gryffindor": 6, "Slytherin": 1})
+        history = p.store.history()
+        self.assertEqual(len(history), 4)
+        self.assertEqual([a["house"] for a in p.store.history(awarder="U1")],
+                         ["Slytherin", "Gryffindor"])
+        self.assertEqual(p.store.history(house="Slytherin")[-1]["clamped"],
+                         1)
+
+
+if __name__ == "__main__":
+    unittest.main()
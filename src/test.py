@@ -1,12 +1,18 @@
 """
 Test point counter functionality
 """
+import asyncio
 import unittest
 
 from google.auth import exceptions
+import mock
+import requests
 
-from main import PointCounter, get_client
-from consts import ADMIN_CHANNEL
+from fakes import FakeSlackClient
+import points_util
+from main import BotRuntime, PointCounter, get_client, upload_scores_image
+from consts import ADMIN_CHANNEL, CHANNEL, HOUSES
+from traffic import TrafficGenerator
 
 TEST_PREFECTS = ["prefect"]
 TEST_POINTS = "dataset/hackathon.test.json"
@@ -134,5 +140,116 @@ class TestPointCounter(unittest.TestCase):
             print(m)
 
 
+class TestParse(unittest.TestCase):
+    """Parse every field out of a message at once"""
+
+    def test_parse_award(self):
+        parsed = points_util.parse(
+            "Dumbledore awards 5 points to ravenclaw and  HUFFLEPUFF "
+            "for being nice")
+        self.assertEqual(parsed.amount, 5)
+        self.assertEqual(parsed.polarity, 1)
+        self.assertEqual(parsed.points, 5)
+        self.assertEqual(parsed.houses, ["Ravenclaw", "Hufflepuff"])
+        self.assertEqual(parsed.subject, "dumbledore")
+        self.assertEqual(parsed.reason, "being nice")
+        self.assertEqual(parsed.says, "")
+
+    def test_parse_deduction(self):
+        parsed = points_util.parse("oNe point from Gryffindor, because of X")
+        self.assertEqual(parsed.points, -1)
+        self.assertEqual(parsed.houses, ["Gryffindor"])
+        self.assertIsNone(parsed.subject)
+        self.assertEqual(parsed.reason, "X")
+
+    def test_parse_numbers_inside_words(self):
+        parsed = points_util.parse("1s and 0s point to slytherin")
+        self.assertEqual(parsed.amount, 0)
+
+
+class TestPrefilter(unittest.TestCase):
+    """Rule out irrelevant messages before parsing them"""
+
+    def relevant(self, text):
+        parsed = points_util.parse(text)
+        return bool(("point" in parsed.text and parsed.houses) or
+                    ("say" in parsed.text and parsed.subject))
+
+    def test_never_rejects_relevant_messages(self):
+        texts = [event["text"] for event in TrafficGenerator(3).events(5000)
+                 if "text" in event]
+        texts += ["10 POINTS TO GRYFFINDOR", "Slythering loses a point",
+                  "points\nto\neverybody", "Dumbledore says hi",
+                  "prof snape SAYS hush"]
+        for text in texts:
+            if self.relevant(text):
+                self.assertTrue(points_util.maybe_relevant(text), text)
+
+    def test_rejects_chatter(self):
+        for text in ["", "lunch anyone?", "good point", "gryffindor rocks",
+                     "he says so"]:
+            self.assertFalse(points_util.maybe_relevant(text), text)
+        self.assertTrue(points_util.maybe_relevant("1 point to huff"))
+
+
+class TestUploadScoresImage(unittest.TestCase):
+    """Upload the house cup image through the slack client"""
+
+    def test_upload_from_memory(self):
+        sc = mock.Mock()
+        sc.api_call.return_value = {"ok": True}
+        upload_scores_image(sc, {h: 10 for h in HOUSES}, timeout=5)
+
+        args, kwargs = sc.api_call.call_args
+        self.assertEqual(args, ("files.upload",))
+        self.assertEqual(kwargs["timeout"], 5)
+        self.assertEqual(kwargs["channels"], CHANNEL)
+        self.assertNotIn("token", kwargs)
+        filename, fileobj, _ = kwargs["file"]
+        self.assertTrue(fileobj.read().startswith(b"\x89PNG"))
+
+    def test_upload_timeout(self):
+        sc = mock.Mock()
+        sc.api_call.side_effect = requests.exceptions.Timeout()
+        self.assertIsNone(upload_scores_image(sc, {h: 10 for h in HOUSES}))
+
+
+class TestBotRuntime(unittest.TestCase):
+    """Drive the asyncio runtime with a fake RTM feed"""
+
+    def run_runtime(self, sc, events):
+        p = PointCounter(TEST_PREFECTS, points_file=TEST_POINTS, reset=True)
+        p.store = None
+        runtime = BotRuntime(sc, p, tick=0.01)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            for event in events:
+                sc.push(event)
+            await asyncio.sleep(0.2)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        return p
+
+    def test_award_is_announced(self):
+        sc = FakeSlackClient()
+        p = self.run_runtime(sc, [
+            {"type": "presence_change", "user": "harry potter"},
+            {"type": "message", "channel": ADMIN_CHANNEL, "user": "prefect",
+             "text": "10 points to Gryffindor"},
+            {"type": "message", "channel": ADMIN_CHANNEL, "user": "prefect",
+             "text": "Dumbledore says ho ho ho"},
+        ])
+        self.assertEqual(p.points["Gryffindor"], 10)
+        posts = [kwargs for _, kwargs, _ in sc.calls_to("chat.postMessage")]
+        self.assertEqual(len(posts), 2)
+        self.assertIn("Gryffindor gets 10 points", posts[0]["text"])
+        self.assertEqual(posts[1]["text"], "ho ho ho")
+        self.assertEqual(posts[1]["username"], "Professor Dumbledore")
+        self.assertFalse(p.points_dirty)
+
+
 if __name__ == "__main__":
     unittest.main()
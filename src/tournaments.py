@@ -0,0 +1,104 @@
+"""
+Registry of the house cup tournaments one deployment runs
+
+Each tournament has its own channels, points file, houses, points cap and
+prefects. Events are routed to a tournament by channel, and tournaments are
+spread over worker processes by a stable hash of their name.
+"""
+import os
+import zlib
+from typing import Dict, Iterator, List, Optional
+
+from consts import (
+    CHANNEL, ADMIN_CHANNEL, POINTS_FILE, HOUSES, MAX_POINTS, PREFECTS,
+    LEDGER_DIR, TOURNAMENTS
+)
+
+DEFAULT_NAME = "default"
+
+
+class Tournament(object):
+    """One house cup competition, and the bot's state for it
+
+    `counter`, `scoreboard` and `writer` are filled in when the bot starts.
+    `houses` can be any of HOUSES, the only ones messages are parsed for
+    and the cup image has bars for.
+    """
+
+    def __init__(self, name, channel=CHANNEL, admin_channel=ADMIN_CHANNEL,
+                 points_file=POINTS_FILE, houses=HOUSES,
+                 max_points=MAX_POINTS, prefects=PREFECTS, ledger_dir=None):
+        unknown = [house for house in houses if house not in HOUSES]
+        if unknown:
+            raise ValueError("Tournament %s has unknown houses %s" % (
+                name, ", ".join(unknown)))
+        self.name = name
+        self.channel = channel
+        self.admin_channel = admin_channel
+        self.points_file = points_file
+        self.houses = list(houses)
+        self.max_points = max_points
+        self.prefect_names = list(prefects)
+        self.ledger_dir = ledger_dir
+        self.counter = None
+        self.scoreboard = None
+        self.writer = None
+
+    @property
+    def channels(self):
+        return {self.channel, self.admin_channel}
+
+    def shard(self, workers) -> int:
+        """Worker this tournament belongs to; the same in every process"""
+        return zlib.crc32(self.name.encode("utf-8")) % workers
+
+    def __repr__(self):
+        return "Tournament(%r, channel=%r)" % (self.name, self.channel)
+
+
+class TournamentRegistry(object):
+    """Tournaments indexed by the channels they listen on"""
+
+    def __init__(self, tournaments: List[Tournament]):
+        self.tournaments = list(tournaments)
+        self.by_channel: Dict[str, Tournament] = {}
+        for t in self.tournaments:
+            for channel in t.channels:
+                if channel in self.by_channel:
+                    raise ValueError("Channel %s is in both %s and %s" % (
+                        channel, self.by_channel[channel].name, t.name))
+                self.by_channel[channel] = t
+
+    def route(self, event) -> Optional[Tournament]:
+        """The tournament an RTM event belongs to, if any"""
+        return self.by_channel.get(event.get("channel"))
+
+    def partition(self, worker, workers) -> 'TournamentRegistry':
+        """The tournaments worker number `worker` out of `workers` runs"""
+        return TournamentRegistry(
+            [t for t in self.tournaments if t.shard(workers) == worker])
+
+    def __iter__(self) -> Iterator[Tournament]:
+        return iter(self.tournaments)
+
+    def __len__(self):
+        return len(self.tournaments)
+
+
+def load_tournaments(config=TOURNAMENTS) -> TournamentRegistry:
+    """Tournaments from the TOURNAMENTS setting
+
+    Without it the bot runs a single tournament from the CHANNEL,
+    ADMIN_CHANNEL and POINTS_FILE settings, with its ledger in LEDGER_DIR.
+    Otherwise each tournament's ledger is in its own directory in there.
+    """
+    if not config:
+        return TournamentRegistry(
+            [Tournament(DEFAULT_NAME, ledger_dir=LEDGER_DIR)])
+    tournaments = []
+    for settings in config:
+        settings = dict(settings)
+        settings.setdefault(
+            "ledger_dir", os.path.join(LEDGER_DIR, settings["name"]))
+        tournaments.append(Tournament(**settings))
+    return TournamentRegistry(tournaments)
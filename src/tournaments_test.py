@@ -0,0 +1,107 @@
+"""
+Test routing events to tournaments and sharding them over workers
+"""
+import asyncio
+import unittest
+
+from fakes import FakeSlackClient
+from main import BotRuntime, PointCounter
+from tournaments import Tournament, TournamentRegistry, load_tournaments
+
+TEST_PREFECTS = ["prefect"]
+
+
+def tournament(name, houses=("Gryffindor", "Slytherin"), max_points=100):
+    t = Tournament(name, channel=name, admin_channel=name + "-admin",
+                   points_file=name + ".json", houses=houses,
+                   max_points=max_points, prefects=TEST_PREFECTS)
+    t.counter = PointCounter(
+        TEST_PREFECTS, points_file=t.points_file, reset=True,
+        houses=t.houses, max_points=t.max_points,
+        admin_channel=t.admin_channel)
+    t.counter.store = None
+    return t
+
+
+def message(channel, text):
+    return {"type": "message", "channel": channel, "user": "prefect",
+            "text": text}
+
+
+class TestTournamentRegistry(unittest.TestCase):
+
+    def test_route_by_channel(self):
+        a, b = Tournament("a", "a", "a-admin"), Tournament("b", "b", "b-admin")
+        registry = TournamentRegistry([a, b])
+        self.assertIs(registry.route({"channel": "a-admin"}), a)
+        self.assertIs(registry.route({"channel": "b"}), b)
+        self.assertIsNone(registry.route({"channel": "elsewhere"}))
+        self.assertIsNone(registry.route({"type": "hello"}))
+
+    def test_shared_channel_is_an_error(self):
+        with self.assertRaises(ValueError):
+            TournamentRegistry([Tournament("a", "a", "admin"),
+                                Tournament("b", "b", "admin")])
+
+    def test_partition_covers_every_tournament_once(self):
+        registry = TournamentRegistry(
+            [Tournament(str(i), "c%d" % i, "a%d" % i) for i in range(20)])
+        shards = [registry.partition(w, 3) for w in range(3)]
+        names = sorted(t.name for shard in shards for t in shard)
+        self.assertEqual(names, sorted(t.name for t in registry))
+        self.assertEqual([t.name for t in registry.partition(1, 3)],
+                         [t.name for t in shards[1]])
+
+    def test_default_tournament(self):
+        registry = load_tournaments([])
+        self.assertEqual(len(registry), 1)
+        self.assertIsNotNone(list(registry)[0].ledger_dir)
+
+    def test_unknown_house_is_an_error(self):
+        with self.assertRaises(ValueError):
+            load_tournaments([{"name": "a", "channel": "a",
+                               "houses": ["Gryffindor", "Durmstrang"]}])
+
+
+class TestTournamentCounters(unittest.TestCase):
+
+    def test_cap_and_houses_are_per_tournament(self):
+        t = tournament("small", max_points=50)
+        t.counter.award_points("80 points to Gryffindor and Hufflepuff",
+                               "prefect")
+        self.assertEqual(t.counter.points["Gryffindor"], 50)
+        self.assertEqual(t.counter.points["Hufflepuff"], 0)
+
+    def test_scoreboard_scaled_to_cap(self):
+        t = tournament("small", max_points=50)
+        BotRuntime(FakeSlackClient(), tournaments=TournamentRegistry([t]))
+        self.assertEqual(t.scoreboard.max_points, 50)
+        self.assertEqual(sorted(t.scoreboard.houses),
+                         ["Gryffindor", "Slytherin"])
+
+    def test_runtime_routes_to_tournaments(self):
+        sc = FakeSlackClient()
+        a, b = tournament("a"), tournament("b")
+        runtime = BotRuntime(sc, tournaments=TournamentRegistry([a, b]),
+                             tick=0.01)
+
+        async def run():
+            task = asyncio.get_running_loop().create_task(runtime.run())
+            sc.push(message("a", "10 points to Gryffindor"))
+            sc.push(message("b-admin", "5 points to Slytherin"))
+            sc.push(message("elsewhere", "7 points to Slytherin"))
+            await asyncio.sleep(0.2)
+            runtime.stop()
+            await task
+
+        asyncio.run(run())
+        self.assertEqual(a.counter.points["Gryffindor"], 10)
+        self.assertEqual(a.counter.points["Slytherin"], 0)
+        self.assertEqual(b.counter.points["Slytherin"], 5)
+        posts = [kwargs["channel"]
+                 for _, kwargs, _ in sc.calls_to("chat.postMessage")]
+        self.assertEqual(posts, ["a", "b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""
+Seeded generator of realistic Slack channel traffic for benchmarks
+
+Most of a busy channel is chatter the bot ignores. Mixed in are point
+awards, deductions, prefect "Dumbledore says" lines, long messages full of
+mentions and punctuation, and the typing/presence events RTM also sends.
+"""
+import random
+from typing import Dict, List
+
+from consts import ADMIN_CHANNEL, CHANNEL, HOUSES, SPECIAL_SUBJECT
+
+# Relative weights of each kind of event
+MIX = {
+    "chatter": 60,
+    "other_event": 20,
+    "award": 10,
+    "deduction": 3,
+    "says": 2,
+    "long": 5,
+}
+
+CHATTER = [
+    "lunch is at noon, anyone want pizza?",
+    "the deploy is green :tada:",
+    "can someone review my PR? it's only 3 files",
+    "who broke the build again",
+    "I'll be in the big room if anyone needs me",
+    "lol",
+    "+1",
+    "going to grab coffee, back in 10",
+    "does anybody know where the projector remote went?",
+    "that demo was amazing, nice work team",
+]
+REASONS = [
+    "fixing the flaky test",
+    "an amazing demo",
+    "bringing snacks",
+    "finding the bug in <@U2ABCDEF1>'s code",
+    "staying late to help",
+]
+HOUSE_SPELLINGS = {
+    "Gryffindor": ["Gryffindor", "gryffindor", "GRYFFINDOR", "gryf"],
+    "Ravenclaw": ["Ravenclaw", "ravenclaw", "Ravenclaws", "raven"],
+    "Hufflepuff": ["Hufflepuff", "hufflepuff", "huffle", "Huffle Puff"],
+    "Slytherin": ["Slytherin", "slytherin", "slyth", "slytherins"],
+}
+
+
+class TrafficGenerator(object):
+    """Generate RTM events with a fixed seed, so every run sees the same
+    corpus"""
+
+    def __init__(self, seed=0, users=200, prefects=("prefect",),
+                 mix=None):
+        self.random = random.Random(seed)
+        self.users = ["U%08d" % i for i in range(users)]
+        self.prefects = list(prefects)
+        self.mix = mix or MIX
+        self.ts = 1500000000.0
+
+    def events(self, count) -> List[Dict]:
+        kinds = self.random.choices(
+            list(self.mix), weights=list(self.mix.values()), k=count)
+        return [getattr(self, kind)() for kind in kinds]
+
+    def message(self, text, user=None, channel=CHANNEL):
+        self.ts += self.random.random()
+        return {
+            "type": "message",
+            "channel": channel,
+            "user": user or self.random.choice(self.users),
+            "text": text,
+            "ts": "%.6f" % self.ts,
+        }
+
+    def house(self):
+        return self.random.choice(
+            HOUSE_SPELLINGS[self.random.choice(HOUSES)])
+
+    def mention(self):
+        return "<@%s>" % self.random.choice(self.users)
+
+    def chatter(self):
+        return self.message(self.random.choice(CHATTER))
+
+    def other_event(self):
+        return {
+            "type": self.random.choice(["user_typing", "presence_change",
+                                        "reaction_added"]),
+            "channel": CHANNEL,
+            "user": self.random.choice(self.users),
+        }
+
+    def award(self):
+        amount = self.random.choice(["1", "one", "5", "10", "50"])
+        points = "point" if amount in ("1", "one") else "points"
+        text = "%s %s to %s" % (amount, points, self.house())
+        if self.random.random() < 0.5:
+            text += " for %s" % self.random.choice(REASONS)
+        user = self.random.choice(self.prefects + self.users[:20])
+        return self.message(text, user=user)
+
+    def deduction(self):
+        amount = self.random.choice(["1", "one", "10"])
+        points = "point" if amount in ("1", "one") else "points"
+        text = "%s %s from %s because of %s" % (
+            amount, points, self.house(), self.random.choice(REASONS))
+        if self.random.random() < 0.3:
+            subject = self.random.choice(list(SPECIAL_SUBJECT))
+            text = "%s takes away %s" % (subject.capitalize(), text)
+        return self.message(text, user=self.random.choice(self.prefects))
+
+    def says(self):
+        subject = self.random.choice(list(SPECIAL_SUBJECT))
+        return self.message(
+            "%s says %s" % (subject.capitalize(),
+                            self.random.choice(CHATTER)),
+            user=self.random.choice(self.prefects), channel=ADMIN_CHANNEL)
+
+    def long(self):
+        words = []
+        for _ in range(self.random.randint(20, 60)):
+            roll = self.random.random()
+            if roll < 0.1:
+                words.append(self.mention())
+            elif roll < 0.15:
+                words.append("...")
+            elif roll < 0.2:
+                words.append(str(self.random.randint(0, 2000)))
+            else:
+                words.append(self.random.choice(
+                    self.random.choice(CHATTER).split()))
+        if self.random.random() < 0.3:
+            words[self.random.randrange(len(words))] = \
+                "....1 point to %s for %s" % (self.house(), self.mention())
+        return self.message(" ".join(words))